@@ -1,13 +1,20 @@
+import copy
 import os
+import sys
 import datetime
 import reframe as rfm
 import reframe.utility.typecheck as typ
 import reframe.utility.sanity as sn
 import reframe.utility.udeps as udeps
-from reframe.core.backends import getlauncher
 
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
+from powercap import abtest, clusters, decomposition, launchers
+from powercap.mixins import (ab_comparison, cached_build, cached_fetch, cached_image, cap_sweep,
+                             domain_decomposition, field_regression, log_scan, node_local_inputs,
+                             perf_baselines)
 
-class fetch_fall3d(rfm.RunOnlyRegressionTest):  
+
+class fetch_fall3d(rfm.RunOnlyRegressionTest, cached_fetch):  
     descr = 'Fetch FALL3D'
     
     maintainers = ['mredenti']
@@ -24,9 +31,17 @@ class fetch_fall3d(rfm.RunOnlyRegressionTest):
                 ]
     postrun_cmds= [f'tar xzf {tarball}']
     
+    # Expected SHA-256 of the tarball, recorded on first download if empty
+    tarball_sha256 = variable(str, value='')
+    
     # Run fetch step on login node
     local = True
     
+    def artifact_args(self):
+        url = f'https://gitlab.com/fall3d-suite/fall3d/-/archive/{self.version}/{self.tarball}'
+        sha256 = [f'--sha256 {self.tarball_sha256}'] if self.tarball_sha256 else []
+        return ['url', url, self.tarball, *sha256]
+    
     @sanity_function
     def validate_download(self):
         return sn.assert_eq(self.job.exitcode, 0)
@@ -35,7 +50,7 @@ class fetch_fall3d(rfm.RunOnlyRegressionTest):
 # Fall3d CMake build logic
 # ========================================================
 @rfm.simple_test
-class build_fall3d(rfm.CompileOnlyRegressionTest):
+class build_fall3d(rfm.CompileOnlyRegressionTest, cached_build):
     descr = 'Build FALL3D'
     
     build_system = 'CustomBuild' # switch back to 'CMake' when FR https://github.com/reframe-hpc/reframe/issues/3359 integrated
@@ -55,11 +70,18 @@ class build_fall3d(rfm.CompileOnlyRegressionTest):
     build_locally = False
     build_time_limit='600'
     
+    build_cache_paths = ['build/bin']
+    
+    def build_cache_source(self):
+        return self.fall3d_source.tarball
+    
     @run_before('compile')
     def prepare_build(self):
         
         configuredir = os.path.join(self.fall3d_source.stagedir, self.fall3d_source.srcdir)
         installdir = os.path.join(self.stagedir, 'install')
+        processor = self.current_partition.processor
+        device = self.current_partition.devices[0]
         self.build_system.builddir = 'build'
         # remote reframe default compiler flags
         self.build_system.flags_from_environ = False
@@ -75,7 +97,7 @@ class build_fall3d(rfm.CompileOnlyRegressionTest):
             ' -D WITH-ACC=YES' 
             ' -D WITH-R4=NO'
             # -fast: Common optimizations; includes -O2 -Munroll=c:1 -Mlre -Mautoinline 
-            f' -D CUSTOM_COMPILER_FLAGS="-fast -tp={self.current_partition.processor.arch} -gpu={self.current_partition.devices[0].arch}"' 
+            f' -D CUSTOM_COMPILER_FLAGS="-fast -tp={clusters.nvhpc_tp(processor.arch)} {clusters.nvhpc_gpu(device.arch)}"' 
             f' -D CMAKE_INSTALL_PREFIX={installdir}'
             f' -S {configuredir}',
             'cmake --build ./build --parallel 8'
@@ -84,13 +106,18 @@ class build_fall3d(rfm.CompileOnlyRegressionTest):
 
     @sanity_function
     def validate_build(self):
+        if self.build_cache_hit:
+            return self.assert_build_restored()
+        
         # Check that the output contains the string 'Built target Fall3d.x'
         return sn.assert_found(r'Built target Fall3d\.x', self.stdout)
     
 # ========================================================
 # Fall3d Base Test Class with Conditional Dependencies
 # ========================================================
-class fall3d_base_test(rfm.RunOnlyRegressionTest):
+class fall3d_base_test(rfm.RunOnlyRegressionTest, cap_sweep, perf_baselines,
+                       domain_decomposition, log_scan, field_regression, node_local_inputs,
+                       cached_image, ab_comparison):
     """Base class of Fall3d runtime tests"""
     
     fall3d_binaries = None # fixture(build_fall3d, scope='environment')
@@ -98,38 +125,63 @@ class fall3d_base_test(rfm.RunOnlyRegressionTest):
     valid_systems = ['leonardo:booster', 'thea:gh']
     valid_prog_environs = ['*'] 
 
-    execution_mode = variable(typ.Str[r'baremetal|container']) 
+    # ab: interleaved trials of the ab_arms, e.g. baremetal and container:<image>
+    execution_mode = variable(typ.Str[r'baremetal|container|ab']) 
     image = variable(str) 
+    image_recipe = os.path.join(os.path.dirname(__file__), 'hpccm', 'bb_recipe.py')
     
     num_tasks = None
     num_tasks_per_node = None
     exclusive_access = True
     
+    def runs_baremetal(self):
+        return (self.execution_mode == 'baremetal' or
+                self.execution_mode == 'ab' and 'baremetal' in self.ab_modes())
+    
     @run_after('init')
     def configure_dependencies(self):
         '''Conditionally add dependencies based on the programming environment.'''
-        if self.execution_mode == 'baremetal':
+        if self.runs_baremetal():
             self.depends_on('build_fall3d', udeps.by_env)
+        
+        if self.execution_mode == 'ab':
+            # Logs and fields are the ones of the last trial of each arm
+            self.perf_variables.pop('elapsed_time', None)
             
     @require_deps
     def get_dependencies(self, build_fall3d):
-        if self.execution_mode == 'baremetal':
+        if self.runs_baremetal():
             self.fall3d_binaries = build_fall3d(part='*', environ='*')
     
+    @run_after('setup')
+    def set_resources(self): # find a better name
+        accelerator = self.current_partition.devices
+        self.num_tasks = self.num_gpus
+        self.num_gpus_per_node =  self.num_gpus if self.num_gpus < accelerator[0].num_devices else accelerator[0].num_devices
+        self.num_tasks_per_node = self.num_gpus_per_node
+        self.num_cpus_per_task = self.current_partition.processor.num_cpus // self.num_tasks_per_node
+        # --nodes is set automatically as job.num_tasks // num_tasks_per_node
+        self.extra_resources = {
+            "gpu": {"num_gpus_per_node": f"{self.num_gpus_per_node}"},
+        }
+    
+    # After set_resources, whose ranks per node weigh the decomposition
     @run_after('setup')
     def prepare_run(self):
-        #The total number of processors is NPX × NPY × NPY × SIZE and should be equivalent to the argument np
-        npx=npy=npz=1
-        while npx*npy*npz != self.num_gpus:
-            # Find which dimension is smallest and increment it
-            if npx <= npy:
-                npx *= 2
-            else:
-                npy *= 2
+        #The total number of processors is NPX × NPY × NPZ × SIZE and should be equivalent to the argument np
+        inp = os.path.join(os.path.dirname(__file__), self.sourcesdir, f'{self.test_prefix}.inp')
+        if os.path.exists(inp):
+            grid = decomposition.read_fall3d_grid(inp)
+        else:
+            grid = decomposition.unknown_grid(self.num_gpus, 3)
+
+        dims = self.decompose('fall3d', grid, self.num_gpus, decomposition.FALL3D_DIMS)
+        self.executable_opts += [str(d) for d in dims]
         
-        self.executable_opts += [str(npx), str(npy), str(npz)]
+        # The meteorological data is read by every rank, read it from node-local copies
+        self.prerun_cmds = self.input_staging_cmds() + self.prerun_cmds
         
-        if self.execution_mode == 'baremetal':
+        if self.runs_baremetal():
             
             self.executable = os.path.join(
                 self.fall3d_binaries.stagedir,
@@ -137,83 +189,114 @@ class fall3d_base_test(rfm.RunOnlyRegressionTest):
                 'bin', 'Fall3d.x'
             )
         
-        elif self.execution_mode == 'container':
+        if self.execution_mode == 'container':
             self.modules = ['openmpi']
-            self.container_platform.image = self.image
-            #This does not have any effect for the Singularity container platform.
-            #self.container_platform.pull_image = False
-            # adds --nv flag to singularity exec
-            self.container_platform.with_cuda = True # if self.container_platform=='Singularity'
-            # https://reframe-hpc.readthedocs.io/en/stable/regression_test_api.html#reframe.core.containers.ContainerPlatform.mount_points
-            input_dir = os.path.join(os.path.dirname(__file__), self.sourcesdir) # handle symlinks of read only input files
-            self.container_platform.mount_points = [
-                (input_dir, input_dir) 
-            ]
-            # Additional options to be passed to the container runtime when executed
-            self.container_platform.options = ['--no-home']
-            # command issued by singularity exec
-            self.container_platform.command = f"Fall3d.x {' '.join(map(str, self.executable_opts))}"
-            # workdir: The working directory of ReFrame inside the container. Default is rfm_workdir
-        
-    @run_after('setup')
-    def set_resources(self): # find a better name
-        accelerator = self.current_partition.devices
-        self.num_tasks = self.num_gpus
-        self.num_gpus_per_node =  self.num_gpus if self.num_gpus < accelerator[0].num_devices else accelerator[0].num_devices
-        self.num_tasks_per_node = self.num_gpus_per_node
-        self.num_cpus_per_task = self.current_partition.processor.num_cpus // self.num_tasks_per_node
-        # --nodes is set automatically as job.num_tasks // num_tasks_per_node
-        self.extra_resources = {
-            "gpu": {"num_gpus_per_node": f"{self.num_gpus_per_node}"},
-        }
+            self.configure_container(self.container_platform, self.image)
+            self.prerun_cmds = self.prerun_cmds + self.container_image_cmds()
     
+    def configure_container(self, platform, image):
+        '''Set up `platform` to run Fall3d.x from `image`.'''
+        platform.image = self.cached_image_path(image)
+        #This does not have any effect for the Singularity container platform.
+        #platform.pull_image = False
+        # adds --nv flag to singularity exec
+        platform.with_cuda = True # if self.container_platform=='Singularity'
+        # https://reframe-hpc.readthedocs.io/en/stable/regression_test_api.html#reframe.core.containers.ContainerPlatform.mount_points
+        input_dir = os.path.join(os.path.dirname(__file__), self.sourcesdir) # handle symlinks of read only input files
+        platform.mount_points = [
+            (input_dir, input_dir) 
+        ] + self.staging_mount_points()
+        # Additional options to be passed to the container runtime when executed
+        platform.options = ['--no-home']
+        # command issued by singularity exec
+        platform.command = f"Fall3d.x {' '.join(map(str, self.executable_opts))}"
+        # workdir: The working directory of ReFrame inside the container. Default is rfm_workdir
+        
     @run_before('run')
     def load_modules(self):
-        if self.execution_mode == 'baremetal':
+        if self.runs_baremetal():
             self.modules = self.fall3d_binaries.modules
+        elif self.execution_mode == 'ab':
+            self.modules = ['openmpi']
 
     @run_before("run")
     def replace_launcher(self):
-        launcher_cls = getlauncher(self.launcher) 
-        self.job.launcher = launcher_cls()
-        if self.launcher in ['mpirun-mapby', 'mpirun-mapby-nsys', 'srun-pmix-nsys']:
+        self.job.launcher = launchers.make_launcher(self.launcher, self.current_partition)
+        if (launchers.kind_of(self.launcher) == 'mpirun' or
+            launchers.has_modifier(self.launcher, 'nsys')):
             self.modules = ['openmpi']
-        self.job.launcher = launcher_cls()
+    
+    @run_before("run")
+    def prepare_ab_trials(self):
+        '''Launch commands of the arms compared in `ab` mode.'''
+        if self.execution_mode != 'ab':
+            return
+        
+        launch = self.job.launcher.run_command(self.job)
+        trials = {}
+        for arm in self.ab_arms:
+            mode, _, image = arm.partition(':')
+            if mode == 'baremetal':
+                trials[arm] = ' '.join([launch, self.executable, *map(str, self.executable_opts)])
+            else:
+                platform = copy.deepcopy(self.container_platform)
+                self.configure_container(platform, image or self.image)
+                # The directory of the arm, within the stage directory mounted at workdir
+                workdir = os.path.relpath(self.ab_workdir(arm), self.stagedir)
+                platform.workdir = os.path.join(platform.workdir, workdir)
+                self.prerun_cmds = (self.prerun_cmds +
+                                    self.container_image_cmds(platform, abtest.arm_name(arm)))
+                trials[arm] = f'{launch} {platform.launch_command(self.stagedir)}'
+        
+        self.use_ab_harness(trials, self.readonly_files)
         
+    def field_output(self):
+        return f'{self.test_prefix}.res.nc'
+
+    def log_patterns(self):
+        # Every pattern of a log is looked for in one shared scan of it
+        ends_normally = r'^.*Task\s+{}\s*:\s*ends NORMALLY\s*$'
+        # Example lines:
+        #   Run start time     : 27 oct 2024 at 12:42:53 
+        #   End time           : 27 oct 2024 at 12:47:54 
+        timestamp = r'(\d{1,2}\s+\w+\s+\d{4}\s+at\s+\d{2}:\d{2}:\d{2})'
+        return {
+            f'{self.test_prefix}.SetTgsd.log': {'ends': ends_normally.format('SetTgsd')},
+            f'{self.test_prefix}.SetDbs.log': {'ends': ends_normally.format('SetDbs')},
+            f'{self.test_prefix}.SetSrc.log': {'ends': ends_normally.format('SetSrc')},
+            f'{self.test_prefix}.Fall3d.log': {
+                'no_warnings': r'^  Number of warnings\s*:\s*0\s*$',
+                'no_errors': r'^  Number of errors\s*:\s*0\s*$',
+                'ends': ends_normally.format('FALL3D'),
+                'start_time': rf'Run start time\s+:\s+{timestamp}',
+                'end_time': rf'End time\s+:\s+{timestamp}',
+            },
+            self.job.stdout: {'success': r'^<LOG>\s+The program has been run successfully\s*$'},
+        }
+
     @sanity_function
     def assert_simulation_success(self):
-        log_prefix = self.test_prefix  # Using the class attribute
-        # Generate log file names dynamically.
-        log_setsrc  = f'{log_prefix}.SetSrc.log'
-        log_settgsd = f'{log_prefix}.SetTgsd.log'
-        log_setdbs  = f'{log_prefix}.SetDbs.log'
-        log_fall3d  = f'{log_prefix}.Fall3d.log'
-
+        if self.execution_mode == 'ab':
+            return self.assert_trials()
+        
+        log_fall3d = f'{self.test_prefix}.Fall3d.log'
         conditions = [
-            sn.assert_found(r'^.*Task\s+SetTgsd\s*:\s*ends NORMALLY\s*$', log_settgsd),
-            sn.assert_found(r'^.*Task\s+SetDbs\s*:\s*ends NORMALLY\s*$', log_setdbs),
-            sn.assert_found(r'^.*Task\s+SetSrc\s*:\s*ends NORMALLY\s*$', log_setsrc),
-            sn.assert_found(r'^  Number of warnings\s*:\s*0\s*$', log_fall3d),
-            sn.assert_found(r'^  Number of errors\s*:\s*0\s*$', log_fall3d),
-            sn.assert_found(r'^.*Task\s+FALL3D\s*:\s*ends NORMALLY\s*$', log_fall3d),
-            sn.assert_found(r'^<LOG>\s+The program has been run successfully\s*$', self.stdout)
+            self.assert_scanned(f'{self.test_prefix}.SetTgsd.log', 'ends'),
+            self.assert_scanned(f'{self.test_prefix}.SetDbs.log', 'ends'),
+            self.assert_scanned(f'{self.test_prefix}.SetSrc.log', 'ends'),
+            self.assert_scanned(log_fall3d, 'no_warnings'),
+            self.assert_scanned(log_fall3d, 'no_errors'),
+            self.assert_scanned(log_fall3d, 'ends'),
+            self.assert_scanned(self.job.stdout, 'success'),
+            self.assert_fields(),
         ]
         return sn.all(conditions)
     
     @performance_function('s')
     def elapsed_time(self):
-        # Extract the start and end times from the output (self.stdout)
-        # Example lines:
-        #   Run start time     : 27 oct 2024 at 12:42:53 
-        #   End time           : 27 oct 2024 at 12:47:54 
-        start_time_str = sn.extractsingle(
-            r"Run start time\s+:\s+(\d{1,2}\s+\w+\s+\d{4}\s+at\s+\d{2}:\d{2}:\d{2})",
-            f'{self.test_prefix}.Fall3d.log', 1
-        )
-        end_time_str = sn.extractsingle(
-            r"End time\s+:\s+(\d{1,2}\s+\w+\s+\d{4}\s+at\s+\d{2}:\d{2}:\d{2})",
-            f'{self.test_prefix}.Fall3d.log', 1
-        )
+        log_fall3d = f'{self.test_prefix}.Fall3d.log'
+        start_time_str = self.extract_scanned(log_fall3d, 'start_time', 1)
+        end_time_str = self.extract_scanned(log_fall3d, 'end_time', 1)
         
         dt_format = "%d %b %Y at %H:%M:%S"
         start_time = datetime.datetime.strptime(start_time_str.evaluate(), dt_format) 
@@ -263,6 +346,7 @@ class fall3d_raikoke_large_test(fall3d_base_test):
         f'{test_prefix}.inp',
         'Raikoke-2019.gfs.nc',
     ]
+    staged_inputs = ['Raikoke-2019.gfs.nc']
     executable_opts = ['All', 'Raikoke-2019.inp']
     # maybe we can run a prerun hook which fetches the lfs
     # show define an test case name variable and make keep files the default in the base
@@ -1,9 +1,14 @@
 import os
+import sys
 import datetime
 import reframe as rfm
 import reframe.utility.udeps as udeps
 import reframe.utility.sanity as sn
-from reframe.core.backends import getlauncher
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
+from powercap import decomposition, launchers
+from powercap.mixins import (cached_image, cap_sweep, domain_decomposition, field_regression,
+                             log_scan, node_local_inputs, perf_baselines)
 
 #@run_after('setup')
     #def check_files_exist(self):
@@ -18,7 +23,9 @@ from reframe.core.backends import getlauncher
 # Fall3d Base Test Class: 
 #   The actual simulation test that creates the staged environment.
 # =================================================================
-class fall3d_base_test(rfm.RunOnlyRegressionTest):
+class fall3d_base_test(rfm.RunOnlyRegressionTest, cap_sweep, perf_baselines,
+                       domain_decomposition, log_scan, field_regression, node_local_inputs,
+                       cached_image):
     '''Base class of Fall3d runtime tests'''
     
     descr = 'Create stage files'
@@ -33,6 +40,8 @@ class fall3d_base_test(rfm.RunOnlyRegressionTest):
     
     exclusive_access = True
     
+    image_recipe = os.path.join(os.path.dirname(__file__), 'hpccm', 'bb_recipe.py')
+    
     workdir = None
             
     @run_after('setup')
@@ -50,7 +59,8 @@ class fall3d_base_test(rfm.RunOnlyRegressionTest):
         ] + [
             # Append symlink commands with error checking (-f) - see -r for relative
             f'ln -s {os.path.join(self.base_dir, self.data_dir, file)} {file}' for file in self.read_only_files
-        ] + self.prerun_cmds + ['']
+        ] + self.input_staging_cmds(
+            self.workdir, os.path.join(self.base_dir, self.data_dir)) + self.prerun_cmds + ['']
         
     @run_after('setup')
     def copy_log_files(self):
@@ -72,25 +82,25 @@ class fall3d_base_test(rfm.RunOnlyRegressionTest):
 
     @run_before("run")
     def replace_launcher(self):
-        launcher_cls = getlauncher(self.launcher) 
-        self.job.launcher = launcher_cls()
-        if self.launcher in ['mpirun-mapby', 'mpirun-mapby-nsys', 'srun-pmix-nsys']:
+        self.job.launcher = launchers.make_launcher(self.launcher, self.current_partition)
+        if (launchers.kind_of(self.launcher) == 'mpirun' or
+            launchers.has_modifier(self.launcher, 'nsys')):
             self.modules = ['openmpi']
     
+    # After set_resources, whose ranks per node weigh the decomposition
     @run_after('setup')
     def prepare_run(self):
-        #The total number of processors is NPX × NPY × NPY × SIZE and should be equivalent to the argument np
-        npx=npy=npz=1
-        while npx*npy*npz != self.num_gpus:
-            # Find which dimension is smallest and increment it
-            if npx <= npy:
-                npx *= 2
-            else:
-                npy *= 2
-        
-        self.executable_opts += [str(npx), str(npy), str(npz)]
+        #The total number of processors is NPX × NPY × NPZ × SIZE and should be equivalent to the argument np
+        inp = os.path.join(os.path.dirname(__file__), self.data_dir, f'{self.test_prefix}.inp')
+        if os.path.exists(inp):
+            grid = decomposition.read_fall3d_grid(inp)
+        else:
+            grid = decomposition.unknown_grid(self.num_gpus, 3)
+
+        dims = self.decompose('fall3d', grid, self.num_gpus, decomposition.FALL3D_DIMS)
+        self.executable_opts += [str(d) for d in dims]
         
-        self.container_platform.image = os.path.join(self.base_dir, self.image)
+        self.container_platform.image = self.cached_image_path(os.path.join(self.base_dir, self.image))
         # adds --nv flag to singularity exec
         self.container_platform.with_cuda = True 
         # https://reframe-hpc.readthedocs.io/en/stable/regression_test_api.html#reframe.core.containers.ContainerPlatform.mount_points
@@ -100,47 +110,59 @@ class fall3d_base_test(rfm.RunOnlyRegressionTest):
         self.container_platform.mount_points = [
             (input_dir, input_dir),
             (self.workdir, '/workdir') 
-        ]
+        ] + self.staging_mount_points()
         self.container_platform.workdir = os.path.join("/workdir")
         self.container_platform.command = f"Fall3d.x {' '.join(map(str, self.executable_opts))}"
+        self.prerun_cmds = self.prerun_cmds + self.container_image_cmds()
+
+    def field_output(self):
+        # Read in place rather than copied back with the logs
+        return os.path.join(self.workdir, f'{self.test_prefix}.res.nc')
 
     # before sanity step, rsync log files back to home stage directory
     
+    def log_patterns(self):
+        # Every pattern of a log is looked for in one shared scan of it
+        ends_normally = r'^.*Task\s+{}\s*:\s*ends NORMALLY\s*$'
+        # Example lines:
+        #   Run start time     : 27 oct 2024 at 12:42:53 
+        #   End time           : 27 oct 2024 at 12:47:54 
+        timestamp = r'(\d{1,2}\s+\w+\s+\d{4}\s+at\s+\d{2}:\d{2}:\d{2})'
+        return {
+            f'{self.test_prefix}.SetTgsd.log': {'ends': ends_normally.format('SetTgsd')},
+            f'{self.test_prefix}.SetDbs.log': {'ends': ends_normally.format('SetDbs')},
+            f'{self.test_prefix}.SetSrc.log': {'ends': ends_normally.format('SetSrc')},
+            f'{self.test_prefix}.Fall3d.log': {
+                'no_warnings': r'^  Number of warnings\s*:\s*0\s*$',
+                'no_errors': r'^  Number of errors\s*:\s*0\s*$',
+                'ends': ends_normally.format('FALL3D'),
+                'start_time': rf'Run start time\s+:\s+{timestamp}',
+                'end_time': rf'End time\s+:\s+{timestamp}',
+            },
+            self.job.stdout: {'success': r'^<LOG>\s+The program has been run successfully\s*$'},
+        }
+
     @sanity_function
     def assert_simulation_success(self):
-        log_prefix = self.test_prefix  # Using the class attribute
-        # Generate log file names dynamically.
-        log_setsrc  = f'{log_prefix}.SetSrc.log'
-        log_settgsd = f'{log_prefix}.SetTgsd.log'
-        log_setdbs  = f'{log_prefix}.SetDbs.log'
-        log_fall3d  = f'{log_prefix}.Fall3d.log'
-
+        log_fall3d = f'{self.test_prefix}.Fall3d.log'
         conditions = [
-            sn.assert_found(r'^.*Task\s+SetTgsd\s*:\s*ends NORMALLY\s*$', log_settgsd),
-            sn.assert_found(r'^.*Task\s+SetDbs\s*:\s*ends NORMALLY\s*$', log_setdbs),
-            sn.assert_found(r'^.*Task\s+SetSrc\s*:\s*ends NORMALLY\s*$', log_setsrc),
-            sn.assert_found(r'^  Number of warnings\s*:\s*0\s*$', log_fall3d),
-            sn.assert_found(r'^  Number of errors\s*:\s*0\s*$', log_fall3d),
-            sn.assert_found(r'^.*Task\s+FALL3D\s*:\s*ends NORMALLY\s*$', log_fall3d),
-            sn.assert_found(r'^<LOG>\s+The program has been run successfully\s*$', self.stdout),
-            sn.assert_eq(self.job.exitcode, 0)
+            self.assert_scanned(f'{self.test_prefix}.SetTgsd.log', 'ends'),
+            self.assert_scanned(f'{self.test_prefix}.SetDbs.log', 'ends'),
+            self.assert_scanned(f'{self.test_prefix}.SetSrc.log', 'ends'),
+            self.assert_scanned(log_fall3d, 'no_warnings'),
+            self.assert_scanned(log_fall3d, 'no_errors'),
+            self.assert_scanned(log_fall3d, 'ends'),
+            self.assert_scanned(self.job.stdout, 'success'),
+            sn.assert_eq(self.job.exitcode, 0),
+            self.assert_fields(),
         ]
         return sn.all(conditions)
     
     @performance_function('s')
     def elapsed_time(self):
-        # Extract the start and end times from the output (self.stdout)
-        # Example lines:
-        #   Run start time     : 27 oct 2024 at 12:42:53 
-        #   End time           : 27 oct 2024 at 12:47:54 
-        start_time_str = sn.extractsingle(
-            r"Run start time\s+:\s+(\d{1,2}\s+\w+\s+\d{4}\s+at\s+\d{2}:\d{2}:\d{2})",
-            f'{self.test_prefix}.Fall3d.log', 1
-        )
-        end_time_str = sn.extractsingle(
-            r"End time\s+:\s+(\d{1,2}\s+\w+\s+\d{4}\s+at\s+\d{2}:\d{2}:\d{2})",
-            f'{self.test_prefix}.Fall3d.log', 1
-        )
+        log_fall3d = f'{self.test_prefix}.Fall3d.log'
+        start_time_str = self.extract_scanned(log_fall3d, 'start_time', 1)
+        end_time_str = self.extract_scanned(log_fall3d, 'end_time', 1)
         
         dt_format = "%d %b %Y at %H:%M:%S"
         start_time = datetime.datetime.strptime(start_time_str.evaluate(), dt_format) 
@@ -189,6 +211,7 @@ class fall3d_raikoke_large_test(fall3d_base_test):
         f'{test_prefix}.inp',
         'Raikoke-2019.gfs.nc',
     ]
+    staged_inputs = ['Raikoke-2019.gfs.nc']
     executable_opts = ['All', 'Raikoke-2019.inp']
     keep_files = [
         f'{test_prefix}.SetSrc.log', 
@@ -6,6 +6,8 @@ The generation is parameterized solely using the provided user arguments, which
 - `cluster`: Specifies the target cluster ('leonardo' or 'thea').
 - `fall3d_version`: Fall3d version to build (default is '9.0.1').
 - `fall3d_single_precision`: Indicates whether to build Fall3d for single precision (default is 'NO').
+- `toolchain`: Base images of the cluster profile to build on (see configuration/clusters.yaml).
+- `layers`: Directory of the prebuilt dependency layer images to start from (see powercap/layers.py).
 
 For example, to generate a Singularity definition file for the 'leonardo' cluster, you can run:
 
@@ -26,6 +28,8 @@ from packaging.version import Version
 from hpccm.templates.git import git
 from hpccm.common import container_type
 import re
+import os
+import sys
 
 
 ###############################################################################
@@ -39,75 +43,20 @@ fall3d_single_precision = USERARG.get('fall3d_single_precision', 'NO')
 cluster_name = USERARG.get('cluster', None)
 if cluster_name is None:
     raise RuntimeError("You must specify the 'cluster' argument (e.g., 'leonardo' or 'thea').")
+# Base images and CUDA version, FALL3D is built against CUDA 11.8 on Leonardo
+toolchain = USERARG.get('toolchain', 'nvhpc-cuda11.8' if cluster_name == 'leonardo' else 'nvhpc')
 
 ###############################################################################
-# Define Cluster Configurations
+# Cluster Profile
 ###############################################################################
 
-# Configuration mappings for different clusters
-cluster_configs = {
-    'leonardo': {
-        # --------------------
-        # Base operating system
-        # --------------------
-        'base_os': 'ubuntu22',
-
-        # --------------------
-        # NVHPC, CUDA setup for A100
-        # --------------------
-        'nvhpc_version': '24.11',
-        'cuda_version': '11.8',
-        'cuda_arch': '80',
-
-        # --------------------
-        # Use a (unique) content-based identifier for images
-        # --------------------
-        'digest_devel': 'sha256:f50d2e293b79d43684a36c781ceb34a663db54249364530bf6da72bdf2feab30', # nvcr.io/nvidia/nvhpc:24.11-devel-cuda_multi-ubuntu22.04
-        'digest_runtime': 'sha256:70d561f38e07c013ace2e5e8b30cdd3dadd81c2e132e07147ebcbda71f5a602a', # nvcr.io/nvidia/nvhpc:24.11-runtime-cuda11.8-ubuntu22.04
-
-        # --------------------
-        # Cluster arch and micro arch
-        # --------------------
-        'arch': 'x86_64',
-        'march': 'icelake'
-    },
-    'thea': {
-        # --------------------
-        # Base operating system
-        # --------------------
-        'base_os': 'ubuntu22',
-        
-        # --------------------
-        # NVHPC, CUDA setup for GH200
-        # --------------------
-        'nvhpc_version': '24.11',
-        'cuda_version': '12.6',
-        'cuda_arch': '90',
-        
-        # --------------------
-        # Use a (unique) content-based identifier for images (docker://nvcr.io/nvidia/nvhpc:24.11-devel-cuda12.6-ubuntu22.04)
-        # --------------------
-        'digest_devel': 'sha256:da058394e75309cf6c9002a0d47332b0e730f107f029464819a4a9ba2a6e0454', # nvcr.io/nvidia/nvhpc:24.11-devel-cuda12.6-ubuntu22.04
-        'digest_runtime': 'sha256:fb36c0c055458603df27c31dbdf6ab02fc483f76f4272e7db99546ffe710d914', # nvcr.io/nvidia/nvhpc:24.11-runtime-cuda12.6-ubuntu22.04
-        
-        # --------------------
-        # Cluster arch and micro arch 
-        # --------------------
-        'arch': 'aarch64',
-        'march': 'neoverse-v2'
-    }
-}
-
-
-# Validate cluster name
-if cluster_name not in cluster_configs:
-    raise RuntimeError(
-        f"Invalid cluster name: '{cluster_name}'. "
-        f"Valid options are: {', '.join(cluster_configs.keys())}."
-    )
+# The clusters are described once, in configuration/clusters.yaml (see
+# powercap/clusters.py), for the recipes and the ReFrame configurations alike
+sys.path.insert(0, os.path.abspath(os.path.join(include.prepend_path, '..', '..', '..')))
+from powercap import clusters, layers
 
 # Retrieve cluster-specific settings
-params = cluster_configs[cluster_name]
+params = clusters.profile(cluster_name).recipe_params(toolchain)
 
 ###############################################################################
 # Add descriptive comments to the container definition file
@@ -121,10 +70,12 @@ Stage0 += comment(__doc__, reformat=False)
 # see # NVIDIA HPC SDK (NGC) https://catalog.ngc.nvidia.com/orgs/nvidia/containers/nvhpc/tags
 # It seems Singularity does not allow specifying both a tag and a digest in the same reference
 # alternative: image=f'nvcr.io/nvidia/nvhpc:{params["nvhpc_version"]}-devel-cuda_multi-{params["base_os"]}'
-Stage0 += baseimage(image=f'nvcr.io/nvidia/nvhpc@{params["digest_devel"]}',
-                _distro=f'{params["base_os"]}',
-                _arch=f'{params["arch"]}',
-                _as='devel') 
+# The dependencies of FALL3D are built into a layer of their own, see powercap/layers.py
+netcdf = layers.Layer('fall3d-netcdf', USERARG.get('layers'),
+                      image=params["image_devel"],
+                      _distro=f'{params["base_os"]}',
+                      _arch=f'{params["arch"]}',
+                      _as='devel')
 
 ###############################################################################
 # Install Base Dependencies
@@ -142,22 +93,22 @@ os_common_packages = ['autoconf',
                     'libzip-dev',
                     'libcurl4-openssl-dev']
 
-Stage0 += packages(apt=os_common_packages + ['curl'],
+netcdf += packages(apt=os_common_packages + ['curl'],
                    epel=True,
                    yum=os_common_packages + ['curl-devel', '--allowerasing'])
 
-cuda_major = params["cuda_version"].split('.')[0]  # e.g. '11.8' -> '11' # I think there is a version function
+cuda_major = params["cuda_major"]
 
 
 # Load NVIDIA HPC-X module
 if params["base_os"] == "rockylinux9":
-    Stage0 += shell(commands=['. /usr/share/Modules/init/sh',
+    netcdf.add(shell(commands=['. /usr/share/Modules/init/sh',
                             'module use /opt/nvidia/hpc_sdk/modulefiles',
-                            f'module load hpcx-cuda{cuda_major}'])
+                            f'module load hpcx-cuda{cuda_major}']), replay=True)
 else:
-    Stage0 += shell(commands=['. /usr/share/modules/init/sh',
+    netcdf.add(shell(commands=['. /usr/share/modules/init/sh',
                             'module use /opt/nvidia/hpc_sdk/modulefiles',
-                            f'module load nvhpc-hpcx-cuda{cuda_major}'])
+                            f'module load nvhpc-hpcx-cuda{cuda_major}']), replay=True)
 
 #############################
 # HDF5
@@ -181,7 +132,7 @@ libaec = generic_cmake(
                             "CPATH" : "/opt/libaec/include:$CPATH"
                         },
 )
-Stage0 += libaec
+netcdf += libaec
 
 hdf5 = generic_cmake(
     url='https://support.hdfgroup.org/ftp/HDF5/releases/hdf5-1.14/hdf5-1.14.3/src/hdf5-1.14.3.tar.bz2',
@@ -229,7 +180,7 @@ hdf5 = generic_cmake(
                             "CPATH" : "/opt/hdf5/include:$CPATH"
                         },
 )
-Stage0 += hdf5
+netcdf += hdf5
 
 
 #############################
@@ -258,7 +209,7 @@ parallel_netcdf = pnetcdf( # It will use the nvhpc communication libraries (is t
   check=False  
 )
 
-Stage0 += parallel_netcdf
+netcdf += parallel_netcdf
 
 #############################
 # netCDF - NetCDF does not provide a parallel API prior to 4.0 (NetCDF4 uses HDF5 parallel capabilities)
@@ -301,7 +252,7 @@ netcdf_c = generic_cmake(
                         },
 )
 
-Stage0 += netcdf_c
+netcdf += netcdf_c
 
 # https://github.com/Unidata/netcdf-fortran/issues/278
 #Stage0 += shell(commands=['export LDFLAGS="$(nc-config --libs)"'])
@@ -331,7 +282,9 @@ netcdf_fortran = generic_autotools(
     with_libaec='/opt/libaec'
 )
 
-Stage0 += netcdf_fortran
+netcdf += netcdf_fortran
+
+Stage0 += netcdf.devel()
 
 
 #############################
@@ -344,7 +297,7 @@ Stage0 += generic_cmake(cmake_opts=['-D CMAKE_BUILD_TYPE=Release',
                                     '-D WITH-MPI=YES',
                                     '-D WITH-ACC=YES',
                                     '-D CMAKE_Fortran_COMPILER=nvfortran',
-                                    f'-D CUSTOM_COMPILER_FLAGS="-fast -tp={params["march"]}"',
+                                    f'-D CUSTOM_COMPILER_FLAGS="-fast -tp={params["tp"]}"',
                                     f'-D WITH-R4={fall3d_single_precision}'
                         ],
                         prefix='/opt/fall3d', 
@@ -371,7 +324,7 @@ Stage0 += generic_cmake(cmake_opts=['-D CMAKE_BUILD_TYPE=Release',
     
 # It seems Singularity does not allow specifying both a tag and a digest in the same reference
 # alternative: image=f'nvcr.io/nvidia/nvhpc:{params["nvhpc_version"]}-runtime-cuda{params["cuda_version"]}-{params["base_os"]}'
-Stage1 += baseimage(image=f'nvcr.io/nvidia/nvhpc@{params["digest_runtime"]}',
+Stage1 += baseimage(image=params["image_runtime"],
                     _distro=f'{params["base_os"]}',
                     _arch=f'{params["arch"]}',
                     _as='runtime')
@@ -391,6 +344,7 @@ Stage1 += packages(apt=os_packages + ['curl'],
                    yum=os_packages + ['curl-devel', '--allowerasing'])
 
 
+Stage1 += netcdf.runtime(_from='devel')
 Stage1 += Stage0.runtime(_from='devel') 
 
 if hpccm.config.g_ctype == container_type.DOCKER:
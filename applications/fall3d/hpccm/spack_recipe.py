@@ -6,6 +6,7 @@ The generation is parameterized solely using the provided user arguments, which
 - `cluster`: Specifies the target cluster ('leonardo' or 'thea').
 - `fall3d_version`: Fall3d version to build (default is '9.0.1').
 - `fall3d_single_precision`: Indicates whether to build Fall3d for single precision (default is 'NO').
+- `toolchain`: Base images of the cluster profile to build on (see configuration/clusters.yaml).
 
 For example, to generate a Singularity definition file for the 'leonardo' cluster, you can run:
 
@@ -24,6 +25,8 @@ Note:
 
 from hpccm.templates.git import git
 from hpccm.common import container_type
+import os
+import sys
 
 ###############################################################################
 # Get User Arguments
@@ -36,103 +39,32 @@ fall3d_single_precision = USERARG.get('fall3d_single_precision', 'NO')
 cluster_name = USERARG.get('cluster', None)
 if cluster_name is None:
     raise RuntimeError("You must specify the 'cluster' argument (e.g., 'leonardo' or 'thea').")
+# Base images and CUDA version, FALL3D is built against CUDA 11.8 on Leonardo
+toolchain = USERARG.get('toolchain', 'nvhpc-cuda11.8' if cluster_name == 'leonardo' else 'nvhpc')
 
 ###############################################################################
-# Define Cluster Configurations
+# Cluster Profile
 ###############################################################################
 
-# Configuration mappings for different clusters
-cluster_configs = {
-    'leonardo': {
-        # --------------------
-        # Base operating system
-        # --------------------
-        'base_os': 'ubuntu22',
-
-        # --------------------
-        # Spack version and specs to be installed in environment
-        # --------------------
-        'spack_version': '0.21.0',
-        'spack_arch': 'linux-rhel8-icelake',
-        'spack_branch_or_tag': 'v0.21.0',
-        'spack_specs' : [
-            'hdf5@1.14.3%nvhpc~cxx+fortran+hl~ipo~java~map+mpi+shared~szip~threadsafe+tools api=default build_system=cmake build_type=Release generator=make',
-            'netcdf-c@4.9.2%nvhpc+blosc~byterange~dap~fsync~hdf4~jna+mpi~nczarr_zip+optimize+parallel-netcdf+pic+shared+szip+zstd build_system=autotools patches=0161eb8',
-            'netcdf-fortran@4.6.1%nvhpc~doc+pic+shared build_system=autotools',
-            'parallel-netcdf@1.12.3%nvhpc~burstbuffer+cxx+fortran+pic+shared build_system=autotools',
-            'zlib-ng%gcc',
-        ],
-
-        # --------------------
-        # NVHPC, CUDA setup for A100
-        # --------------------
-        'nvhpc_version': '24.11',
-        'cuda_version': '11.8',
-        'cuda_arch': '80',
-
-        # --------------------
-        # Use a (unique) content-based identifier for images
-        # --------------------
-        'digest_devel': 'sha256:f50d2e293b79d43684a36c781ceb34a663db54249364530bf6da72bdf2feab30', # nvcr.io/nvidia/nvhpc:24.11-devel-cuda_multi-ubuntu22.04
-        'digest_runtime': 'sha256:70d561f38e07c013ace2e5e8b30cdd3dadd81c2e132e07147ebcbda71f5a602a', # nvcr.io/nvidia/nvhpc:24.11-runtime-cuda11.8-ubuntu22.04
-
-        # --------------------
-        # Cluster arch and micro arch
-        # --------------------
-        'arch': 'x86_64',
-        'march': 'icelake'
-    },
-    'thea': {
-        # --------------------
-        # Base operating system
-        # --------------------
-        'base_os': 'ubuntu22',
-        
-        # --------------------
-        # Spack version and specs to be installed in environment
-        # --------------------
-        'spack_version': '0.21.0',
-        'spack_arch': 'linux-rocky9-neoverse_v2',
-        'spack_branch_or_tag': 'v0.21.0',
-        'spack_specs' : [
-            'hdf5@1.14.3%nvhpc~cxx+fortran+hl~ipo~java~map+mpi+shared~szip~threadsafe+tools api=default build_system=cmake build_type=Release generator=make',
-            'netcdf-c@4.9.2%nvhpc+blosc~byterange~dap~fsync~hdf4~jna+mpi~nczarr_zip+optimize+parallel-netcdf+pic+shared+szip+zstd build_system=autotools patches=0161eb8',
-            'netcdf-fortran@4.6.1%nvhpc~doc+pic+shared build_system=autotools',
-            'parallel-netcdf@1.12.3%nvhpc~burstbuffer+cxx+fortran+pic+shared build_system=autotools',
-            'zlib-ng%gcc',
-        ],
-        
-        # --------------------
-        # NVHPC, CUDA setup for GH200
-        # --------------------
-        'nvhpc_version': '24.11',
-        'cuda_version': '12.6',
-        'cuda_arch': '90',
-        
-        # --------------------
-        # Use a (unique) content-based identifier for images
-        # --------------------
-        'digest_devel': 'sha256:da058394e75309cf6c9002a0d47332b0e730f107f029464819a4a9ba2a6e0454', # nvcr.io/nvidia/nvhpc:24.11-devel-cuda12.6-ubuntu22.04
-        'digest_runtime': 'sha256:fb36c0c055458603df27c31dbdf6ab02fc483f76f4272e7db99546ffe710d914', # nvcr.io/nvidia/nvhpc:24.11-runtime-cuda12.6-ubuntu22.04
-        
-        # --------------------
-        # Cluster arch and micro arch
-        # --------------------
-        'arch': 'aarch64',
-        'march': 'neoverse-v2'
-    }
-}
-
-
-# Validate cluster name
-if cluster_name not in cluster_configs:
-    raise RuntimeError(
-        f"Invalid cluster name: '{cluster_name}'. "
-        f"Valid options are: {', '.join(cluster_configs.keys())}."
-    )
+# The clusters are described once, in configuration/clusters.yaml (see
+# powercap/clusters.py), for the recipes and the ReFrame configurations alike
+sys.path.insert(0, os.path.abspath(os.path.join(include.prepend_path, '..', '..', '..')))
+from powercap import clusters
 
 # Retrieve cluster-specific settings
-params = cluster_configs[cluster_name]
+params = clusters.profile(cluster_name).recipe_params(toolchain)
+
+# --------------------
+# Spack version and specs to be installed in environment
+# --------------------
+params['spack_branch_or_tag'] = 'v0.21.0'
+params['spack_specs'] = [
+    'hdf5@1.14.3%nvhpc~cxx+fortran+hl~ipo~java~map+mpi+shared~szip~threadsafe+tools api=default build_system=cmake build_type=Release generator=make',
+    'netcdf-c@4.9.2%nvhpc+blosc~byterange~dap~fsync~hdf4~jna+mpi~nczarr_zip+optimize+parallel-netcdf+pic+shared+szip+zstd build_system=autotools patches=0161eb8',
+    'netcdf-fortran@4.6.1%nvhpc~doc+pic+shared build_system=autotools',
+    'parallel-netcdf@1.12.3%nvhpc~burstbuffer+cxx+fortran+pic+shared build_system=autotools',
+    'zlib-ng%gcc',
+]
 
 ###############################################################################
 # Add descriptive comments to the container definition file
@@ -146,7 +78,7 @@ Stage0 += comment(__doc__, reformat=False)
 # see # NVIDIA HPC SDK (NGC) https://catalog.ngc.nvidia.com/orgs/nvidia/containers/nvhpc/tags
 # It seems Singularity does not allow specifying both a tag and a digest in the same reference
 # alternative: image=f'nvcr.io/nvidia/nvhpc:{params["nvhpc_version"]}-devel-cuda_multi-{params["base_os"]}'
-Stage0 += baseimage(image=f'nvcr.io/nvidia/nvhpc@{params["digest_devel"]}',
+Stage0 += baseimage(image=params["image_devel"],
                 _distro=f'{params["base_os"]}',
                 _arch=f'{params["arch"]}',
                 _as='devel') 
@@ -167,7 +99,7 @@ Stage0 += packages(apt=os_common_packages + ['curl'],
                    epel=True,
                    yum=os_common_packages + ['curl-devel', '--allowerasing'])
 
-cuda_major = params["cuda_version"].split('.')[0]  # e.g. '11.8' -> '11' # I think there is a version function
+cuda_major = params["cuda_major"]
 
 if params["base_os"] == "rockylinux9":
     Stage0 += shell(commands=['. /usr/share/Modules/init/sh',
@@ -242,7 +174,7 @@ Stage0 += generic_cmake(cmake_opts=['-D CMAKE_BUILD_TYPE=Release',
                                     '-D WITH-MPI=YES',
                                     '-D WITH-ACC=YES',
                                     '-D CMAKE_Fortran_COMPILER=nvfortran',
-                                    f'-D CUSTOM_COMPILER_FLAGS="-fast -tp={params["march"]}"',
+                                    f'-D CUSTOM_COMPILER_FLAGS="-fast -tp={params["tp"]}"',
                                     f'-D WITH-R4={fall3d_single_precision}',
                                     ],
                         prefix='/opt/fall3d', 
@@ -269,7 +201,7 @@ Stage0 += generic_cmake(cmake_opts=['-D CMAKE_BUILD_TYPE=Release',
 
 # It seems Singularity does not allow specifying both a tag and a digest in the same reference
 # alternative: image=f'nvcr.io/nvidia/nvhpc:{params["nvhpc_version"]}-runtime-cuda{params["cuda_version"]}-{params["base_os"]}'
-Stage1 += baseimage(image=f'nvcr.io/nvidia/nvhpc@{params["digest_runtime"]}',
+Stage1 += baseimage(image=params["image_runtime"],
                     _distro=f'{params["base_os"]}',
                     _arch=f'{params["arch"]}',
                     _as='runtime')
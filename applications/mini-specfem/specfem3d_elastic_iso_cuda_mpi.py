@@ -1,4 +1,5 @@
 import os
+import sys
 import re
 import reframe as rfm
 import reframe.utility.typecheck as typ
@@ -6,8 +7,13 @@ import reframe.utility.sanity as sn
 import reframe.utility.osext as osext
 from reframe.core.backends import getlauncher
 
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
+from powercap import decomposition
+from powercap.mixins import (cached_build, cached_fetch, cap_sweep, domain_decomposition,
+                             perf_baselines, progress_telemetry)
 
-class fetch_specfemd3d_miniapps(rfm.RunOnlyRegressionTest):
+
+class fetch_specfemd3d_miniapps(rfm.RunOnlyRegressionTest, cached_fetch):
 
     descr = "Fetch SPECFEM3D mini-apps repository"
 
@@ -20,21 +26,43 @@ class fetch_specfemd3d_miniapps(rfm.RunOnlyRegressionTest):
     executable_opts = [f"{repo_url}"]
     local = True
 
+    def artifact_args(self):
+        return ['git', self.repo_url, self.commit_hash, 'specfem_mini_app']
+
     @sanity_function
     def validate_download(self):
         return sn.assert_eq(self.job.exitcode, 0)
 
 
-class build_specfem3d_miniapps(rfm.CompileOnlyRegressionTest):
+#: GPU counts the mini-app is built for by default, all in one build
+GPU_COUNTS = [1]
+
+
+class build_specfem3d_miniapps(rfm.CompileOnlyRegressionTest, cached_build, domain_decomposition):
+    """Build the mini-app once for all the GPU counts of the benchmarks.
+
+    The decomposition is compiled into `config_mod.f90`: one
+    `xspecfem_mini_app.<NPX>x<NPY>` binary is built per GPU count of
+    `gpu_counts`, patching the source each time.
+    """
+
     descr = "Build Specfem3d mini-app"
 
     build_system = "Make"
     build_prefix = variable(str)
     # build_locally = False # check first whether you can pass it from the command line
-    num_gpus = parameter([1])
+    gpu_counts = variable(typ.List[int], value=GPU_COUNTS)
 
     specfem3d_miniapps = fixture(fetch_specfemd3d_miniapps, scope="test")
 
+    #: GPU count -> (NPX, NPY) of the binaries
+    decompositions = {}
+
+    def binary(self, num_gpus):
+        '''Path of the binary to run on `num_gpus` GPUs.'''
+        name = "xspecfem_mini_app.{}x{}".format(*self.decompositions[num_gpus])
+        return os.path.join(self.build_cache_root(), name)
+
     @run_before("compile")
     def prepare_build(self):
         # turn cuda into a parameter or variable
@@ -49,26 +77,54 @@ class build_specfem3d_miniapps(rfm.CompileOnlyRegressionTest):
             'LIBS="-lstdc++ -lcudart -L$NVHPC_HOME/Linux_aarch64/24.9/cuda/lib64"',
         ]
         self.build_system.max_concurrency = 1
+        self.prebuild_cmds = [f"cd {fullpath}"]
 
-        gpus = int(self.num_gpus)
-        npx = int(gpus / int(gpus**0.5))
-        npy = int(gpus**0.5)
-
-        self.prebuild_cmds = [
-            f"cd {fullpath}",
-            f"sed -i 's/NPX_config *= *[0-9]\+/NPX_config = {npx}/g; s/NPY_config *= *[0-9]\+/NPY_config = {npy}/g' {os.path.join(fullpath, 'config_mod.f90')}",
-        ]
-
-
-class specfemd3d_base_benchmark(rfm.RunOnlyRegressionTest):
+        # The decomposition is compiled in, so build each GPU count in turn;
+        # the choices are cached so that the builds are too
+        self.decompositions = {
+            gpus: self.decompose("specfem-mini-app", decomposition.unknown_grid(gpus, 2), gpus)
+            for gpus in self.gpu_counts
+        }
+        config = os.path.join(fullpath, "config_mod.f90")
+        make, = self.build_system.emit_build_commands(self.current_environ)
+        make = make.replace("make ", "make -B ", 1)
+        commands = []
+        for i, (npx, npy) in enumerate(self.decompositions.values()):
+            commands += [
+                f"sed -i 's/NPX_config *= *[0-9]\\+/NPX_config = {npx}/g; s/NPY_config *= *[0-9]\\+/NPY_config = {npy}/g' {config}",
+                *([make] if i > 0 else []),
+                f"cp xspecfem_mini_app xspecfem_mini_app.{npx}x{npy}",
+            ]
+
+        # The build system makes the first binary, the other ones are remade
+        self.prebuild_cmds += commands[:1]
+        self.postbuild_cmds = commands[1:]
+        self.build_cache_paths = [f"xspecfem_mini_app.{npx}x{npy}"
+                                  for npx, npy in self.decompositions.values()]
+
+    def build_cache_source(self):
+        return self.specfem3d_miniapps.commit_hash
+
+    def build_cache_root(self):
+        return os.path.join(self.specfem3d_miniapps.stagedir,
+                            "specfem_mini_app/elastic_iso_cuda_mpi")
+
+
+class specfemd3d_base_benchmark(rfm.RunOnlyRegressionTest, cap_sweep, perf_baselines,
+                                progress_telemetry):
     """Base class of Specfem3d mini-aps runtime tests"""
 
+    progress_pattern = "specfem"
+
     valid_systems = ["*"]
     valid_prog_environs = ["*"]
     
     exclusive_access = True
     time_limit = "600"
 
+    #: Other counts are run with e.g. `-P num_gpus=1,2,4,8`, built with the same `gpu_counts`
+    num_gpus = variable(int, value=GPU_COUNTS[0])
+
     specfemd3d_miniapps_binaries = fixture(
         build_specfem3d_miniapps, scope="environment"
     )
@@ -80,22 +136,22 @@ class specfemd3d_base_benchmark(rfm.RunOnlyRegressionTest):
     def setup_job_opts(self):
         procinfo = self.current_partition.processor
         self.num_cpus_per_task = procinfo.num_cores
-        self.num_nodes = self.specfemd3d_miniapps_binaries.num_gpus 
-        self.num_gpus_per_node = int(self.specfemd3d_miniapps_binaries.num_gpus / self.num_nodes)
+        self.num_nodes = self.num_gpus
+        self.num_gpus_per_node = int(self.num_gpus / self.num_nodes)
         self.num_tasks_per_node = self.num_gpus_per_node
-        self.num_tasks = self.specfemd3d_miniapps_binaries.num_gpus
+        self.num_tasks = self.num_gpus
         self.extra_resources = {
             "nodes": {"nodes": f"{self.num_nodes}"},
         }
 
     @run_before("run")
     def set_executable_path(self):
-        # Set the executable path using the stagedir and build prefix
-        self.executable = os.path.join(
-            self.specfemd3d_miniapps_binaries.specfem3d_miniapps.stagedir,
-            self.specfemd3d_miniapps_binaries.build_prefix,
-            "xspecfem_mini_app",
-        )
+        binaries = self.specfemd3d_miniapps_binaries
+        if self.num_gpus not in binaries.gpu_counts:
+            raise ValueError(f"the mini-app is not built for {self.num_gpus} GPUs: "
+                             f"add it to gpu_counts")
+
+        self.executable = binaries.binary(self.num_gpus)
 
     @run_before("run")
     def replace_launcher(self):
@@ -105,7 +161,7 @@ class specfemd3d_base_benchmark(rfm.RunOnlyRegressionTest):
         self.job.launcher = getlauncher("local")()
         self.job.launcher.modifier = "mpirun"
         self.job.launcher.modifier_options = [
-            f"-np {self.specfemd3d_miniapps_binaries.num_gpus}",
+            f"-np {self.num_gpus}",
             "--map-by ppr:1:node:PE=72",
             "--report-bindings",
         ]
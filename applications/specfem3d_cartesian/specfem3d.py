@@ -1,14 +1,19 @@
 import os
+import sys
 import re
 import reframe as rfm
 import reframe.utility.typecheck as typ
 import reframe.utility.sanity as sn
-import reframe.utility.osext as osext
 import reframe.utility.udeps as udeps
-from reframe.core.backends import getlauncher
+from reframe.core.exceptions import SanityError
 
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
+from powercap import clusters, launchers, refcache, seismograms, specfem
+from powercap.mixins import (cached_build, cached_fetch, cached_image, cached_pipeline, cap_sweep,
+                             log_scan, perf_baselines)
 
-class fetch_specfemd3d_cartesian(rfm.RunOnlyRegressionTest):
+
+class fetch_specfemd3d_cartesian(rfm.RunOnlyRegressionTest, cached_fetch):
     descr = "Fetch SPECFEM3D_CARTESIAN"
 
     maintainers = ['mredenti']
@@ -29,6 +34,9 @@ class fetch_specfemd3d_cartesian(rfm.RunOnlyRegressionTest):
     postrun_cmds = [f'cd specfem3d && git checkout {commit}']
     
     local = True
+    
+    def artifact_args(self):
+        return ['git', self.repo_url, self.commit, 'specfem3d', '--recursive']
         
     @sanity_function
     def validate_download(self):
@@ -38,7 +46,7 @@ class fetch_specfemd3d_cartesian(rfm.RunOnlyRegressionTest):
 # Specfem3d Autotools build logic
 # ========================================================
 @rfm.simple_test
-class build_specfem3d_cartesian(rfm.CompileOnlyRegressionTest):
+class build_specfem3d_cartesian(rfm.CompileOnlyRegressionTest, cached_build):
     descr = "Build Specfem3D"
 
     build_system = "Autotools"
@@ -51,6 +59,14 @@ class build_specfem3d_cartesian(rfm.CompileOnlyRegressionTest):
     
     build_locally = True
     build_time_limit='600'
+    
+    build_cache_paths = ['bin']
+
+    def build_cache_source(self):
+        return self.specfem3d_cartesian_source.commit
+
+    def build_cache_root(self):
+        return self.build_system.sourcesdir
 
     @run_before("compile")
     def prepare_build(self):        
@@ -67,24 +83,8 @@ class build_specfem3d_cartesian(rfm.CompileOnlyRegressionTest):
         self.build_system.cflags = ['-O3']
         self.build_system.fflags = ['-O3']
         
-        # Map Nvidia GPU arch to the SPECFEM3D "cudaN" flag
-        arch_map = {
-            'sm_80': 'cuda11',  # Ampere: A100
-            'sm_90': 'cuda12',  # Hopper: H100
-        }
-
-        # Extract the actual GPU arch from the system
-        device_arch = self.current_partition.devices[0].arch
-
-        # Look up the correct "cudaN" option
-        try:
-            target_gpu_arch = arch_map[device_arch]
-        except KeyError:
-            # For unknown arch, either raise or default to something safe
-            raise ValueError(
-                f"Unsupported or unknown GPU architecture '{device_arch}'. "
-                "Please update arch_map accordingly."
-            )
+        # SPECFEM3D "cudaN" flag of the GPU arch of the system
+        target_gpu_arch = clusters.specfem_cuda(self.current_partition.devices[0].arch)
         
         self.build_system.config_opts= [
             'MPIFC=mpif90',
@@ -99,7 +99,8 @@ class build_specfem3d_cartesian(rfm.CompileOnlyRegressionTest):
 # SPECFEM3D Base Test Class with Conditional Dependencies
 # ========================================================
 
-class specfemd3d_base_benchmark(rfm.RunOnlyRegressionTest):
+class specfemd3d_base_benchmark(rfm.RunOnlyRegressionTest, cap_sweep, perf_baselines, log_scan,
+                                cached_pipeline, cached_image):
     """Base class of Specfem3d mini-aps runtime tests"""
 
     valid_systems = ["leonardo:booster", "thea:gh"]
@@ -107,10 +108,27 @@ class specfemd3d_base_benchmark(rfm.RunOnlyRegressionTest):
     
     execution_mode = variable(typ.Str[r'baremetal|container'])
     image = variable(str) 
+    image_recipe = os.path.join(os.path.dirname(__file__), 'hpccm', 'recipe.py')
     
     exclusive_access = True
     num_gpus = None
 
+    #: Size of the case, see `powercap/specfem.py`
+    case = None
+
+    #: Reference seismograms the ones of the run are checked against, if the
+    #: case has them (see `powercap/seismograms.py`)
+    reference_solution = variable(str, value='REF_SOLUTION')
+
+    #: Tolerances of the seismogram misfits, e.g. ``-S seismogram_tolerances=l2:1e-4``
+    seismogram_tolerances = variable(typ.Dict[str, float], value={})
+
+    #: Binary cache of the reference seismograms, empty to parse them on
+    #: every check (see `powercap/refcache.py`)
+    reference_cache = variable(str, value=os.environ.get('POWERCAP_REFERENCE_CACHE', ''))
+
+    _seismogram_misfits = None
+
     specfemd3d_cartesian_binaries = None
     
     @run_after('init')
@@ -124,12 +142,25 @@ class specfemd3d_base_benchmark(rfm.RunOnlyRegressionTest):
         if self.execution_mode == 'baremetal':
             self.specfemd3d_cartesian_binaries = build_specfem3d_cartesian(part='*', environ='*')
     
+    def has_reference_solution(self):
+        return os.path.isdir(os.path.join(os.path.dirname(__file__), self.sourcesdir,
+                                          self.reference_solution))
+
+    @run_after("init")
+    def add_seismogram_perf_variables(self):
+        if not self.has_reference_solution():
+            return
+
+        for key in ('l2', 'amplitude'):
+            self.perf_variables[f'seismogram_{key}'] = sn.make_performance_function(
+                self.seismogram_misfit, '', key
+            )
+
     @run_after("setup")
     def get_nproc(self):
-        # get the number of processors, ignoring comments in the Par_file
-        result = osext.run_command(f"grep -Po '^NPROC\\s*=\\s*\\K\\d+' {os.path.join(os.path.dirname(__file__), self.sourcesdir)}/DATA/Par_file")
-        # Remove any whitespace and convert the output to an integer.
-        self.num_gpus = int(result.stdout.strip())
+        # NPROC, NSTEP and the mesh size, ignoring comments in the parameter files
+        self.case = specfem.Case(os.path.join(os.path.dirname(__file__), self.sourcesdir, 'DATA'))
+        self.num_gpus = self.case.nproc
    
     @run_before("run")
     def setup_job_opts(self):
@@ -151,19 +182,19 @@ class specfemd3d_base_benchmark(rfm.RunOnlyRegressionTest):
     @run_before("run")
     def replace_launcher(self):
         try:
-            launcher_cls = getlauncher(self.launcher) 
+            self.job.launcher = launchers.make_launcher(self.launcher, self.current_partition)
         except Exception:
-            launcher_cls = getlauncher("mpirun")
-        self.job.launcher = launcher_cls()
+            self.job.launcher = launchers.getlauncher("mpirun")()
     
     @run_before("run")
     def prepare_run(self):
         
+        image_cmds = []
         if self.execution_mode == 'baremetal':
-            self.prerun_cmds = [
-                self.job.launcher.run_command(self) + ' ' + f'{os.path.join(self.specfemd3d_cartesian_binaries.build_system.sourcesdir, "bin", "xmeshfem3D")}',
-                self.job.launcher.run_command(self) + ' ' + f'{os.path.join(self.specfemd3d_cartesian_binaries.build_system.sourcesdir, "bin", "xgenerate_databases")}'
-            ]
+            mesher = self.job.launcher.run_command(self) + ' ' + f'{os.path.join(self.specfemd3d_cartesian_binaries.build_system.sourcesdir, "bin", "xmeshfem3D")}'
+            databases = self.job.launcher.run_command(self) + ' ' + f'{os.path.join(self.specfemd3d_cartesian_binaries.build_system.sourcesdir, "bin", "xgenerate_databases")}'
+            binaries = {'commit': self.specfemd3d_cartesian_binaries.specfem3d_cartesian_source.commit,
+                        'environ': self.current_environ.name}
             # Set the executable path using the stagedir and build prefix
             self.executable = os.path.join(
                 self.specfemd3d_cartesian_binaries.build_system.sourcesdir,
@@ -173,7 +204,7 @@ class specfemd3d_base_benchmark(rfm.RunOnlyRegressionTest):
 
         elif self.execution_mode == 'container':
             
-            self.container_platform.image = self.image
+            self.container_platform.image = self.cached_image_path(self.image)
             self.container_platform.with_cuda = True
             self.container_platform.options = ['--no-home']
             
@@ -182,34 +213,127 @@ class specfemd3d_base_benchmark(rfm.RunOnlyRegressionTest):
             self.container_platform.mount_points = [
                 (input_dir, input_dir) 
             ]
+            # Before the mesher, which already runs in the container
+            image_cmds = self.container_image_cmds()
             
             self.container_platform.command = "xmeshfem3D"
             
-            self.prerun_cmds = [
-                self.job.launcher.run_command(self) + ' ' + self.container_platform.launch_command(self.stagedir)
-            ]
+            mesher = self.job.launcher.run_command(self) + ' ' + self.container_platform.launch_command(self.stagedir)
             
             self.container_platform.command = "xgenerate_databases"
             
-            self.prerun_cmds += [
-                self.job.launcher.run_command(self) + ' ' + self.container_platform.launch_command(self.stagedir),
-            ]
+            databases = self.job.launcher.run_command(self) + ' ' + self.container_platform.launch_command(self.stagedir)
         
             self.container_platform.command = "xspecfem3D"
+
+            binaries = {'image': self.image}
+
+        # Mesher -> databases -> solver; the databases of a case are reused
+        # across runs through the pipeline cache, keyed by the pre-processing
+        # inputs and NPROC (in Par_file)
+        data_dir = os.path.join(os.path.dirname(__file__), self.sourcesdir, 'DATA')
+        mesher_inputs = {**specfem.mesher_inputs(data_dir), 'binaries': binaries}
+        self.prerun_cmds = image_cmds + self.pipeline_cmds([
+            ('mesher', [mesher], mesher_inputs, ['DATABASES_MPI', 'OUTPUT_FILES']),
+            ('databases', [databases], specfem.databases_inputs(data_dir),
+             ['DATABASES_MPI', 'OUTPUT_FILES']),
+        ])
         
+    def log_patterns(self):
+        # Example lines:
+        #  Elapsed time for mesh generation and buffer creation in seconds =    12.34
+        #  Total elapsed time in seconds =    567.89
+        #  End of the simulation
+        elapsed = r'Elapsed time [^=\n]*in seconds\s*=\s*(\S+)'
+        return {
+            'OUTPUT_FILES/output_meshfem3D.txt': {'elapsed': elapsed},
+            'OUTPUT_FILES/output_generate_databases.txt': {'elapsed': elapsed},
+            'OUTPUT_FILES/output_solver.txt': {
+                'loop_time': r'Total elapsed time in seconds\s*=\s*(\S+)',
+                'ends': r'End of the simulation',
+            },
+        }
+
+    def seismogram_misfits(self):
+        # The traces are read once for the sanity and the performance stage
+        if self._seismogram_misfits is None:
+            cache = refcache.ReferenceCache(self.reference_cache) if self.reference_cache else None
+            self._seismogram_misfits = seismograms.compare(
+                os.path.join(self.stagedir, self.reference_solution),
+                os.path.join(self.stagedir, 'OUTPUT_FILES'),
+                cache=cache
+            )
+
+        return self._seismogram_misfits
+
+    @sn.deferrable
+    def assert_seismograms(self):
+        try:
+            names, result = self.seismogram_misfits()
+        except ValueError as err:
+            raise SanityError(str(err)) from None
+
+        failed = seismograms.failures(names, result, self.seismogram_tolerances)
+        if failed:
+            raise SanityError(f'{len(failed)} seismogram misfits out of tolerance, e.g. ' +
+                              ', '.join(f'{name} {key}={value:.3g}'
+                                        for name, key, value in failed[:3]))
+
+        return True
+
+    @sn.deferrable
+    def seismogram_misfit(self, key):
+        return seismograms.summary(self.seismogram_misfits()[1])[key]
+
     @sanity_function
     def validate_test(self):
-        return sn.assert_eq(self.job.exitcode, 0)
+        conditions = [
+            sn.assert_eq(self.job.exitcode, 0),
+            self.assert_scanned('OUTPUT_FILES/output_solver.txt', 'ends'),
+        ]
+        if self.has_reference_solution():
+            conditions.append(self.assert_seismograms())
+
+        return sn.all(conditions)
+
+    def loop_time(self):
+        # The solver prints the elapsed time at every status report, the
+        # total one after the time loop
+        return self.extract_scanned('OUTPUT_FILES/output_solver.txt', 'loop_time',
+                                    1, float, 'last')
+
+    @run_before('performance')
+    def skip_restored_stage_times(self):
+        # The logs of a restored stage are the ones of the job that cached it
+        if self.is_dry_run():
+            return
+
+        restored = self.restored_stages()
+        for stage, var in (('mesher', 'mesher_time'), ('databases', 'databases_time')):
+            if stage in restored:
+                self.perf_variables.pop(var, None)
+
+    @performance_function("s")
+    def mesher_time(self):
+        return self.extract_scanned('OUTPUT_FILES/output_meshfem3D.txt', 'elapsed',
+                                    1, float, 'last')
+
+    @performance_function("s")
+    def databases_time(self):
+        return self.extract_scanned('OUTPUT_FILES/output_generate_databases.txt', 'elapsed',
+                                    1, float, 'last')
+
+    @performance_function("s")
+    def solver_time(self):
+        return self.loop_time()
 
-    #@performance_function("s")
-    #def end_time_iteration_loop(self):
-    #    return sn.extractsingle(
-    #        r"End of time iteration loop\.\.\.\s+(\S+)", self.stdout, 1, float
-    #    )
+    @performance_function("s")
+    def time_per_step(self):
+        return self.loop_time() / self.case.nstep
 
-    #@performance_function("count")
-    #def time_step_count(self):
-    #    return sn.extractsingle(r"time step\s*:\s*\d+\s*/\s*(\d+)", self.stdout, 1, int)
+    @performance_function("elements/s")
+    def element_updates_per_s(self):
+        return self.case.element_updates_per_s(self.loop_time())
 
 
 @rfm.simple_test
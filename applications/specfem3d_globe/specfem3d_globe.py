@@ -1,4 +1,5 @@
 import os
+import sys
 import re
 import reframe as rfm
 import reframe.utility.typecheck as typ
@@ -6,8 +7,12 @@ import reframe.utility.sanity as sn
 import reframe.utility.osext as osext
 from reframe.core.backends import getlauncher
 
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
+from powercap import clusters, decomposition
+from powercap.mixins import cached_fetch, cap_sweep, perf_baselines, progress_telemetry
 
-class fetch_specfemd3d_globe(rfm.RunOnlyRegressionTest):
+
+class fetch_specfemd3d_globe(rfm.RunOnlyRegressionTest, cached_fetch):
     descr = "Fetch SPECFEM3D_GLOBE repository"
 
     repo_url = "https://github.com/SPECFEM/specfem3d_globe.git"
@@ -21,6 +26,9 @@ class fetch_specfemd3d_globe(rfm.RunOnlyRegressionTest):
     ]
     local = True
 
+    def artifact_args(self):
+        return ['git', self.repo_url, self.version, 'specfem3d_globe', '--recursive']
+
     @sanity_function
     def validate_download(self):
         return sn.assert_eq(self.job.exitcode, 0)
@@ -41,6 +49,9 @@ class build_specfem3d_miniapps(rfm.CompileOnlyRegressionTest):
     
     num_gpus = parameter([1])
 
+    #: Chunks of the cubed sphere, each split into NPROC_XI x NPROC_ETA slices
+    nchunks = variable(int, value=1)
+
     @run_before("compile")
     def prepare_build(self):        
         
@@ -52,24 +63,8 @@ class build_specfem3d_miniapps(rfm.CompileOnlyRegressionTest):
         self.build_system.fflags = ['-O3']
         # CUDA_FLAGS= CUDA_LIB= CUDA_INC=
         
-        # Map Nvidia GPU arch to the SPECFEM3D "cudaN" flag
-        arch_map = {
-            'sm_80': 'cuda11',  # Ampere: A100
-            'sm_90': 'cuda12',  # Hopper: H100
-        }
-
-        # Extract the actual GPU arch from the system
-        device_arch = self.current_partition.devices[0].arch
-
-        # Look up the correct "cudaN" option
-        try:
-            target_gpu_arch = arch_map[device_arch]
-        except KeyError:
-            # For unknown arch, either raise or default to something safe
-            raise ValueError(
-                f"Unsupported or unknown GPU architecture '{device_arch}'. "
-                "Please update arch_map accordingly."
-            )
+        # SPECFEM3D "cudaN" flag of the GPU arch of the system
+        target_gpu_arch = clusters.specfem_cuda(self.current_partition.devices[0].arch)
 
         self.build_system.config_opts= [
             'MPIFC=mpif90',
@@ -79,23 +74,23 @@ class build_specfem3d_miniapps(rfm.CompileOnlyRegressionTest):
         ]
         self.build_system.max_concurrency = 8
         
-        # maybe a different function
-        gpus = int(self.num_gpus)
-        npx = int(gpus / int(gpus**0.5))
-        npy = int(gpus**0.5)
-
-        #f"cd {fullpath}",
-        #self.prebuild_cmds = [
-        #    f"sed -i 's/NPX_config *= *[0-9]\+/NPX_config = {npx}/g; s/NPY_config *= *[0-9]\+/NPY_config = {npy}/g' {os.path.join(fullpath, 'config_mod.f90')}",
-        #]
+        # The mesher and solver are sized for the slices of the Par_file
+        nproc = decomposition.globe_nproc(int(self.num_gpus), self.nchunks)
+        par_file = os.path.join(self.build_system.configuredir, 'DATA', 'Par_file')
+        self.prebuild_cmds = [
+            f"sed -i 's/^NCHUNKS *= *[0-9]\+/NCHUNKS = {self.nchunks}/; s/^NPROC_XI *= *[0-9]\+/NPROC_XI = {nproc}/; s/^NPROC_ETA *= *[0-9]\+/NPROC_ETA = {nproc}/' {par_file}",
+        ]
 
 # ========================================================
 # SPECFEM3D_GLOBE Base Test Class with Conditional Dependencies
 # ========================================================
 
-class specfemd3d_base_benchmark(rfm.RunOnlyRegressionTest):
+class specfemd3d_base_benchmark(rfm.RunOnlyRegressionTest, cap_sweep, perf_baselines,
+                                progress_telemetry):
     """Base class of Specfem3d mini-aps runtime tests"""
 
+    progress_pattern = "specfem"
+
     valid_systems = ["leonardo:booster"]
     valid_prog_environs = ["*"]
     
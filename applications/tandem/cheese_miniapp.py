@@ -1,4 +1,5 @@
 import os
+import sys
 import re
 import reframe as rfm
 import reframe.utility.typecheck as typ
@@ -6,6 +7,10 @@ import reframe.utility.sanity as sn
 import reframe.utility.osext as osext
 from reframe.core.backends import getlauncher
 
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
+from powercap import affinity, launchers
+from powercap.mixins import cap_sweep, perf_baselines
+
 
 class fetch_tandem(rfm.RunOnlyRegressionTest):
 
@@ -69,7 +74,7 @@ class build_xshells(rfm.CompileOnlyRegressionTest):
         self.build_system.max_concurrency = 1
 
 
-class xshells_base_benchmark(rfm.RunOnlyRegressionTest):
+class xshells_base_benchmark(rfm.RunOnlyRegressionTest, cap_sweep, perf_baselines):
     """Base class of xshells miniapp runtime benchmarks"""
 
     valid_systems = ["leonardo:booster"]
@@ -126,6 +131,11 @@ class xshells_base_benchmark(rfm.RunOnlyRegressionTest):
         self.job.options = [
             opt for opt in self.job.options if not opt.startswith("--ntasks")
         ]
+        placements = affinity.rank_map(
+            launchers.partition_topology(self.current_partition),
+            self.num_tasks_per_node,
+            self.num_cpus_per_task,
+        )
         self.job.launcher = getlauncher("local")()
         self.job.launcher.modifier = "mpirun"
         self.job.launcher.modifier_options = [
@@ -133,7 +143,7 @@ class xshells_base_benchmark(rfm.RunOnlyRegressionTest):
             f"--map-by socket:PE={self.num_cpus_per_task}",
             "--rank-by core",
             "--report-bindings",
-            "bash -c 'export CUDA_VISIBLE_DEVICES=$((OMPI_COMM_WORLD_LOCAL_RANK % 4)); exec",
+            affinity.wrapper_command(placements),
         ]
 
     @sanity_function
@@ -165,5 +175,5 @@ class xshells_medium_benchmark(xshells_base_benchmark):
     kind = "gpu"
     num_gpus = parameter([1, 2, 4, 8, 16, 32, 64])  # 16, 32, 64
     executable = "./xsgpu_mpi"
-    executable_opts = ["xshells.par.medium'"]
+    executable_opts = ["xshells.par.medium"]
     benchmark = "medium"
@@ -24,6 +24,8 @@ from hpccm.templates.git import git
 from hpccm.common import container_type
 import hpccm.building_blocks as bb
 import re
+import os
+import sys
 
 
 ###############################################################################
@@ -39,73 +41,16 @@ if cluster_name is None:
     raise RuntimeError("You must specify the 'cluster' argument (e.g., 'leonardo' or 'thea').")
 
 ###############################################################################
-# Define Cluster Configurations
+# Cluster Profile
 ###############################################################################
 
-# Configuration mappings for different clusters
-cluster_configs = {
-    'leonardo': {
-        # --------------------
-        # Base operating system
-        # --------------------
-        'base_os': 'ubuntu22',
-
-        # --------------------
-        # NVHPC, CUDA setup for A100
-        # --------------------
-        'nvhpc_version': '24.11',
-        'cuda_version': '12.6',
-        'cuda_arch': '80',
-
-        # --------------------
-        # Use a (unique) content-based identifier for images
-        # --------------------
-        'digest_devel': 'sha256:ac4a478728822dbc02d6b081cd9935f103f224990c9fe5fde17951f0ba83953a', # nvcr.io/nvidia/nvhpc:24.11-devel-cuda12.6-ubuntu22.04 # https://catalog.ngc.nvidia.com/orgs/nvidia/containers/nvhpc/tags
-        'digest_runtime': 'sha256:0d4d48e7208887ae032c9372298840133553dcb0572dabc35922fc2273243602', # nvcr.io/nvidia/nvhpc:24.11-runtime-cuda12.6-ubuntu22.04
-
-        # --------------------
-        # Cluster arch and micro arch
-        # --------------------
-        'arch': 'x86_64',
-        'march': 'icelake'
-    },
-    'thea': {
-        # --------------------
-        # Base operating system
-        # --------------------
-        'base_os': 'ubuntu22',
-        
-        # --------------------
-        # NVHPC, CUDA setup for GH200
-        # --------------------
-        'nvhpc_version': '24.11',
-        'cuda_version': '12.6',
-        'cuda_arch': '90',
-        
-        # --------------------
-        # Use a (unique) content-based identifier for images 
-        # --------------------
-        'digest_devel': 'sha256:da058394e75309cf6c9002a0d47332b0e730f107f029464819a4a9ba2a6e0454', # nvcr.io/nvidia/nvhpc:24.11-devel-cuda12.6-ubuntu22.04
-        'digest_runtime': 'sha256:fb36c0c055458603df27c31dbdf6ab02fc483f76f4272e7db99546ffe710d914', # nvcr.io/nvidia/nvhpc:24.11-runtime-cuda12.6-ubuntu22.04
-        
-        # --------------------
-        # Cluster arch and micro arch 
-        # --------------------
-        'arch': 'aarch64',
-        'march': 'neoverse-v2'
-    }
-}
-
-
-# Validate cluster name
-if cluster_name not in cluster_configs:
-    raise RuntimeError(
-        f"Invalid cluster name: '{cluster_name}'. "
-        f"Valid options are: {', '.join(cluster_configs.keys())}."
-    )
+# The clusters are described once, in configuration/clusters.yaml (see
+# powercap/clusters.py), for the recipes and the ReFrame configurations alike
+sys.path.insert(0, os.path.abspath(os.path.join(include.prepend_path, '..', '..', '..')))
+from powercap import clusters
 
 # Retrieve cluster-specific settings
-params = cluster_configs[cluster_name]
+params = clusters.profile(cluster_name).recipe_params('nvhpc')
 
 ###############################################################################
 # Add descriptive comments to the container definition file
@@ -116,7 +61,7 @@ Stage0 += comment(__doc__, reformat=False)
 ###############################################################################
 # Devel stage Base Image
 ###############################################################################
-Stage0 += baseimage(image=f'nvcr.io/nvidia/nvhpc@{params["digest_devel"]}',
+Stage0 += baseimage(image=params["image_devel"],
                 _distro=f'{params["base_os"]}',
                 _arch=f'{params["arch"]}',
                 _as='devel') 
@@ -147,7 +92,7 @@ Stage0 += packages(
 python = bb.python(python2=False)
 Stage0 += python
 
-cuda_major = params["cuda_version"].split('.')[0]  
+cuda_major = params["cuda_major"]
 
 # Load NVIDIA HPC-X module
 if params["base_os"] == "rockylinux9":
@@ -229,7 +174,7 @@ Stage0 += copy(src='./xshells.hpp', dest='/opt/xshells.hpp')
 Stage0 += shell(commands=[
     'mv /opt/xshells.hpp /opt/xshells',
     'cd /opt/xshells',
-    './configure MPICXX=mpicxx --enable-cuda=ampere --disable-simd',
+    f'./configure MPICXX=mpicxx --enable-cuda={params["xshells_cuda"]} --disable-simd',
     'make xsgpu_mpi'
 ])
 
@@ -247,7 +192,7 @@ Stage0 += environment(
     
 # It seems Singularity does not allow specifying both a tag and a digest in the same reference
 # alternative: image=f'nvcr.io/nvidia/nvhpc:{params["nvhpc_version"]}-runtime-cuda{params["cuda_version"]}-{params["base_os"]}'
-Stage1 += baseimage(image=f'nvcr.io/nvidia/nvhpc@{params["digest_runtime"]}',
+Stage1 += baseimage(image=params["image_runtime"],
                     _distro=f'{params["base_os"]}',
                     _arch=f'{params["arch"]}',
                     _as='runtime')
@@ -1,14 +1,20 @@
 import os
+import hashlib
+import sys
 import re
 import reframe as rfm
 import reframe.utility.typecheck as typ
 import reframe.utility.sanity as sn
 import reframe.utility.osext as osext
 import reframe.utility.udeps as udeps
-from reframe.core.backends import getlauncher
 
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
+from powercap import clusters, launchers
+from powercap.mixins import (cached_build, cached_fetch, cached_image, cap_sweep, perf_baselines,
+                             progress_telemetry)
 
-class fetch_xshells(rfm.RunOnlyRegressionTest):
+
+class fetch_xshells(rfm.RunOnlyRegressionTest, cached_fetch):
     descr = "Fetch XSHELLS"
 
     maintainers = ['mredenti']
@@ -32,6 +38,9 @@ class fetch_xshells(rfm.RunOnlyRegressionTest):
     
     src = variable(str, value="turbulent-geodynamo")
 
+    def artifact_args(self):
+        return ['git', self.repo_url, self.commit, 'xshells', '--recursive']
+
     @run_after("setup")
     def get_parameter_file(self):
         # get the number of processors, ignoring comments in the Par_file
@@ -49,7 +58,7 @@ class fetch_xshells(rfm.RunOnlyRegressionTest):
 # XSHELLS Autotools build logic
 # ========================================================
 @rfm.simple_test
-class build_xshells(rfm.CompileOnlyRegressionTest):
+class build_xshells(rfm.CompileOnlyRegressionTest, cached_build):
     descr = "Build xshells"
 
     build_system = "Autotools"
@@ -66,6 +75,17 @@ class build_xshells(rfm.CompileOnlyRegressionTest):
     build_locally = True
     build_time_limit='600'
     
+    build_cache_paths = ['xsgpu_mpi']
+    
+    def build_cache_source(self):
+        # xshells.hpp is compiled in, so its content is part of the source
+        hpp = os.path.join(os.path.dirname(__file__), self.xshells_source.src, 'xshells.hpp')
+        with open(hpp, 'rb') as fp:
+            return [self.xshells_source.commit, hashlib.sha256(fp.read()).hexdigest()]
+    
+    def build_cache_root(self):
+        return self.build_system.sourcesdir
+    
     @run_before("compile")
     def prepare_build(self):        
     
@@ -79,7 +99,7 @@ class build_xshells(rfm.CompileOnlyRegressionTest):
         
         self.build_system.config_opts= [
             'MPICXX=mpicxx',
-            '--enable-cuda=ampere'
+            f'--enable-cuda={clusters.xshells_cuda(self.current_partition.devices[0].arch)}'
         ]
         self.build_system.make_opts = ['xsgpu_mpi']
         self.build_system.max_concurrency = 1
@@ -88,7 +108,8 @@ class build_xshells(rfm.CompileOnlyRegressionTest):
 # XSHELLS Base Test Class with Conditional Dependencies
 # ========================================================
 
-class xshells_base_benchmark(rfm.RunOnlyRegressionTest):
+class xshells_base_benchmark(rfm.RunOnlyRegressionTest, cap_sweep, perf_baselines,
+                             progress_telemetry, cached_image):
     """Base class of xshells mini-aps runtime tests"""
 
     valid_systems = ["leonardo:booster", "thea:gh"]
@@ -96,6 +117,7 @@ class xshells_base_benchmark(rfm.RunOnlyRegressionTest):
     
     execution_mode = variable(typ.Str[r'baremetal|container'])
     image = variable(str) 
+    image_recipe = os.path.join(os.path.dirname(__file__), 'hpccm', 'geodynamo_recipe.py')
     
     exclusive_access = True
     
@@ -132,25 +154,28 @@ class xshells_base_benchmark(rfm.RunOnlyRegressionTest):
     @run_before("run")
     def replace_launcher(self):
         try:
-            launcher_cls = getlauncher(self.launcher) 
+            launchers.parse(self.launcher)
+            launcher = self.launcher
         except Exception:
-            launcher_cls = getlauncher("mpirun")
-        self.job.launcher = launcher_cls()
+            launcher = "mpirun"
+        if self.execution_mode == 'baremetal' and not launchers.has_modifier(launcher, 'affinity'):
+            # One GPU per rank, with the cores and NIC of its NUMA domain
+            launcher += '+affinity'
+        self.job.launcher = launchers.make_launcher(launcher, self.current_partition)
     
     @run_before("run")
     def prepare_run(self):
         
         if self.execution_mode == 'baremetal':
             # Set the executable path using the stagedir and build prefix
-            self.executable = "bash -c 'export CUDA_VISIBLE_DEVICES=$((OMPI_COMM_WORLD_LOCAL_RANK % 4)); exec " + \
-                os.path.join(
-                    self.xshells_binaries.build_system.sourcesdir,
-                    self.executable
-                )
+            self.executable = os.path.join(
+                self.xshells_binaries.build_system.sourcesdir,
+                self.executable
+            )
 
         elif self.execution_mode == 'container':
             
-            self.container_platform.image = self.image
+            self.container_platform.image = self.cached_image_path(self.image)
             self.container_platform.with_cuda = True
             self.container_platform.options = ['--no-home']
             
@@ -160,9 +185,28 @@ class xshells_base_benchmark(rfm.RunOnlyRegressionTest):
                 (input_dir, input_dir) 
             ]
             
-            self.container_platform.command = self.executable + " -iter_max=100"
+            self.container_platform.command = " ".join([self.executable, *self.executable_opts])
+            self.prerun_cmds = self.prerun_cmds + self.container_image_cmds()
             
         
+    @run_before("run")
+    def set_progress_total(self):
+        """Number of iterations of the run: -iter_max= of the options, else of xshells.par."""
+        if self.progress_total:
+            return
+
+        for opt in self.executable_opts:
+            if opt.startswith("-iter_max="):
+                self.progress_total = int(opt.split("=", 1)[1])
+                return
+
+        par = os.path.join(os.path.dirname(__file__), self.sourcesdir, "xshells.par")
+        with open(par) as fp:
+            match = re.search(r"^\s*iter_max\s*=\s*(\d+)", fp.read(), re.MULTILINE)
+
+        if match:
+            self.progress_total = int(match.group(1))
+
     @sanity_function
     def validate_test(self):
         return sn.assert_eq(self.job.exitcode, 0)
@@ -178,5 +222,5 @@ class xshells_turbulent_geodynamo(xshells_base_benchmark):
     launcher = variable(str, value="srun-pmix")
     num_gpus = parameter([4])
     executable = "xsgpu_mpi"
-    executable_opts = ["-iter_max=100'"] 
+    executable_opts = ["-iter_max=100"] 
     time_limit = "1800"
@@ -1,24 +1,35 @@
 #
 # ReFrame LEONARDO settings
 #
-from reframe.core.backends import register_launcher
-from reframe.core.launchers import JobLauncher
+import os
+import sys
+from reframe.core.logging import register_log_handler
 
-@register_launcher('mpirun-mapby')
-class MpirunLauncher(JobLauncher):
-    def command(self, job):
-        return ['mpirun', 
-                '-np', str(job.num_tasks),
-                f'--map-by socket:PE={job.num_cpus_per_task}',
-                '--rank-by core',
-                '--report-bindings']
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from powercap import clusters
+from powercap.launchers import register_base_launcher
+from powercap.perflog import create_perfstore_handler
 
-@register_launcher('mpirun-nsys')
-class MpirunLauncher(JobLauncher):
-    def command(self, job):
-        return ['mpirun', '-np', str(job.num_tasks), 
-                '--report-bindings',
-                'nsys', '-t cuda,nvtx', '--stats=true']
+register_log_handler('perfstore')(create_perfstore_handler)
+
+# Architectures of the nodes, shared with the container recipes
+profile = clusters.profile('leonardo')
+
+@register_base_launcher('mpirun-mapby', 'mpirun')
+def mpirun_mapby(job):
+    return ['mpirun', 
+            '-np', str(job.num_tasks),
+            f'--map-by socket:PE={job.num_cpus_per_task}',
+            '--rank-by core',
+            '--report-bindings']
+
+# The former launcher, with its own options; modifiers are stacked on the base
+# launchers, e.g. `mpirun-mapby+nsys+powermon`
+@register_base_launcher('mpirun-nsys', 'mpirun')
+def mpirun_nsys(job):
+    return ['mpirun', '-np', str(job.num_tasks),
+            '--report-bindings',
+            'nsys', '-t cuda,nvtx', '--stats=true']
 
 site_configuration = {
     "systems": [
@@ -42,14 +53,9 @@ site_configuration = {
                         "openmpi-gcc", 
                         "openmpi-nvhpc"
                     ],
-                    "processor": {
-                        "arch": "icelake",
-                        "platform": "x86_64",
-                        "num_cpus": 32,
-                        "num_cpus_per_core": 1,
-                        "num_cpus_per_socket": 32,
-                        "num_sockets": 1,
-                    },
+                    "processor": profile.processor(
+                        num_cpus=32, num_cpus_per_core=1, num_cpus_per_socket=32, num_sockets=1,
+                    ),
                 },
                 {
                     "name": "booster",
@@ -83,22 +89,10 @@ site_configuration = {
                         "cuda",
                         "openmpi-nvhpc",
                     ],
-                    "processor": {
-                        "arch": "icelake",
-                        "platform": "x86_64",
-                        "num_cpus": 32,
-                        "num_cpus_per_core": 1,
-                        "num_cpus_per_socket": 32,
-                        "num_sockets": 1,
-                    },
-                    "devices": [
-                        {
-                            'type': 'gpu',
-                            'arch': 'sm_80',
-                            'model': 'Ampere',
-                            'num_devices': 4,
-                        }
-                    ],
+                    "processor": profile.processor(
+                        num_cpus=32, num_cpus_per_core=1, num_cpus_per_socket=32, num_sockets=1,
+                    ),
+                    "devices": profile.devices(num_devices=4),
                 },
                 {
                     "name": "dcgp",
@@ -197,32 +191,10 @@ site_configuration = {
             ],
             "handlers_perflog": [
                 {
-                    "type": "filelog",
-                    "prefix": "%(check_system)s/%(check_partition)s",
+                    # Columnar store, see powercap/perflog.py
+                    "type": "perfstore",
+                    "basedir": "./perfstore",
                     "level": "info",
-                    "format": (
-                        "%(asctime)s|"
-                        "reframe %(version)s|"
-                        "%(check_job_completion_time)s|"
-                        "%(check_info)s|"
-                        "%(check_modules)s|"
-                        "%(check_result)s|"
-                        "%(check_executable)s|"
-                        "%(check_executable_opts)s|"
-                        "%(check_system)s|"
-                        "%(check_partition)s|"
-                        "%(check_environ)s|"
-                        "%(check_descr)s|"
-                        "%(check_job_nodelist)s|"
-                        "%(check_num_tasks_per_node)s|"
-                        "%(check_num_cpus_per_task)s|"
-                        "%(check_num_gpus_per_node)s|"
-                        "%(check_num_tasks)s|"
-                        "%(check_exclusive_access)s|"
-                        "%(check_perfvalues)s"
-                    ),
-                    "format_perfvars": ("%(check_perf_value)s|" "%(check_perf_unit)s|"),
-                    "append": True,
                 }
             ],
         }
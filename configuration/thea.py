@@ -1,65 +1,48 @@
 #
 # ReFrame THEA settings
 #
-from reframe.core.backends import register_launcher
-from reframe.core.launchers import JobLauncher
+import os
+import sys
+from reframe.core.logging import register_log_handler
 
-@register_launcher('mpirun-mapby')
-class MpirunLauncher(JobLauncher):
-    def command(self, job):
-        return ['mpirun', 
-                '-np', str(job.num_tasks),
-                f'--map-by ppr:{job.num_tasks_per_node}:node:PE={job.num_cpus_per_task}',
-                '--report-bindings']
-        
-@register_launcher('srun-pmix')
-class MpirunLauncher(JobLauncher):
-    def command(self, job):
-        return ['srun', 
-                '--mpi=pmix',
-                f'-N {job.num_tasks}',
-                f'-n {job.num_tasks}',
-                f'--cpus-per-task={job.num_cpus_per_task}',
-               ]
-        
-@register_launcher('srun-pmix-nsys')
-class MpirunLauncher(JobLauncher):
-    def command(self, job):
-        return ['srun', 
-                '--mpi=pmix',
-                f'-N {job.num_tasks}',
-                f'-n {job.num_tasks}',
-                f'--cpus-per-task={job.num_cpus_per_task}',
-                'nsys profile', 
-                '-o ${PWD}/output_%q{SLURM_NODEID}_%q{SLURM_PROCID}',
-                '-t cuda,nvtx,osrt,mpi', 
-                '--stats=true',
-                '--cuda-memory-usage=true',
-                '--cudabacktrace=true'
-               ]
-        
-@register_launcher('srun-pmi2')
-class MpirunLauncher(JobLauncher):
-    def command(self, job):
-        return ['srun', 
-                '--mpi=pmi2',
-                f'-N {job.num_tasks}',
-                f'-n {job.num_tasks}',
-                f'--cpus-per-task={job.num_cpus_per_task}',
-               ]
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from powercap import clusters
+from powercap.launchers import register_alias, register_base_launcher
+from powercap.perflog import create_perfstore_handler
 
-@register_launcher('mpirun-mapby-nsys')
-class MpirunLauncher(JobLauncher):
-    def command(self, job):
-        return ['nsys profile', 
-                '-t cuda,nvtx,osrt,mpi', 
-                '--stats=true',
-                '--cuda-memory-usage=true',
-                'mpirun', 
-                '-np', str(job.num_tasks),
-                f'--map-by ppr:{job.num_tasks_per_node}:node:PE={job.num_cpus_per_task}',
-                '--report-bindings',
-                ]
+register_log_handler('perfstore')(create_perfstore_handler)
+
+# Architectures of the nodes, shared with the container recipes
+profile = clusters.profile('thea')
+
+@register_base_launcher('mpirun-mapby', 'mpirun')
+def mpirun_mapby(job):
+    return ['mpirun', 
+            '-np', str(job.num_tasks),
+            f'--map-by ppr:{job.num_tasks_per_node}:node:PE={job.num_cpus_per_task}',
+            '--report-bindings']
+
+@register_base_launcher('srun-pmix', 'srun')
+def srun_pmix(job):
+    return ['srun', 
+            '--mpi=pmix',
+            f'-N {job.num_tasks}',
+            f'-n {job.num_tasks}',
+            f'--cpus-per-task={job.num_cpus_per_task}',
+           ]
+
+@register_base_launcher('srun-pmi2', 'srun')
+def srun_pmi2(job):
+    return ['srun', 
+            '--mpi=pmi2',
+            f'-N {job.num_tasks}',
+            f'-n {job.num_tasks}',
+            f'--cpus-per-task={job.num_cpus_per_task}',
+           ]
+
+# Modifiers are stacked on the base launchers, e.g. `srun-pmix+nsys+powermon`
+register_alias('srun-pmix-nsys', 'srun-pmix+nsys')
+register_alias('mpirun-mapby-nsys', 'mpirun-mapby+nsys-outer')
 
 site_configuration = {
     "systems": [
@@ -108,14 +91,9 @@ site_configuration = {
                         "gcc", 
                         "openmpi-gcc",
                     ],
-                    "processor": {
-                        "arch": "neoverse-v2",
-                        "platform": "arm64",
-                        "num_cpus": 144,
-                        "num_cpus_per_core": 1,
-                        "num_cpus_per_socket": 72,
-                        "num_sockets": 2,
-                    },
+                    "processor": profile.processor(
+                        num_cpus=144, num_cpus_per_core=1, num_cpus_per_socket=72, num_sockets=2,
+                    ),
                 },
                 {
                     "name": "gh",
@@ -153,21 +131,10 @@ site_configuration = {
                         "openmpi-gcc",
                         "cuda"
                     ],
-                    "processor": {
-                        "arch": "neoverse-v2",
-                        "platform": "arm64",
-                        "num_cpus": 72,
-                        "num_cpus_per_core": 1,
-                        "num_cpus_per_socket": 1,
-                        "num_sockets": 1,
-                    },
-                    "devices": [
-                        {
-                            'type': 'gpu',
-                            'arch': 'sm_90',
-                            'num_devices': 1,
-                        }
-                    ],
+                    "processor": profile.processor(
+                        num_cpus=72, num_cpus_per_core=1, num_cpus_per_socket=1, num_sockets=1,
+                    ),
+                    "devices": profile.devices(num_devices=1),
                 },
             ],
         },
@@ -255,32 +222,10 @@ site_configuration = {
             ],
             "handlers_perflog": [
                 {
-                    "type": "filelog",
-                    "prefix": "%(check_system)s/%(check_partition)s",
+                    # Columnar store, see powercap/perflog.py
+                    "type": "perfstore",
+                    "basedir": "./perfstore",
                     "level": "info",
-                    "format": (
-                        "%(asctime)s,"
-                        "%(check_job_completion_time)s,"
-                        "reframe %(version)s,"
-                        "%(check_info)s,"
-                        "%(check_modules)s,"
-                        "%(check_result)s,"
-                        "%(check_executable)s,"
-                        "%(check_executable_opts)s,"
-                        "%(check_system)s,"
-                        "%(check_environ)s,"
-                        "%(check_partition)s,"
-                        "%(check_descr)s,"
-                        "%(check_job_nodelist)s,"
-                        "%(check_num_tasks_per_node)s,"
-                        "%(check_num_cpus_per_task)s,"
-                        "%(check_num_gpus_per_node)s,"
-                        "%(check_num_tasks)s,"
-                        "%(check_exclusive_access)s,"
-                        "%(check_perfvalues)s"
-                    ),
-                    "format_perfvars": ("%(check_perf_value)s," "%(check_perf_unit)s,"),
-                    "append": True,
                 }
             ],
         }
@@ -0,0 +1,8 @@
+"""
+Shared support code for the power capping ReFrame checks.
+
+The checks under `applications/` and the site configurations under
+`configuration/` put the repository root on `sys.path` and import from this
+package. Modules that do not depend on ReFrame can also be run standalone,
+e.g. `python -m powercap.perflog --help`.
+"""
@@ -0,0 +1,216 @@
+"""
+Interleaved A/B comparison of execution modes and container images.
+
+The arms of a comparison, e.g. the bare-metal build of an application and one
+or more of its container images, run in the same allocation, in rounds: every
+round runs each arm once, in an order drawn at random, so that the drifts of
+the machine during the allocation (thermal state, file-system load, network
+neighbours) are spread over the arms rather than confounded with them. The
+trials are recorded one per line:
+
+    round,arm,status,start,end
+
+Every arm is compared with the baseline arm through the differences of the
+trials of the same round, which cancel what the two have in common:
+
+    mean_diff         mean of arm - baseline over the rounds
+    rel_diff          mean_diff over the mean of the baseline
+    ci_low, ci_high   bootstrap confidence interval of mean_diff
+    t, p              paired t-test of mean_diff = 0
+
+Trials are compared on their wall time, and on their energy when the power
+buffers sampled during the allocation are given (see `powercap/power.py`).
+
+    $ python -m powercap.abtest schedule baremetal container:hpcx.sif container:spack.sif --rounds 5
+    $ python -m powercap.abtest compare ab_trials.csv --baseline baremetal
+    $ python -m powercap.abtest compare ab_trials.csv --baseline baremetal --power 'power_*.bin' --metric energy_J
+"""
+
+import argparse
+import glob
+import math
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+from tabulate import tabulate
+
+from powercap import power
+
+
+TRIAL_COLUMNS = ['round', 'arm', 'status', 'start', 'end']
+
+METRICS = ('seconds', 'energy_J')
+
+
+def arm_name(spec):
+    '''Short name of the arm `spec`, e.g. `hpcx.sif` of `container:/images/hpcx.sif`.'''
+    mode, _, image = spec.partition(':')
+    return os.path.basename(image) if image else mode
+
+
+def schedule(arms, rounds, seed=None):
+    '''`(round, arm)` of the trials, every round a random permutation of `arms`.'''
+    rng = np.random.default_rng(seed)
+    return [(r, arms[i]) for r in range(rounds) for i in rng.permutation(len(arms))]
+
+
+def read_trials(path, buffers=()):
+    '''Trials of `path`, with their `seconds` and, given power `buffers`, `energy_J`.'''
+    trials = pd.read_csv(path, names=TRIAL_COLUMNS, header=None)
+    trials['seconds'] = trials['end'] - trials['start']
+    if buffers:
+        trials['energy_J'] = [power.summarize(buffers, (t.start, t.end))['energy_J']
+                              for t in trials.itertuples()]
+
+    return trials
+
+
+def _betacf(a, b, x, iterations=200, eps=1e-14):
+    '''Continued fraction of the regularized incomplete beta function.'''
+    qab, qap, qam = a + b, a + 1.0, a - 1.0
+    c, d = 1.0, 1.0 - qab * x / qap
+    d = 1.0 / (d if abs(d) > 1e-300 else 1e-300)
+    h = d
+    for m in range(1, iterations + 1):
+        m2 = 2 * m
+        for aa in (m * (b - m) * x / ((qam + m2) * (a + m2)),
+                   -(a + m) * (qab + m) * x / ((a + m2) * (qap + m2))):
+            d = 1.0 + aa * d
+            d = 1.0 / (d if abs(d) > 1e-300 else 1e-300)
+            c = 1.0 + aa / c
+            c = c if abs(c) > 1e-300 else 1e-300
+            h *= d * c
+
+        if abs(d * c - 1.0) < eps:
+            break
+
+    return h
+
+
+def betainc(a, b, x):
+    '''Regularized incomplete beta function I_x(a, b).'''
+    if x <= 0.0 or x >= 1.0:
+        return max(0.0, min(1.0, x))
+
+    front = math.exp(math.lgamma(a + b) - math.lgamma(a) - math.lgamma(b) +
+                     a * math.log(x) + b * math.log1p(-x))
+    if x < (a + 1.0) / (a + b + 2.0):
+        return front * _betacf(a, b, x) / a
+
+    return 1.0 - front * _betacf(b, a, 1.0 - x) / b
+
+
+def paired_ttest(diffs):
+    '''`(t, p)` of the two-sided t-test of a zero mean of the paired `diffs`.'''
+    diffs = np.asarray(diffs, dtype=float)
+    n = len(diffs)
+    if n < 2:
+        return math.nan, math.nan
+
+    sem = diffs.std(ddof=1) / math.sqrt(n)
+    if sem == 0:
+        return (0.0, 1.0) if diffs.mean() == 0 else (math.copysign(math.inf, diffs.mean()), 0.0)
+
+    t = diffs.mean() / sem
+    dof = n - 1
+    return t, betainc(dof / 2, 0.5, dof / (dof + t * t))
+
+
+def bootstrap_ci(diffs, confidence=0.95, resamples=10000, seed=0):
+    '''Percentile bootstrap confidence interval of the mean of `diffs`.'''
+    diffs = np.asarray(diffs, dtype=float)
+    if len(diffs) < 2:
+        return math.nan, math.nan
+
+    rng = np.random.default_rng(seed)
+    means = diffs[rng.integers(0, len(diffs), (resamples, len(diffs)))].mean(axis=1)
+    alpha = (1 - confidence) / 2
+    return tuple(np.quantile(means, [alpha, 1 - alpha]))
+
+
+def compare(trials, baseline, metric='seconds', confidence=0.95, resamples=10000, seed=0):
+    '''Paired comparison of every arm of `trials` with the `baseline` arm.
+
+    The baseline is given by the caller: the order of the arms in `trials`
+    is the random one of the schedule. Failed trials are left out, with the
+    trial they pair with.
+    '''
+    ok = trials[trials['status'] == 0]
+    table = ok.pivot_table(index='round', columns='arm', values=metric, aggfunc='first')
+    arms = list(dict.fromkeys([baseline, *trials['arm']]))
+    if baseline not in table:
+        raise ValueError(f'no successful trial of the baseline {baseline!r}')
+
+    rows = []
+    for arm in arms:
+        diffs, ref = np.zeros(0), math.nan
+        if arm != baseline and arm in table:
+            pairs = table[[baseline, arm]].dropna()
+            diffs = (pairs[arm] - pairs[baseline]).to_numpy()
+            ref = pairs[baseline].mean()
+
+        mean_diff = diffs.mean() if len(diffs) else math.nan
+        t, p = paired_ttest(diffs)
+        ci_low, ci_high = bootstrap_ci(diffs, confidence, resamples, seed)
+        rows.append({
+            'arm': arm,
+            'trials': int((trials['arm'] == arm).sum()),
+            'failed': int(((trials['arm'] == arm) & (trials['status'] != 0)).sum()),
+            'pairs': len(diffs),
+            'median': table[arm].median() if arm in table else math.nan,
+            'mean_diff': mean_diff,
+            'rel_diff': mean_diff / ref,
+            'ci_low': ci_low,
+            'ci_high': ci_high,
+            't': t,
+            'p': p,
+        })
+
+    return pd.DataFrame(rows)
+
+
+# ========================================================
+# Command line interface
+# ========================================================
+
+def _print(df):
+    print(tabulate(df, headers='keys', showindex=False, floatfmt='.4g'))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m powercap.abtest',
+                                     description=__doc__.split('\n\n')[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    schedule_cmd = commands.add_parser('schedule', help='print the order of the trials')
+    schedule_cmd.add_argument('arms', nargs='+')
+    schedule_cmd.add_argument('--rounds', type=int, default=5)
+    schedule_cmd.add_argument('--seed', type=int)
+
+    compare_cmd = commands.add_parser('compare', help='compare the arms of recorded trials')
+    compare_cmd.add_argument('trials', help='CSV file of the trials')
+    compare_cmd.add_argument('--baseline', required=True, help='arm compared against')
+    compare_cmd.add_argument('--metric', choices=METRICS, default='seconds')
+    compare_cmd.add_argument('--power', help='glob of the power buffers of the allocation')
+    compare_cmd.add_argument('--confidence', type=float, default=0.95,
+                             help='level of the bootstrap interval (default: %(default)s)')
+    compare_cmd.add_argument('--resamples', type=int, default=10000,
+                             help='bootstrap resamples (default: %(default)s)')
+
+    args = parser.parse_args(argv)
+    if args.command == 'schedule':
+        print(tabulate(schedule(args.arms, args.rounds, args.seed), headers=['round', 'arm']))
+        return 0
+
+    buffers = sorted(glob.glob(args.power)) if args.power else []
+    if args.metric == 'energy_J' and not buffers:
+        parser.error('--metric energy_J requires --power')
+
+    trials = read_trials(args.trials, buffers)
+    _print(compare(trials, args.baseline, args.metric, args.confidence, args.resamples))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
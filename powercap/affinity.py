@@ -0,0 +1,307 @@
+"""
+Placement of the ranks of a node on GPUs, CPU cores and network interfaces.
+
+A node topology is a list of NUMA domains, each with its CPUs and the GPUs
+and NICs attached to it:
+
+    {"numa_nodes": [
+        {"cpus": "0-15", "gpus": [0, 1], "nics": ["mlx5_0:1"]},
+        {"cpus": "16-31", "gpus": [2, 3], "nics": ["mlx5_1:1"]}
+    ]}
+
+It is taken from a topology dump file written on a compute node by
+`python -m powercap.affinity detect`, or else derived from the `processor` and
+`devices` entries of the partition: the NUMA domains of the processor
+`topology`, if ReFrame auto-detected it, or one domain per socket, with the
+GPUs spread evenly over the domains in order.
+
+The local ranks of a node are assigned GPUs in blocks, so that neighbouring
+ranks share a GPU and a domain, then cores from the domain of their GPU and a
+NIC of that domain, round robin. The placement is turned into `srun` binding
+options, or into a wrapper of each rank that pins it with `taskset` and
+exports `CUDA_VISIBLE_DEVICES` and `UCX_NET_DEVICES` for its local rank.
+
+    $ python -m powercap.affinity detect -o topology.json
+    $ python -m powercap.affinity map --topology topology.json --tasks-per-node 4 --cpus-per-task 8
+    $ python -m powercap.affinity map --cpus 32 --gpus 4 --tasks-per-node 4 --cpus-per-task 8 --kind mpirun
+"""
+
+import argparse
+import glob
+import json
+import os
+import subprocess
+import sys
+
+from tabulate import tabulate
+
+
+# ========================================================
+# CPU lists
+# ========================================================
+
+def parse_cpulist(text):
+    '''CPUs of a Linux CPU list such as `0-3,8,10-11`.'''
+    cpus = []
+    for item in text.strip().split(','):
+        if item:
+            first, _, last = item.partition('-')
+            cpus += range(int(first), int(last or first) + 1)
+
+    return cpus
+
+
+def format_cpulist(cpus):
+    '''Inverse of `parse_cpulist()`.'''
+    ranges = []
+    for cpu in sorted(cpus):
+        if ranges and cpu == ranges[-1][1] + 1:
+            ranges[-1][1] = cpu
+        else:
+            ranges.append([cpu, cpu])
+
+    return ','.join(str(a) if a == b else f'{a}-{b}' for a, b in ranges)
+
+
+def cpu_mask(cpus):
+    return hex(sum(1 << cpu for cpu in cpus))
+
+
+def _mask_cpus(mask):
+    value = int(mask, 16)
+    return [cpu for cpu in range(value.bit_length()) if value >> cpu & 1]
+
+
+# ========================================================
+# Topology
+# ========================================================
+
+def _domain(cpus, gpus=(), nics=()):
+    return {'cpus': list(cpus), 'gpus': list(gpus), 'nics': list(nics)}
+
+
+def topology_from_processor(processor, num_gpus=0):
+    '''Topology of a ReFrame `processor` configuration with `num_gpus` GPUs.'''
+    numa_nodes = (processor.get('topology') or {}).get('numa_nodes')
+    if numa_nodes:
+        domains = [_domain(_mask_cpus(mask)) for mask in numa_nodes]
+    else:
+        num_cpus = processor.get('num_cpus') or 1
+        num_sockets = processor.get('num_sockets') or 1
+        per_socket = num_cpus // num_sockets
+        domains = [_domain(range(s * per_socket, (s + 1) * per_socket))
+                   for s in range(num_sockets)]
+
+    for gpu in range(num_gpus):
+        domains[gpu * len(domains) // num_gpus]['gpus'].append(gpu)
+
+    return domains
+
+
+def load_topology(path):
+    with open(path) as fp:
+        dump = json.load(fp)
+
+    return [_domain(parse_cpulist(d['cpus']), d.get('gpus', []), d.get('nics', []))
+            for d in dump['numa_nodes']]
+
+
+def save_topology(domains, path):
+    dump = {'numa_nodes': [{**d, 'cpus': format_cpulist(d['cpus'])} for d in domains]}
+    with open(path, 'w') as fp:
+        json.dump(dump, fp, indent=2)
+        fp.write('\n')
+
+
+def _read(path):
+    with open(path) as fp:
+        return fp.read().strip()
+
+
+def _pci_numa_node(sysfs, bus_id):
+    # nvidia-smi reports 8 hex digits of PCI domain, sysfs 4
+    path = os.path.join(sysfs, 'bus/pci/devices', bus_id[-12:].lower(), 'numa_node')
+    return max(int(_read(path)), 0) if os.path.exists(path) else 0
+
+
+def detect_topology(sysfs='/sys'):
+    '''Topology of the current node, from sysfs and `nvidia-smi`.'''
+    nodes = sorted(glob.glob(os.path.join(sysfs, 'devices/system/node/node[0-9]*')),
+                   key=lambda p: int(p.rsplit('node', 1)[-1]))
+    domains = {int(p.rsplit('node', 1)[-1]): _domain(parse_cpulist(_read(f'{p}/cpulist')))
+               for p in nodes}
+    domains = {n: d for n, d in domains.items() if d['cpus']}
+    if not domains:
+        domains = {0: _domain(range(os.cpu_count()))}
+
+    def _closest(node):
+        return domains[node] if node in domains else next(iter(domains.values()))
+
+    try:
+        completed = subprocess.run(['nvidia-smi', '--query-gpu=index,pci.bus_id',
+                                    '--format=csv,noheader'],
+                                   capture_output=True, text=True, check=True)
+    except (OSError, subprocess.CalledProcessError):
+        completed = None
+
+    for line in completed.stdout.splitlines() if completed else []:
+        index, bus_id = (f.strip() for f in line.split(','))
+        _closest(_pci_numa_node(sysfs, bus_id))['gpus'].append(int(index))
+
+    for dev in sorted(glob.glob(os.path.join(sysfs, 'class/infiniband/*'))):
+        numa_node = os.path.join(dev, 'device/numa_node')
+        node = max(int(_read(numa_node)), 0) if os.path.exists(numa_node) else 0
+        for port in sorted(glob.glob(os.path.join(dev, 'ports/*'))):
+            if os.path.exists(os.path.join(port, 'state')) and \
+               'ACTIVE' in _read(os.path.join(port, 'state')):
+                _closest(node)['nics'].append(f'{os.path.basename(dev)}:{os.path.basename(port)}')
+
+    return list(domains.values())
+
+
+# ========================================================
+# Placement
+# ========================================================
+
+def rank_map(domains, tasks_per_node, cpus_per_task=1):
+    '''Placement of the local ranks of a node.
+
+    Returns one `{'rank', 'numa', 'gpu', 'cpus', 'nic'}` dictionary per local
+    rank; `gpu` and `nic` are None if the node has none.
+    '''
+    gpus = [(n, gpu) for n, d in enumerate(domains) for gpu in d['gpus']]
+    free = [list(d['cpus']) for d in domains]
+    used_nics = [0] * len(domains)
+    all_nics = [nic for d in domains for nic in d['nics']]
+    placements = []
+    for rank in range(tasks_per_node):
+        if gpus:
+            numa, gpu = gpus[rank * len(gpus) // tasks_per_node]
+        else:
+            numa, gpu = rank * len(domains) // tasks_per_node, None
+
+        # Cores of the domain first, then of the following ones
+        cpus = []
+        for n in [numa] + [n for n in range(len(domains)) if n != numa]:
+            take = free[n][:cpus_per_task - len(cpus)]
+            free[n] = free[n][len(take):]
+            cpus += take
+            if len(cpus) == cpus_per_task:
+                break
+
+        nics = domains[numa]['nics']
+        if nics:
+            nic = nics[used_nics[numa] % len(nics)]
+            used_nics[numa] += 1
+        else:
+            nic = all_nics[rank % len(all_nics)] if all_nics else None
+
+        placements.append({'rank': rank, 'numa': numa, 'gpu': gpu,
+                           'cpus': cpus, 'nic': nic})
+
+    return placements
+
+
+def srun_options(placements, cpus=True, gpus=True):
+    '''`srun` options binding each local rank to its cores and GPU.'''
+    options = []
+    if cpus and all(p['cpus'] for p in placements):
+        masks = ','.join(cpu_mask(p['cpus']) for p in placements)
+        options.append(f'--cpu-bind=mask_cpu:{masks}')
+
+    if gpus and all(p['gpu'] is not None for p in placements):
+        options.append(f'--gpu-bind=map_gpu:{",".join(str(p["gpu"]) for p in placements)}')
+
+    return options
+
+
+# Node-local rank, as set by srun or Open MPI
+LOCAL_RANK = '${SLURM_LOCALID:-${OMPI_COMM_WORLD_LOCAL_RANK:-0}}'
+
+
+def wrapper_command(placements, cpus=True, gpus=True, nics=True):
+    '''Shell command running its arguments with the placement of the local rank.
+
+    Returns an empty string if there is nothing to apply.
+    '''
+    cases = []
+    for p in placements:
+        env = []
+        if gpus and p['gpu'] is not None:
+            env.append(f'CUDA_VISIBLE_DEVICES={p["gpu"]}')
+        if nics and p['nic'] is not None:
+            env.append(f'UCX_NET_DEVICES={p["nic"]}')
+
+        cmd = ''.join(f'export {e}; ' for e in env)
+        if cpus and p['cpus']:
+            cmd += f'exec taskset -c {format_cpulist(p["cpus"])} "$@";;'
+        elif env:
+            cmd += 'exec "$@";;'
+        else:
+            continue
+
+        cases.append(f'{p["rank"]}) {cmd}')
+
+    if not cases:
+        return ''
+
+    return f"bash -c 'case {LOCAL_RANK} in {' '.join(cases)} esac; exec \"$@\"' affinity"
+
+
+# ========================================================
+# Command line interface
+# ========================================================
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m powercap.affinity',
+                                     description=__doc__.split('\n\n')[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    detect_cmd = commands.add_parser('detect', help='dump the topology of this node')
+    detect_cmd.add_argument('-o', '--output', help='topology file (default: stdout)')
+
+    map_cmd = commands.add_parser('map', help='show the placement of the ranks of a node')
+    map_cmd.add_argument('--topology', help='topology file')
+    map_cmd.add_argument('--cpus', type=int, help='CPUs per node, without a topology file')
+    map_cmd.add_argument('--sockets', type=int, default=1,
+                         help='sockets per node, without a topology file (default: %(default)s)')
+    map_cmd.add_argument('--gpus', type=int, default=0,
+                         help='GPUs per node, without a topology file (default: %(default)s)')
+    map_cmd.add_argument('--tasks-per-node', type=int, required=True)
+    map_cmd.add_argument('--cpus-per-task', type=int, default=1)
+    map_cmd.add_argument('--kind', choices=['srun', 'mpirun'], default='srun',
+                         help='launcher to show the binding options of')
+
+    args = parser.parse_args(argv)
+    if args.command == 'detect':
+        domains = detect_topology()
+        if args.output:
+            save_topology(domains, args.output)
+        else:
+            print(json.dumps({'numa_nodes': [{**d, 'cpus': format_cpulist(d['cpus'])}
+                                             for d in domains]}, indent=2))
+
+        return
+
+    if args.topology:
+        domains = load_topology(args.topology)
+    elif args.cpus:
+        domains = topology_from_processor({'num_cpus': args.cpus,
+                                           'num_sockets': args.sockets}, args.gpus)
+    else:
+        parser.error('either --topology or --cpus is required')
+
+    placements = rank_map(domains, args.tasks_per_node, args.cpus_per_task)
+    print(tabulate([[p['rank'], p['numa'], p['gpu'], format_cpulist(p['cpus']), p['nic']]
+                    for p in placements],
+                   headers=['rank', 'numa', 'gpu', 'cpus', 'nic']))
+    print()
+    if args.kind == 'srun':
+        print(' '.join(srun_options(placements)))
+        print(wrapper_command(placements, cpus=False, gpus=False))
+    else:
+        print(wrapper_command(placements))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,275 @@
+"""
+Shared cache of downloaded sources: tarballs and bare git mirrors.
+
+Tarballs are stored by URL together with their SHA-256 digest, which is
+either given by the caller or recorded on the first download, and verified
+every time the file is handed out. Git repositories are kept as bare mirrors;
+checkouts are cloned from the mirror sharing its objects, with submodules
+resolved through mirrors of their own, and the checked out commit is verified
+against the requested one. The remote is only contacted when the requested
+revision is not in the mirror, or to update a branch.
+
+    <cache>/files/<sha256(url)>/<name>            downloaded file
+    <cache>/files/<sha256(url)>/<name>.sha256     its digest
+    <cache>/git/<sha256(url)>.git                 bare mirror
+
+In offline mode nothing is downloaded and a missing artifact is an error, so
+that fetch steps on partitions without outbound network fail immediately.
+
+    $ python -m powercap.artifacts --cache $WORK/artifacts url https://example.org/src.tar.gz src.tar.gz
+    $ python -m powercap.artifacts --cache $WORK/artifacts git https://github.com/org/repo.git v1.0 repo --recursive
+    $ python -m powercap.artifacts --cache $WORK/artifacts --offline git https://github.com/org/repo.git v1.0 repo
+"""
+
+import argparse
+import hashlib
+import os
+import posixpath
+import re
+import shutil
+import subprocess
+import sys
+import urllib.parse
+import urllib.request
+import uuid
+
+from filelock import FileLock
+from tabulate import tabulate
+
+
+class ArtifactError(Exception):
+    '''An artifact is missing from the cache or failed its verification.'''
+
+
+_COMMIT = re.compile(r'^[0-9a-f]{40}$')
+
+
+def sha256_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as fp:
+        for block in iter(lambda: fp.read(1 << 20), b''):
+            digest.update(block)
+
+    return digest.hexdigest()
+
+
+def _url_key(url):
+    return hashlib.sha256(url.encode()).hexdigest()
+
+
+def _git(*args, cwd=None):
+    completed = subprocess.run(['git', *args], cwd=cwd, check=True,
+                               capture_output=True, text=True)
+    return completed.stdout.strip()
+
+
+def resolve_url(base, url):
+    '''Resolve a relative submodule URL against the URL of its superproject.'''
+    if not url.startswith(('./', '../')):
+        return url
+
+    parts = urllib.parse.urlsplit(base)
+    path = posixpath.normpath(posixpath.join(parts.path, url))
+    return urllib.parse.urlunsplit(parts._replace(path=path))
+
+
+class ArtifactCache:
+    '''Directory of downloaded files and git mirrors.'''
+
+    def __init__(self, root, offline=False):
+        self.root = os.path.abspath(root)
+        self.offline = offline
+
+    def _lock(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return FileLock(f'{path}.lock')
+
+    # ========================================================
+    # Files
+    # ========================================================
+
+    def file_path(self, url):
+        name = os.path.basename(urllib.parse.urlsplit(url).path) or 'download'
+        return os.path.join(self.root, 'files', _url_key(url), name)
+
+    def get_file(self, url, sha256=None):
+        '''Path of the verified cached copy of `url`, downloading it if needed.'''
+        path = self.file_path(url)
+        with self._lock(path):
+            if not os.path.exists(path):
+                if self.offline:
+                    raise ArtifactError(f'{url} is not cached (offline mode)')
+
+                tmp = f'{path}.{uuid.uuid4().hex}'
+                with urllib.request.urlopen(url) as response, open(tmp, 'wb') as fp:
+                    shutil.copyfileobj(response, fp)
+
+                digest = sha256_file(tmp)
+                if sha256 and digest != sha256:
+                    os.remove(tmp)
+                    raise ArtifactError(f'{url}: SHA-256 {digest} does not match {sha256}')
+
+                with open(f'{path}.sha256', 'w') as fp:
+                    fp.write(f'{digest}\n')
+
+                os.replace(tmp, path)
+
+        with open(f'{path}.sha256') as fp:
+            recorded = fp.read().strip()
+
+        digest = sha256_file(path)
+        if digest != recorded or (sha256 and digest != sha256):
+            raise ArtifactError(f'{path}: SHA-256 {digest} does not match '
+                                f'{sha256 or recorded}')
+
+        return path
+
+    def fetch_file(self, url, dest, sha256=None):
+        '''Copy the verified cached copy of `url` to `dest`.'''
+        shutil.copyfile(self.get_file(url, sha256), dest)
+
+    # ========================================================
+    # Git repositories
+    # ========================================================
+
+    def mirror_path(self, url):
+        return os.path.join(self.root, 'git', f'{_url_key(url)}.git')
+
+    def _resolve(self, mirror, ref):
+        try:
+            return _git('rev-parse', '--verify', '--quiet', f'{ref}^{{commit}}', cwd=mirror)
+        except subprocess.CalledProcessError:
+            return None
+
+    def mirror(self, url, ref):
+        '''Make sure the mirror of `url` holds `ref`; return its path and commit.
+
+        Commits and tags are looked up in the mirror first; branches are
+        updated from the remote unless in offline mode.
+        '''
+        path = self.mirror_path(url)
+        with self._lock(path):
+            exists = os.path.exists(path)
+            commit = self._resolve(path, ref) if exists else None
+            is_branch = exists and self._resolve(path, f'refs/heads/{ref}') is not None
+            if commit is None or (is_branch and not self.offline):
+                if self.offline:
+                    raise ArtifactError(f'{url}@{ref} is not cached (offline mode)')
+
+                if exists:
+                    _git('remote', 'update', '--prune', cwd=path)
+                else:
+                    tmp = f'{path}.{uuid.uuid4().hex}'
+                    _git('clone', '--mirror', '--quiet', url, tmp)
+                    os.replace(tmp, path)
+
+                commit = self._resolve(path, ref)
+                if commit is None:
+                    raise ArtifactError(f'{url}: no such revision {ref!r}')
+
+            if _COMMIT.match(ref) and commit != ref:
+                raise ArtifactError(f'{url}: {ref} resolves to {commit}')
+
+        return path, commit
+
+    def checkout(self, url, ref, dest, recursive=False):
+        '''Check out `ref` of `url` into `dest`, with submodules if `recursive`.'''
+        mirror, commit = self.mirror(url, ref)
+        _git('clone', '--quiet', '--shared', '--no-checkout', mirror, dest)
+        _git('remote', 'set-url', 'origin', url, cwd=dest)
+        _git('checkout', '--quiet', commit, cwd=dest)
+        head = _git('rev-parse', 'HEAD', cwd=dest)
+        if head != commit:
+            raise ArtifactError(f'{dest}: checked out {head} instead of {commit}')
+
+        if recursive:
+            self._checkout_submodules(url, dest)
+
+        return commit
+
+    def _checkout_submodules(self, url, worktree):
+        if not os.path.exists(os.path.join(worktree, '.gitmodules')):
+            return
+
+        config = _git('config', '--file', '.gitmodules', '--get-regexp',
+                      r'^submodule\..*\.(path|url)$', cwd=worktree)
+        modules = {}
+        for line in config.splitlines():
+            key, value = line.split(maxsplit=1)
+            name, attr = key[len('submodule.'):].rsplit('.', 1)
+            modules.setdefault(name, {})[attr] = value
+
+        for name, module in modules.items():
+            sub_url = resolve_url(url, module['url'])
+            sub_commit = _git('rev-parse', f'HEAD:{module["path"]}', cwd=worktree)
+            mirror, _ = self.mirror(sub_url, sub_commit)
+            _git('submodule', 'init', module['path'], cwd=worktree)
+            _git('config', f'submodule.{name}.url', mirror, cwd=worktree)
+            _git('-c', 'protocol.file.allow=always', 'submodule', 'update',
+                 '--quiet', module['path'], cwd=worktree)
+            _git('config', f'submodule.{name}.url', sub_url, cwd=worktree)
+            self._checkout_submodules(sub_url, os.path.join(worktree, module['path']))
+
+    def entries(self):
+        '''Cached files and mirrors.'''
+        ret = []
+        files = os.path.join(self.root, 'files')
+        for key in sorted(os.listdir(files)) if os.path.isdir(files) else []:
+            for f in os.listdir(os.path.join(files, key)):
+                if not f.endswith(('.sha256', '.lock')):
+                    ret.append(('file', f, os.path.join(files, key, f)))
+
+        mirrors = os.path.join(self.root, 'git')
+        for m in sorted(os.listdir(mirrors)) if os.path.isdir(mirrors) else []:
+            if m.endswith('.git'):
+                path = os.path.join(mirrors, m)
+                ret.append(('git', _git('config', 'remote.origin.url', cwd=path), path))
+
+        return ret
+
+
+# ========================================================
+# Command line interface
+# ========================================================
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m powercap.artifacts',
+                                     description=__doc__.split('\n\n')[0])
+    parser.add_argument('--cache', required=True, help='cache directory')
+    parser.add_argument('--offline', action='store_true',
+                        help='fail instead of downloading missing artifacts')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    url_cmd = commands.add_parser('url', help='fetch a file')
+    url_cmd.add_argument('url')
+    url_cmd.add_argument('dest')
+    url_cmd.add_argument('--sha256', help='expected SHA-256 digest')
+
+    git_cmd = commands.add_parser('git', help='check out a git revision')
+    git_cmd.add_argument('url')
+    git_cmd.add_argument('ref', help='commit, tag or branch')
+    git_cmd.add_argument('dest')
+    git_cmd.add_argument('--recursive', action='store_true',
+                         help='check out the submodules as well')
+
+    commands.add_parser('list', help='list cached artifacts')
+
+    args = parser.parse_args(argv)
+    cache = ArtifactCache(args.cache, args.offline)
+    try:
+        if args.command == 'url':
+            cache.fetch_file(args.url, args.dest, args.sha256)
+            print(f'{args.url} -> {args.dest}')
+        elif args.command == 'git':
+            commit = cache.checkout(args.url, args.ref, args.dest, args.recursive)
+            print(f'{args.url}@{args.ref} ({commit}) -> {args.dest}')
+        else:
+            print(tabulate(cache.entries(), headers=['kind', 'artifact', 'path']))
+    except (ArtifactError, subprocess.CalledProcessError) as err:
+        stderr = getattr(err, 'stderr', None)
+        print(f'error: {err}' + (f'\n{stderr}' if stderr else ''), file=sys.stderr)
+        return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
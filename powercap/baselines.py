@@ -0,0 +1,249 @@
+"""
+Reference baselines built from the performance history.
+
+A baseline is kept for every performance variable of a test case, keyed by
+system:partition, environment and test name including its parameters (e.g.
+`fall3d_raikoke_large_test %num_gpus=4`). It is the median of the most recent
+passing runs, with a tolerance of `k` scaled median absolute deviations
+(MAD * 1.4826, a robust estimate of the standard deviation) relative to the
+median, but no less than `min_tolerance`. The bound is one-sided where the
+direction is known: variables measured in time, energy or power units only
+get an upper bound and rates, e.g. `elements/s`, only a lower bound, so that
+faster runs never fail. Counts, byte sizes, relative differences and the
+unitless accuracy measures (e.g. `seismogram_l2`, `<field>_rel_l2`) get no
+baseline: their expected value is not the one of the past runs.
+
+Cap levels are part of the variable key, e.g. `step_time@1500000` for a cap
+sweep, or `elapsed_time@1500000` for a test run with a `cpufreq` resource.
+
+The baselines are written to a JSON file, which the `perf_baselines` mixin
+(see `powercap/mixins.py`) injects into the `reference` of the tests:
+
+    {
+        "leonardo:booster": {
+            "cuda": {
+                "fall3d_raikoke_large_test %num_gpus=4": {
+                    "elapsed_time": {
+                        "value": 663.5, "lower": null, "upper": 0.05,
+                        "unit": "s", "mad": 1.5, "runs": 12
+                    }
+                }
+            }
+        }
+    }
+
+    $ python -m powercap.baselines --store perfstore build -o baselines.json
+    $ python -m powercap.baselines applications/fall3d/log/*.log build -k 4 --min-runs 2
+    $ python -m powercap.baselines --store perfstore compare -b baselines.json
+"""
+
+import argparse
+import json
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+from tabulate import tabulate
+
+from powercap import perflog
+
+
+# Scale factor of the MAD to the standard deviation of a normal distribution
+MAD_SCALE = 1.4826
+
+# Units of variables that only regress when they increase
+LOWER_IS_BETTER = {'s', 'ms', 'us', 'ns', 'J', 'kJ', 'Wh', 'kWh', 'W'}
+
+# Units of variables that only regress when they decrease
+HIGHER_IS_BETTER = {'elements/s', 'steps/s', 'B/s', 'MB/s', 'GB/s', 'GiB/s', 'FLOP/s',
+                    'GFLOP/s', 'TFLOP/s'}
+
+# Units of variables without a baseline
+NOT_BASELINED = {'', 'count', 'B', '%'}
+
+BASELINE_KEYS = ['system', 'partition', 'environ', 'name', 'var']
+
+
+def _var_keys(df):
+    '''`<perf_var>` or `<perf_var>@<cpufreq>`, as looked up by the tests.'''
+    return np.where(df['cpufreq'].isna(), df['perf_var'],
+                    df['perf_var'] + '@' + df['cpufreq'].fillna(''))
+
+
+def bounds(unit, tolerance):
+    '''`(lower, upper)` relative bounds of a variable in `unit`, None if unbounded.'''
+    if unit in LOWER_IS_BETTER:
+        return None, tolerance
+
+    if unit in HIGHER_IS_BETTER:
+        return -tolerance, None
+
+    return -tolerance, tolerance
+
+
+def compute_baselines(table, k=3.0, min_runs=3, last=20, min_tolerance=0.02):
+    '''Robust baseline of every test case and variable of `table`.
+
+    Only passing runs are considered and, of those, the `last` most recent.
+    Returns a `pandas.DataFrame` with one row per `BASELINE_KEYS`.
+    '''
+    df = table if isinstance(table, pd.DataFrame) else table.to_pandas()
+    df = df[(df['result'].fillna('pass') == 'pass') & df['perf_value'].notna() &
+            ~df['perf_unit'].fillna('').isin(NOT_BASELINED)]
+    df = df.assign(var=_var_keys(df))
+    df = df.sort_values('timestamp', ascending=False)
+    df = df[df.groupby(BASELINE_KEYS, dropna=False).cumcount() < last]
+
+    groups = df.groupby(BASELINE_KEYS, dropna=False)
+    df = df.assign(median=groups['perf_value'].transform('median'))
+    df['dev'] = (df['perf_value'] - df['median']).abs()
+    groups = df.groupby(BASELINE_KEYS, dropna=False)
+    base = groups.agg(
+        runs=('perf_value', 'size'),
+        value=('median', 'first'),
+        mad=('dev', 'median'),
+        unit=('perf_unit', 'last'),
+    ).reset_index()
+    base = base[base['runs'] >= min_runs]
+
+    tolerance = k * MAD_SCALE * base['mad'] / base['value'].abs().where(base['value'] != 0)
+    tolerance = tolerance.fillna(min_tolerance).clip(lower=min_tolerance)
+    base['upper'] = tolerance.where(~base['unit'].isin(HIGHER_IS_BETTER))
+    base['lower'] = -tolerance.where(~base['unit'].isin(LOWER_IS_BETTER))
+    return base.reset_index(drop=True)
+
+
+def to_json(baselines):
+    '''Nest the rows of `compute_baselines()` as in the baselines file.'''
+    tree = {}
+    for row in baselines.to_dict('records'):
+        partition = tree.setdefault(f"{row['system']}:{row['partition']}", {})
+        variables = partition.setdefault(row['environ'], {}).setdefault(row['name'], {})
+        variables[row['var']] = {
+            'value': row['value'],
+            'lower': None if pd.isna(row['lower']) else row['lower'],
+            'upper': None if pd.isna(row['upper']) else row['upper'],
+            'unit': row['unit'],
+            'mad': row['mad'],
+            'runs': int(row['runs']),
+        }
+
+    return tree
+
+
+def from_json(tree):
+    '''Flatten a baselines file back into rows.'''
+    rows = []
+    for fullname, environs in tree.items():
+        system, _, partition = fullname.partition(':')
+        for environ, names in environs.items():
+            for name, variables in names.items():
+                for var, entry in variables.items():
+                    rows.append({'system': system, 'partition': partition,
+                                 'environ': environ, 'name': name, 'var': var,
+                                 **entry})
+
+    return pd.DataFrame(rows, columns=BASELINE_KEYS + ['runs', 'value', 'mad', 'unit',
+                                                       'upper', 'lower'])
+
+
+def load(path):
+    '''Read a baselines file; a missing file holds no baselines.'''
+    if not os.path.exists(path):
+        return {}
+
+    with open(path) as fp:
+        return json.load(fp)
+
+
+def save(tree, path):
+    tmp = f'{path}.tmp'
+    with open(tmp, 'w') as fp:
+        json.dump(tree, fp, indent=2, sort_keys=True)
+        fp.write('\n')
+
+    os.replace(tmp, path)
+
+
+def references(tree, fullname, environ, name):
+    '''ReFrame reference tuples of a test case, keyed by variable.
+
+    The bounds follow the unit, whatever the ones of a file built before.
+    '''
+    variables = tree.get(fullname, {}).get(environ, {}).get(name, {})
+    refs = {}
+    for var, e in variables.items():
+        if e['unit'] in NOT_BASELINED:
+            continue
+
+        tolerance = max(abs(b) for b in (e['lower'], e['upper']) if b is not None)
+        refs[var] = (e['value'], *bounds(e['unit'], tolerance), e['unit'])
+
+    return refs
+
+
+def compare(table, baselines):
+    '''Latest run of every baselined test case and variable against its baseline.'''
+    df = table if isinstance(table, pd.DataFrame) else table.to_pandas()
+    df = df.assign(var=_var_keys(df)).sort_values('timestamp')
+    latest = df.groupby(BASELINE_KEYS, dropna=False).tail(1)
+    latest = latest[BASELINE_KEYS + ['timestamp', 'perf_value']]
+    cmp = latest.merge(baselines[~baselines['unit'].isin(NOT_BASELINED)], on=BASELINE_KEYS,
+                       how='inner')
+    cmp['delta'] = cmp['perf_value'] / cmp['value'] - 1
+    too_high = cmp['delta'] > cmp['upper'].astype(float).fillna(np.inf)
+    too_low = cmp['delta'] < cmp['lower'].astype(float).fillna(-np.inf)
+    cmp['status'] = np.where(too_high | too_low, 'FAIL', 'ok')
+    return cmp[BASELINE_KEYS + ['timestamp', 'perf_value', 'value', 'delta',
+                                'lower', 'upper', 'runs', 'status']]
+
+
+# ========================================================
+# Command line interface
+# ========================================================
+
+def _print(df):
+    print(tabulate(df, headers='keys', showindex=False, floatfmt='.4g'))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m powercap.baselines',
+                                     description=__doc__.split('\n\n')[0])
+    perflog.add_source_args(parser)
+    perflog.add_filter_args(parser)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    build_cmd = commands.add_parser('build', help='build the baselines file')
+    build_cmd.add_argument('-o', '--output', default='baselines.json',
+                           help='baselines file (default: %(default)s)')
+    build_cmd.add_argument('-k', type=float, default=3.0,
+                           help='tolerance in scaled MADs (default: %(default)s)')
+    build_cmd.add_argument('--min-runs', type=int, default=3,
+                           help='runs needed for a baseline (default: %(default)s)')
+    build_cmd.add_argument('--last', type=int, default=20,
+                           help='most recent runs considered (default: %(default)s)')
+    build_cmd.add_argument('--min-tolerance', type=float, default=0.02,
+                           help='smallest relative tolerance (default: %(default)s)')
+
+    compare_cmd = commands.add_parser('compare',
+                                      help='compare the latest runs with the baselines')
+    compare_cmd.add_argument('-b', '--baselines', default='baselines.json',
+                             help='baselines file (default: %(default)s)')
+
+    args = parser.parse_args(argv)
+    table = perflog.perflogs_from_args(args)
+    if args.command == 'build':
+        base = compute_baselines(table, args.k, args.min_runs, args.last,
+                                 args.min_tolerance)
+        save(to_json(base), args.output)
+        _print(base)
+        print(f'\n{len(base)} baseline(s) written to {args.output}')
+    else:
+        cmp = compare(table, from_json(load(args.baselines)))
+        _print(cmp)
+        return int((cmp['status'] == 'FAIL').any())
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,251 @@
+"""
+Content-addressed cache of build products.
+
+A build is identified by the SHA-256 of its inputs: source revision, build
+options, modules and target architectures (see `build_key`). The products of a
+build, i.e. a set of files and directories relative to a root directory, are
+stored under
+
+    <cache>/<key[:2]>/<key>/files/...
+    <cache>/<key[:2]>/<key>/meta.json
+
+Entries are written to a temporary directory and renamed into place, so a
+concurrent reader never sees a partial entry. Restoring an entry records its
+use before copying it; when the cache exceeds its size limit the least
+recently used entries are evicted, except those used within the last `GRACE`
+seconds, which may still be being copied.
+
+The build fixtures use the cache through the `cached_build` mixin (see
+`powercap/mixins.py`); it can also be inspected from the command line:
+
+    $ python -m powercap.buildcache --cache $WORK/buildcache list
+    $ python -m powercap.buildcache --cache $WORK/buildcache evict --max-size 20
+"""
+
+import argparse
+import datetime
+import hashlib
+import json
+import os
+import shutil
+import sys
+import time
+import uuid
+
+from filelock import FileLock
+from tabulate import tabulate
+
+
+#: Seconds after its last use during which an entry is not evicted
+GRACE = 3600
+
+
+def build_key(inputs):
+    '''SHA-256 of the JSON encoding of `inputs`.'''
+    data = json.dumps(inputs, sort_keys=True, default=str)
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+def _tree_size(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+
+    size = 0
+    for dirpath, _, filenames in os.walk(path):
+        for f in filenames:
+            f = os.path.join(dirpath, f)
+            if not os.path.islink(f):
+                size += os.path.getsize(f)
+
+    return size
+
+
+class BuildCache:
+    '''Directory of build products keyed by `build_key`.'''
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+
+    def _lock(self):
+        os.makedirs(self.root, exist_ok=True)
+        return FileLock(os.path.join(self.root, '.lock'))
+
+    def entry_dir(self, key):
+        return os.path.join(self.root, key[:2], key)
+
+    def _read_meta(self, key):
+        with open(os.path.join(self.entry_dir(key), 'meta.json')) as fp:
+            return json.load(fp)
+
+    def _write_meta(self, key, meta):
+        path = os.path.join(self.entry_dir(key), 'meta.json')
+        tmp = f'{path}.{uuid.uuid4().hex}'
+        with open(tmp, 'w') as fp:
+            json.dump(meta, fp, indent=2, sort_keys=True)
+
+        os.replace(tmp, path)
+
+    def __contains__(self, key):
+        return os.path.exists(os.path.join(self.entry_dir(key), 'meta.json'))
+
+    def entries(self):
+        '''Metadata of all entries, least recently used first.'''
+        ret = []
+        for prefix in sorted(os.listdir(self.root)) if os.path.isdir(self.root) else []:
+            if len(prefix) != 2 or not os.path.isdir(os.path.join(self.root, prefix)):
+                continue
+
+            for key in os.listdir(os.path.join(self.root, prefix)):
+                if key in self:
+                    ret.append(self._read_meta(key))
+
+        return sorted(ret, key=lambda m: m['last_used'])
+
+    def store(self, key, root, paths, inputs=None, max_size=None):
+        '''Store `paths`, relative to `root`, under `key`.
+
+        If `max_size` (bytes) is given, least recently used entries are
+        evicted afterwards until the cache fits.
+        '''
+        if key in self:
+            return False
+
+        tmp = os.path.join(self.root, f'.tmp-{uuid.uuid4().hex}')
+        for p in paths:
+            src = os.path.join(root, p)
+            dst = os.path.join(tmp, 'files', p)
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            if os.path.isdir(src):
+                shutil.copytree(src, dst, symlinks=True)
+            else:
+                shutil.copy2(src, dst)
+
+        now = time.time()
+        meta = {
+            'key': key,
+            'paths': list(paths),
+            'inputs': inputs or {},
+            'size': _tree_size(tmp),
+            'created': now,
+            'last_used': now,
+        }
+        with open(os.path.join(tmp, 'meta.json'), 'w') as fp:
+            json.dump(meta, fp, indent=2, sort_keys=True)
+
+        with self._lock():
+            os.makedirs(os.path.dirname(self.entry_dir(key)), exist_ok=True)
+            try:
+                os.rename(tmp, self.entry_dir(key))
+            except OSError:
+                # Stored concurrently by another build
+                shutil.rmtree(tmp, ignore_errors=True)
+                return False
+
+        if max_size is not None:
+            self.evict(max_size)
+
+        return True
+
+    def restore(self, key, root):
+        '''Copy the products stored under `key` into `root`.'''
+        # Recorded first, so that `evict` leaves the entry alone while it is copied
+        with self._lock():
+            if key not in self:
+                return False
+
+            meta = self._read_meta(key)
+            meta['last_used'] = time.time()
+            self._write_meta(key, meta)
+
+        files = os.path.join(self.entry_dir(key), 'files')
+        shutil.copytree(files, root, symlinks=True, dirs_exist_ok=True)
+        return True
+
+    def evict(self, max_size, grace=GRACE):
+        '''Remove least recently used entries until at most `max_size` bytes remain.
+
+        Entries used within the last `grace` seconds are kept.
+        '''
+        evicted = []
+        with self._lock():
+            entries = self.entries()
+            total = sum(m['size'] for m in entries)
+            for meta in entries:
+                if total <= max_size or meta['last_used'] > time.time() - grace:
+                    break
+
+                shutil.rmtree(self.entry_dir(meta['key']))
+                total -= meta['size']
+                evicted.append(meta['key'])
+
+        return evicted
+
+
+# ========================================================
+# Command line interface
+# ========================================================
+
+GiB = 1 << 30
+
+
+def _stamp(t):
+    return datetime.datetime.fromtimestamp(t).isoformat(' ', 'seconds')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m powercap.buildcache',
+                                     description=__doc__.split('\n\n')[0])
+    parser.add_argument('--cache', required=True, help='cache directory')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    store_cmd = commands.add_parser('store', help='store build products')
+    store_cmd.add_argument('--key', required=True)
+    store_cmd.add_argument('--root', required=True,
+                           help='directory the paths are relative to')
+    store_cmd.add_argument('--inputs', help='JSON file of the key inputs')
+    store_cmd.add_argument('--max-size', type=float,
+                           help='evict entries beyond this size in GiB')
+    store_cmd.add_argument('paths', nargs='+')
+
+    restore_cmd = commands.add_parser('restore', help='restore build products')
+    restore_cmd.add_argument('--key', required=True)
+    restore_cmd.add_argument('--root', required=True)
+
+    commands.add_parser('list', help='list entries, least recently used first')
+
+    evict_cmd = commands.add_parser('evict', help='evict least recently used entries')
+    evict_cmd.add_argument('--max-size', type=float, required=True, help='size in GiB')
+    evict_cmd.add_argument('--grace', type=float, default=GRACE,
+                           help=f'keep entries used within this many seconds (default: {GRACE})')
+
+    args = parser.parse_args(argv)
+    cache = BuildCache(args.cache)
+    if args.command == 'store':
+        inputs = None
+        if args.inputs:
+            with open(args.inputs) as fp:
+                inputs = json.load(fp)
+
+        max_size = None if args.max_size is None else args.max_size * GiB
+        if cache.store(args.key, args.root, args.paths, inputs, max_size):
+            print(f'stored {args.key}')
+        else:
+            print(f'{args.key} is already cached')
+    elif args.command == 'restore':
+        if not cache.restore(args.key, args.root):
+            print(f'{args.key} is not cached', file=sys.stderr)
+            return 1
+
+        print(f'restored {args.key}')
+    elif args.command == 'list':
+        print(tabulate([[m['key'][:16], ' '.join(m['paths']), f"{m['size'] / GiB:.2f}",
+                         _stamp(m['created']), _stamp(m['last_used'])]
+                        for m in cache.entries()],
+                       headers=['key', 'paths', 'GiB', 'created', 'last used']))
+    elif args.command == 'evict':
+        for key in cache.evict(args.max_size * GiB, args.grace):
+            print(f'evicted {key}')
+
+
+if __name__ == '__main__':
+    sys.exit(main())
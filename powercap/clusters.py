@@ -0,0 +1,287 @@
+"""
+Registry of the hardware and software profiles of the clusters.
+
+The facts every build for a cluster depends on, its CPU micro-architecture,
+GPU architecture, network stack and pinned base images, are declared once in
+`configuration/clusters.yaml` (or the file `POWERCAP_CLUSTERS` points at),
+validated against `SCHEMA`:
+
+    thea:
+      arch: aarch64
+      march: neoverse_v2
+      gpu: {arch: sm_90, model: GH200}
+      toolchains:
+        nvhpc:
+          nvhpc_version: '24.11'
+          cuda_version: '12.6'
+          devel: {image: nvcr.io/nvidia/nvhpc:24.11-devel-cuda12.6-ubuntu22.04, digest: 'sha256:...'}
+          ...
+
+The ReFrame site configurations take the `processor` and `devices` of their
+partitions from it, and the HPCCM recipes their `params` (see
+`Profile.recipe_params`). The flags the compilers and build systems spell the
+architectures with are derived here, from `march` and `gpu.arch` only:
+
+    nvhpc_tp('neoverse_v2')   -> 'neoverse-v2'    nvfortran -tp=
+    nvhpc_gpu('sm_90')        -> '-gpu=sm_90'     nvfortran
+    specfem_cuda('sm_90')     -> 'cuda12'         SPECFEM3D ./configure --with-cuda=
+    xshells_cuda('sm_90')     -> 'hopper'         XSHELLS ./configure --enable-cuda=
+
+so that a recipe or a build fixture cannot target another architecture than
+the nodes it runs on.
+
+    $ python -m powercap.clusters
+    $ python -m powercap.clusters --images
+"""
+
+import argparse
+import functools
+import os
+import sys
+
+import jsonschema
+import yaml
+from tabulate import tabulate
+
+
+DEFAULT_REGISTRY = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                'configuration', 'clusters.yaml')
+
+#: Build-system names of the GPU architectures, by compute capability
+GPU_ARCHS = {
+    'sm_70': {'family': 'volta', 'specfem': 'cuda9'},
+    'sm_80': {'family': 'ampere', 'specfem': 'cuda11'},
+    'sm_90': {'family': 'hopper', 'specfem': 'cuda12'},
+}
+
+_IMAGE = {
+    'type': 'object',
+    'properties': {
+        'image': {'type': 'string'},
+        'digest': {'type': 'string', 'pattern': '^sha256:[0-9a-f]{64}$'},
+    },
+    'required': ['image', 'digest'],
+    'additionalProperties': False,
+}
+
+SCHEMA = {
+    'type': 'object',
+    'additionalProperties': {
+        'type': 'object',
+        'properties': {
+            'descr': {'type': 'string'},
+            'arch': {'enum': ['x86_64', 'aarch64', 'ppc64le']},
+            'march': {'type': 'string', 'pattern': '^[a-z0-9_]+$'},
+            'gpu': {
+                'type': 'object',
+                'properties': {
+                    'arch': {'enum': list(GPU_ARCHS)},
+                    'model': {'type': 'string'},
+                },
+                'required': ['arch'],
+                'additionalProperties': False,
+            },
+            'base_os': {'type': 'string'},
+            'network_stack': {
+                'type': 'object',
+                'properties': {
+                    'mlnx_ofed': {'type': 'string'},
+                    'knem': {'type': 'boolean'},
+                    'xpmem': {'type': 'boolean'},
+                    'ucx': {'type': 'string'},
+                    'pmix': {'type': 'string'},
+                    'ompi': {'type': 'string'},
+                },
+                'additionalProperties': False,
+            },
+            'toolchains': {
+                'type': 'object',
+                'additionalProperties': {
+                    'type': 'object',
+                    'properties': {
+                        'nvhpc_version': {'type': 'string'},
+                        'cuda_version': {'type': 'string', 'pattern': r'^\d+\.\d+$'},
+                        'devel': _IMAGE,
+                        'runtime': _IMAGE,
+                    },
+                    'required': ['cuda_version', 'devel', 'runtime'],
+                    'additionalProperties': False,
+                },
+            },
+        },
+        'required': ['arch', 'march', 'base_os', 'toolchains'],
+        'additionalProperties': False,
+    },
+}
+
+
+def _gpu_arch(gpu_arch):
+    if gpu_arch not in GPU_ARCHS:
+        raise ValueError(f'unknown GPU architecture {gpu_arch!r}, '
+                         f'expected one of: {", ".join(GPU_ARCHS)}')
+
+    return GPU_ARCHS[gpu_arch]
+
+
+def archspec_target(march):
+    '''archspec (and Spack, HPCCM) name of the micro-architecture `march`.'''
+    return march.replace('-', '_')
+
+
+def nvhpc_tp(march):
+    '''NVHPC `-tp=` name of the micro-architecture `march`.'''
+    return march.replace('_', '-')
+
+
+def cuda_arch(gpu_arch):
+    '''Compute capability of `gpu_arch` as CMake and Spack spell it, e.g. `90`.'''
+    _gpu_arch(gpu_arch)
+    return gpu_arch[len('sm_'):]
+
+
+def nvhpc_gpu(gpu_arch):
+    '''NVHPC `-gpu=` flag of `gpu_arch`.'''
+    _gpu_arch(gpu_arch)
+    return f'-gpu={gpu_arch}'
+
+
+def specfem_cuda(gpu_arch):
+    '''SPECFEM3D `--with-cuda=` value of `gpu_arch`.'''
+    return _gpu_arch(gpu_arch)['specfem']
+
+
+def xshells_cuda(gpu_arch):
+    '''XSHELLS `--enable-cuda=` value of `gpu_arch`.'''
+    return _gpu_arch(gpu_arch)['family']
+
+
+class Profile:
+    '''Profile of the cluster `name` of the registry.'''
+
+    def __init__(self, name, config):
+        self.name = name
+        self.config = config
+        self.arch = config['arch']
+        self.march = config['march']
+        self.gpu = config.get('gpu')
+        self.base_os = config['base_os']
+        self.network_stack = config.get('network_stack', {})
+        self.toolchains = config['toolchains']
+
+    def processor(self, **topology):
+        '''ReFrame `processor` of a partition of the cluster with the given topology.'''
+        return {'arch': self.march, 'platform': self.arch, **topology}
+
+    def devices(self, num_devices):
+        '''ReFrame `devices` of a partition with `num_devices` GPUs per node.'''
+        if self.gpu is None:
+            return []
+
+        device = {'type': 'gpu', 'arch': self.gpu['arch'], 'num_devices': num_devices}
+        if 'model' in self.gpu:
+            device['model'] = self.gpu['model']
+
+        return [device]
+
+    def toolchain(self, name):
+        if name not in self.toolchains:
+            raise ValueError(f'{self.name}: unknown toolchain {name!r}, '
+                             f'expected one of: {", ".join(self.toolchains)}')
+
+        return self.toolchains[name]
+
+    def pins(self):
+        '''`{image: digest}` of the base images of all the toolchains.'''
+        return {stage['image']: stage['digest']
+                for toolchain in self.toolchains.values()
+                for stage in (toolchain['devel'], toolchain['runtime'])}
+
+    def recipe_params(self, toolchain):
+        '''Parameters of an HPCCM recipe building on `toolchain` for the cluster.'''
+        tc = self.toolchain(toolchain)
+        params = {
+            'base_os': self.base_os,
+            'arch': self.arch,
+            'march': archspec_target(self.march),
+            'tp': nvhpc_tp(self.march),
+            'cuda_version': tc['cuda_version'],
+            'cuda_major': tc['cuda_version'].split('.')[0],
+            'network_stack': self.network_stack,
+        }
+        if 'nvhpc_version' in tc:
+            params['nvhpc_version'] = tc['nvhpc_version']
+
+        for stage in ('devel', 'runtime'):
+            repository = tc[stage]['image'].rsplit(':', 1)[0]
+            params[f'digest_{stage}'] = tc[stage]['digest']
+            params[f'image_{stage}'] = f'{repository}@{tc[stage]["digest"]}'
+
+        if self.gpu is not None:
+            gpu_arch = self.gpu['arch']
+            params.update(cuda_arch=cuda_arch(gpu_arch), gpu=nvhpc_gpu(gpu_arch),
+                          specfem_cuda=specfem_cuda(gpu_arch),
+                          xshells_cuda=xshells_cuda(gpu_arch))
+
+        return params
+
+
+@functools.lru_cache(maxsize=None)
+def load(path=None):
+    '''`{name: Profile}` of the registry at `path`, validated against `SCHEMA`.'''
+    path = path or os.environ.get('POWERCAP_CLUSTERS') or DEFAULT_REGISTRY
+    with open(path) as fp:
+        registry = yaml.safe_load(fp)
+
+    try:
+        jsonschema.validate(registry, SCHEMA)
+    except jsonschema.ValidationError as err:
+        where = '.'.join(str(p) for p in err.absolute_path)
+        raise ValueError(f'{path}: {where}: {err.message}') from None
+
+    return {name: Profile(name, config) for name, config in registry.items()}
+
+
+def profile(name, path=None):
+    '''Profile of the cluster `name`.'''
+    profiles = load(path)
+    if name not in profiles:
+        raise ValueError(f'unknown cluster {name!r}, expected one of: {", ".join(profiles)}')
+
+    return profiles[name]
+
+
+# ========================================================
+# Command line interface
+# ========================================================
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m powercap.clusters',
+                                     description=__doc__.split('\n\n')[0])
+    parser.add_argument('--registry', help='registry file (default: %s)' %
+                        os.path.relpath(DEFAULT_REGISTRY))
+    parser.add_argument('--images', action='store_true', help='list the pinned base images')
+
+    args = parser.parse_args(argv)
+    profiles = load(args.registry).values()
+    if args.images:
+        print(tabulate([[p.name, name, stage, tc[stage]['image'], tc[stage]['digest'][7:19]]
+                        for p in profiles
+                        for name, tc in p.toolchains.items()
+                        for stage in ('devel', 'runtime')],
+                       headers=['cluster', 'toolchain', 'stage', 'image', 'digest']))
+        return 0
+
+    rows = []
+    for p in profiles:
+        gpu_arch = p.gpu['arch'] if p.gpu else None
+        rows.append([p.name, p.arch, p.march, gpu_arch, f'-tp={nvhpc_tp(p.march)}',
+                     nvhpc_gpu(gpu_arch) if gpu_arch else '',
+                     f'--with-cuda={specfem_cuda(gpu_arch)}' if gpu_arch else '',
+                     f'--enable-cuda={xshells_cuda(gpu_arch)}' if gpu_arch else ''])
+
+    print(tabulate(rows, headers=['cluster', 'arch', 'march', 'gpu', 'nvhpc -tp', 'nvhpc -gpu',
+                                  'specfem3d', 'xshells']))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
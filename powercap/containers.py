@@ -0,0 +1,163 @@
+"""
+Generate the container definitions of all applications for all clusters.
+
+Each HPCCM recipe of `RECIPES` is run for each cluster of the profiles (see
+`powercap/clusters.py`), on top of the dependency layers it declares (see
+`powercap/layers.py`), and the definitions are written once per layer:
+
+    <out>/layers/fall3d-netcdf-<key>.def          HDF5, PnetCDF, netCDF-C/Fortran
+    <out>/layers/openmpi-cuda-<key>.def           OFED, UCX, PMIx, OpenMPI
+    <out>/fall3d_leonardo.def
+    <out>/specfem3d_cartesian_thea.def
+    ...
+    <out>/build.sh
+
+The key of a layer is the SHA-256 of its definition, so it changes with the
+base image or the building blocks of the stack only: `build.sh` builds the
+layer images it does not find, then the applications on top of them, and
+SPECFEM3D and XSHELLS share the image of their MPI stack.
+
+    $ python -m powercap.containers -o containers
+    $ python -m powercap.containers -o containers --apps fall3d --clusters thea --userarg fall3d_single_precision=YES
+    $ sh containers/build.sh
+"""
+
+import argparse
+import os
+import shlex
+import sys
+
+import hpccm
+from hpccm.common import container_type
+from tabulate import tabulate
+
+from powercap import clusters, layers
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+#: HPCCM recipe of each application, relative to the repository
+RECIPES = {
+    'fall3d': 'applications/fall3d/hpccm/bb_recipe.py',
+    'specfem3d_cartesian': 'applications/specfem3d_cartesian/hpccm/recipe.py',
+    'xshells': 'applications/xshells/hpccm/geodynamo_recipe.py',
+    'xshells-mpi': 'applications/xshells/hpccm/geodynamo_recipe_custom_mpi.py',
+}
+
+#: `{format: (container type, extension of the definitions)}`
+FORMATS = {
+    'singularity': (container_type.SINGULARITY, '.def'),
+    'docker': (container_type.DOCKER, '.Dockerfile'),
+}
+
+
+def generate(out, apps=None, cluster_names=None, fmt='singularity', singularity_version='3.2',
+             layered=True, userarg=None):
+    '''Write the definitions of `apps` for `cluster_names` and of their layers to `out`.
+
+    Returns `[(app, cluster, definition, [layer])]`, the layers being `Layer`s.
+    '''
+    ctype, ext = FORMATS[fmt]
+    layers_dir = os.path.join(os.path.abspath(out), 'layers')
+    os.makedirs(layers_dir if layered else out, exist_ok=True)
+    ret = []
+    for app in apps or RECIPES:
+        for cluster in cluster_names or clusters.load():
+            args = dict(userarg or {}, cluster=cluster)
+            if layered:
+                args['layers'] = layers_dir
+
+            layers.registry.clear()
+            text = hpccm.recipe(os.path.join(ROOT, RECIPES[app]), ctype=ctype,
+                                raise_exceptions=True, singularity_version=singularity_version,
+                                userarg=args)
+            used = list(layers.registry.values())
+            for layer in used:
+                path = os.path.join(layers_dir, f'{layer.tag}{ext}')
+                if not os.path.exists(path):
+                    with open(path, 'w') as fp:
+                        fp.write(layer.text + '\n')
+
+            definition = os.path.join(out, f'{app}_{cluster}{ext}')
+            with open(definition, 'w') as fp:
+                fp.write(text + '\n')
+
+            ret.append((app, cluster, definition, used))
+
+    return ret
+
+
+def build_script(out, generated, fmt='singularity'):
+    '''Shell script building the layer images it does not find, then the applications.'''
+    lines = ['#!/bin/sh', '# Generated by python -m powercap.containers', 'set -e',
+             'cd "$(dirname "$0")"', 'out=$(pwd)']
+    done = set()
+    for _, _, _, used in generated:
+        for layer in used:
+            if layer.tag in done:
+                continue
+
+            done.add(layer.tag)
+            if fmt == 'singularity':
+                lines.append(f'[ -e layers/{layer.tag}.sif ] || '
+                             f'${{SINGULARITY:-singularity}} build layers/{layer.tag}.sif '
+                             f'layers/{layer.tag}.def')
+            else:
+                image = f'{layers.DOCKER_REPOSITORY}:{layer.tag}'
+                lines.append(f'docker image inspect {image} >/dev/null 2>&1 || '
+                             f'docker build -t {image} -f layers/{layer.tag}.Dockerfile layers')
+
+    for app, cluster, definition, _ in generated:
+        # Recipes copy files from their directory, the build context
+        context = shlex.quote(os.path.dirname(os.path.join(ROOT, RECIPES[app])))
+        name = os.path.splitext(os.path.basename(definition))[0]
+        if fmt == 'singularity':
+            lines.append(f'(cd {context} && ${{SINGULARITY:-singularity}} build '
+                         f'"$out/{name}.sif" "$out/{name}.def")')
+        else:
+            lines.append(f'docker build -t powercap/{app}:{cluster} '
+                         f'-f "$out/{name}.Dockerfile" {context}')
+
+    path = os.path.join(out, 'build.sh')
+    with open(path, 'w') as fp:
+        fp.write('\n'.join(lines) + '\n')
+
+    os.chmod(path, 0o755)
+    return path
+
+
+# ========================================================
+# Command line interface
+# ========================================================
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m powercap.containers',
+                                     description=__doc__.split('\n\n')[0])
+    parser.add_argument('-o', '--output', default='containers', help='output directory')
+    parser.add_argument('-a', '--apps', nargs='+', choices=list(RECIPES),
+                        help='applications (default: all)')
+    parser.add_argument('-c', '--clusters', nargs='+', help='clusters (default: all)')
+    parser.add_argument('--format', choices=list(FORMATS), default='singularity')
+    parser.add_argument('--singularity-version', default='3.2')
+    parser.add_argument('--no-layers', action='store_true',
+                        help='build the dependencies in the definition of each application')
+    parser.add_argument('--userarg', nargs='+', default=[], metavar='KEY=VALUE',
+                        help='user arguments passed to all the recipes')
+
+    args = parser.parse_args(argv)
+    unknown = set(args.clusters or []) - set(clusters.load())
+    if unknown:
+        parser.error(f'unknown clusters: {", ".join(sorted(unknown))}')
+
+    userarg = dict(arg.split('=', 1) for arg in args.userarg)
+    generated = generate(args.output, args.apps, args.clusters, args.format,
+                         args.singularity_version, not args.no_layers, userarg)
+    script = build_script(args.output, generated, args.format)
+    print(tabulate([[app, cluster, definition, ' '.join(layer.tag for layer in used)]
+                    for app, cluster, definition, used in generated],
+                   headers=['app', 'cluster', 'definition', 'layers']))
+    print(f'\nBuild with: sh {script}')
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,384 @@
+"""
+Cartesian domain decomposition of a grid over MPI ranks.
+
+Every way of writing the number of ranks as a product of one factor per grid
+dimension is a candidate, as long as no factor exceeds the number of cells
+along its dimension. Candidates are ranked by the cost of a rank, by default
+the halo cells it exchanges relative to the cells it owns (surface to
+volume), the load imbalance breaking ties. Alternatively a linear model of
+the run time in the cells and halo cells per rank is fitted to past runs, as
+found in the performance logs:
+
+    t = a + b * cells per rank + c * halo cells per rank
+
+Given the number of ranks per node, halo cells exchanged with another node
+count `NODE_WEIGHT` times those exchanged within the node; ranks are assumed
+numbered along the first dimension first, consecutive ranks sharing a node.
+
+The application checks go through `choose()`, usually by way of the
+`domain_decomposition` mixin (see `powercap/mixins.py`), which records the
+decomposition chosen for each application, grid, number of ranks and ranks
+per node in a cache file: the choice then stays the same from one campaign to
+the next, as do the builds of the applications that compile it in.
+
+    $ python -m powercap.decomposition 1000 1000 100 -n 16
+    $ python -m powercap.decomposition --fall3d applications/fall3d/raikoke-2019-large/Raikoke-2019.inp -n 8 12
+    $ python -m powercap.decomposition --fall3d Raikoke-2019.inp -n 16 --learn applications/fall3d/log/*.log
+    $ python -m powercap.decomposition 1000 1000 100 -n 16 32 --ranks-per-node 4
+    $ python -m powercap.decomposition --cache $WORK/decompositions.json
+"""
+
+import argparse
+import json
+import math
+import os
+import re
+import sys
+import uuid
+
+import numpy as np
+import pandas as pd
+from filelock import FileLock
+from tabulate import tabulate
+
+from powercap import perflog
+
+
+# ========================================================
+# Geometry
+# ========================================================
+
+def factorizations(n, ndim):
+    '''All tuples of `ndim` positive integers whose product is `n`.'''
+    if ndim == 1:
+        return [(n,)]
+
+    return [(p, *rest)
+            for p in range(1, n + 1) if n % p == 0
+            for rest in factorizations(n // p, ndim - 1)]
+
+
+def local_shape(grid, dims):
+    '''Cells per dimension of the largest subdomain.'''
+    return tuple(math.ceil(g / p) for g, p in zip(grid, dims))
+
+
+def cells(grid, dims):
+    return math.prod(local_shape(grid, dims))
+
+
+def halo_cells(grid, dims, halo=1):
+    '''Cells a rank inside the domain exchanges with its neighbours.'''
+    shape = local_shape(grid, dims)
+    return sum(2 * halo * math.prod(shape) // shape[i]
+               for i, p in enumerate(dims) if p > 1)
+
+
+def node_halo_cells(grid, dims, ranks_per_node, halo=1):
+    '''Most halo cells a rank exchanges with ranks of other nodes.'''
+    shape = local_shape(grid, dims)
+    faces = [halo * math.prod(shape) // shape[i] for i in range(len(dims))]
+    strides = [math.prod(dims[:i]) for i in range(len(dims))]
+    worst = 0
+    for rank in range(math.prod(dims)):
+        node = rank // ranks_per_node
+        exchanged = 0
+        for i, p in enumerate(dims):
+            coord = rank // strides[i] % p
+            for step in (-1, 1):
+                if 0 <= coord + step < p and \
+                   (rank + step * strides[i]) // ranks_per_node != node:
+                    exchanged += faces[i]
+
+        worst = max(worst, exchanged)
+
+    return worst
+
+
+#: Cost of a halo cell exchanged with another node relative to one exchanged
+#: within the node
+NODE_WEIGHT = 4.0
+
+
+def surface_to_volume(grid, dims, halo=1, ranks_per_node=None):
+    '''Halo cells per cell of a rank, weighting inter-node ones by `NODE_WEIGHT`.'''
+    surface = halo_cells(grid, dims, halo)
+    if ranks_per_node and ranks_per_node < math.prod(dims):
+        surface += (NODE_WEIGHT - 1) * node_halo_cells(grid, dims, ranks_per_node, halo)
+
+    return surface / cells(grid, dims)
+
+
+def imbalance(grid, dims):
+    '''Cells of the largest subdomain over the average.'''
+    return cells(grid, dims) * math.prod(dims) / math.prod(grid)
+
+
+# ========================================================
+# Cost model
+# ========================================================
+
+class CostModel:
+    '''Linear model of the run time in the cells and halo cells per rank.'''
+
+    def __init__(self, coef, halo=1):
+        self.coef = coef
+        self.halo = halo
+
+    @staticmethod
+    def _features(grid, dims, halo):
+        return [1.0, cells(grid, dims), halo_cells(grid, dims, halo)]
+
+    @classmethod
+    def fit(cls, samples, halo=1):
+        '''Fit to `(grid, dims, time)` samples.
+
+        Returns None if the samples do not determine the model, or if it
+        does not grow with the work or the communication of a rank.
+        '''
+        samples = list(samples)
+        if len(samples) < 3:
+            return None
+
+        x = np.array([cls._features(g, d, halo) for g, d, _ in samples])
+        y = np.array([t for _, _, t in samples])
+        coef, _, rank, _ = np.linalg.lstsq(x, y, rcond=None)
+        if rank < x.shape[1] or (coef[1:] < 0).any():
+            return None
+
+        return cls(coef, halo)
+
+    def predict(self, grid, dims):
+        return float(np.dot(self.coef, self._features(grid, dims, self.halo)))
+
+
+# e.g. 'Fall3d.x All Raikoke-2019.inp 4 2 1'
+FALL3D_DIMS = re.compile(r'\.inp\s+(\d+)\s+(\d+)\s+(\d+)')
+
+
+def samples_from_perflogs(table, grid, dims_pattern=FALL3D_DIMS,
+                          perf_var='elapsed_time'):
+    '''`(grid, dims, time)` samples of past runs of a test on `grid`.
+
+    The decomposition of each run is parsed out of its command line with
+    `dims_pattern`, e.g. `FALL3D_DIMS`.
+    '''
+    df = table if isinstance(table, pd.DataFrame) else table.to_pandas()
+    df = df[(df['perf_var'] == perf_var) & df['perf_value'].notna()]
+    samples = []
+    for row in df.itertuples():
+        # Either may be missing, e.g. in the legacy perflogs
+        command = ' '.join(c for c in (row.executable, row.executable_opts) if isinstance(c, str))
+        match = dims_pattern.search(command)
+        if match:
+            samples.append((tuple(grid), tuple(map(int, match.groups())), row.perf_value))
+
+    return samples
+
+
+# ========================================================
+# Solver
+# ========================================================
+
+def candidates(grid, n, model=None, halo=1, ranks_per_node=None):
+    '''Valid decompositions of `grid` over `n` ranks, best first.
+
+    Returns `(dims, cost)` pairs; the cost is the predicted run time with a
+    `model`, else the surface to volume ratio.
+    '''
+    ranked = []
+    for dims in factorizations(n, len(grid)):
+        if any(p > g for p, g in zip(dims, grid)):
+            continue
+
+        cost = (model.predict(grid, dims) if model is not None
+                else surface_to_volume(grid, dims, halo, ranks_per_node))
+        # Ties: better balanced, fewer ranks along a dimension, then split
+        # along the leading dimensions
+        ranked.append(((cost, imbalance(grid, dims), max(dims), tuple(-p for p in dims)),
+                       dims))
+
+    return [(dims, key[0]) for key, dims in sorted(ranked)]
+
+
+def decompose(grid, n, model=None, halo=1, ranks_per_node=None):
+    '''Best decomposition of `grid` over `n` ranks, as one factor per dimension.'''
+    ranked = candidates(grid, n, model, halo, ranks_per_node)
+    if not ranked:
+        raise ValueError(f'cannot decompose a {"x".join(map(str, grid))} grid '
+                         f'over {n} ranks')
+
+    return ranked[0][0]
+
+
+# ========================================================
+# Input files
+# ========================================================
+
+_NUMBER = r'([-+]?\d+(?:\.\d*)?(?:[eE][-+]?\d+)?)'
+
+
+def _inp_value(text, key):
+    match = re.search(rf'^\s*{key}\s*=\s*{_NUMBER}(.*)$', text, re.MULTILINE)
+    if match is None:
+        raise ValueError(f'{key} not found')
+
+    return float(match.group(1)), match.group(2)
+
+
+def read_fall3d_grid(path):
+    '''`(NX, NY, NZ)` of the GRID block of a FALL3D `.inp` file.
+
+    `NX`/`NY` given with `RESOLUTION=<deg>` are derived from the longitude
+    and latitude range, as FALL3D does.
+    '''
+    with open(path) as fp:
+        text = fp.read()
+
+    # Only the GRID block, comment lines removed
+    text = text[text.index('\n GRID'):]
+    text = '\n'.join(line for line in text.splitlines()
+                     if not line.strip().startswith('!'))
+    grid = []
+    for key, lo, hi in (('NX', 'LONMIN', 'LONMAX'), ('NY', 'LATMIN', 'LATMAX'),
+                        ('NZ', None, None)):
+        value, rest = _inp_value(text, key)
+        resolution = re.search(rf'RESOLUTION\s*=\s*{_NUMBER}', rest)
+        if resolution and lo:
+            extent = _inp_value(text, hi)[0] - _inp_value(text, lo)[0]
+            value = extent / float(resolution.group(1))
+
+        grid.append(int(round(value)))
+
+    return tuple(grid)
+
+
+def unknown_grid(n, ndim):
+    '''Stand-in for a grid that cannot be read, e.g. from an input file only
+    staged on the compute nodes: the ranks go to the first two dimensions.'''
+    return (n, n, *[1] * (ndim - 2))[:ndim]
+
+
+def globe_nproc(n, nchunks=1):
+    '''`NPROC_XI` (and `NPROC_ETA`) of SPECFEM3D_GLOBE on `n` ranks.
+
+    Each of the `nchunks` chunks of the cubed sphere is split into as many
+    slices along both directions.
+    '''
+    nproc = math.isqrt(n // nchunks)
+    if nchunks * nproc * nproc != n:
+        raise ValueError(f'SPECFEM3D_GLOBE needs {nchunks} x NPROC_XI^2 ranks, not {n}')
+
+    return nproc
+
+
+# ========================================================
+# Cache of choices
+# ========================================================
+
+class DecompositionCache:
+    '''JSON file of the decompositions chosen so far.'''
+
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+
+    @staticmethod
+    def key(app, grid, n, ranks_per_node=None):
+        return f'{app}/{"x".join(map(str, grid))}/{n}/{ranks_per_node or "-"}'
+
+    def _lock(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        return FileLock(f'{self.path}.lock')
+
+    def entries(self):
+        if not os.path.exists(self.path):
+            return {}
+
+        with open(self.path) as fp:
+            return json.load(fp)
+
+    def get(self, key):
+        dims = self.entries().get(key)
+        return tuple(dims) if dims is not None else None
+
+    def put(self, key, dims):
+        '''Record `dims` under `key`; returns the dims recorded first.'''
+        with self._lock():
+            entries = self.entries()
+            entries.setdefault(key, list(dims))
+            tmp = f'{self.path}.{uuid.uuid4().hex}'
+            with open(tmp, 'w') as fp:
+                json.dump(entries, fp, indent=2, sort_keys=True)
+
+            os.replace(tmp, self.path)
+
+        return tuple(entries[key])
+
+
+def choose(app, grid, n, ranks_per_node=None, model=None, cache=None, halo=1):
+    '''Decomposition of `grid` over `n` ranks for `app`, through `cache` if given.'''
+    key = DecompositionCache.key(app, grid, n, ranks_per_node)
+    dims = cache.get(key) if cache is not None else None
+    if dims is None:
+        dims = decompose(grid, n, model, halo, ranks_per_node)
+        if cache is not None:
+            dims = cache.put(key, dims)
+
+    return dims
+
+
+# ========================================================
+# Command line interface
+# ========================================================
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m powercap.decomposition',
+                                     description=__doc__.split('\n\n')[0])
+    parser.add_argument('grid', nargs='*', type=int, help='cells per dimension')
+    parser.add_argument('--fall3d', metavar='INP', help='read the grid of a FALL3D input file')
+    parser.add_argument('-n', '--ranks', nargs='+', type=int)
+    parser.add_argument('--ranks-per-node', type=int,
+                        help='weight the halo exchanged between nodes')
+    parser.add_argument('--halo', type=int, default=1,
+                        help='halo width in cells (default: %(default)s)')
+    parser.add_argument('--learn', nargs='+', metavar='PERFLOG',
+                        help='fit the cost model to the runs of these perflogs')
+    parser.add_argument('--top', type=int, default=5,
+                        help='candidates listed per number of ranks (default: %(default)s)')
+    parser.add_argument('--cache', help='list the choices recorded in a cache file')
+
+    args = parser.parse_args(argv)
+    if args.cache:
+        print(tabulate(sorted((k, 'x'.join(map(str, v)))
+                              for k, v in DecompositionCache(args.cache).entries().items()),
+                       headers=['application/grid/ranks/ranks per node', 'dims']))
+        return
+
+    grid = read_fall3d_grid(args.fall3d) if args.fall3d else tuple(args.grid)
+    if not grid or not args.ranks:
+        parser.error('a grid or --fall3d, and --ranks are required')
+
+    model = None
+    if args.learn:
+        samples = samples_from_perflogs(perflog.read_perflogs(files=args.learn), grid)
+        model = CostModel.fit(samples, args.halo)
+        print(f'{len(samples)} past run(s); ' +
+              (f'model coefficients {model.coef}' if model is not None
+               else 'no model fits them, using surface to volume'))
+
+    print(f'grid {"x".join(map(str, grid))}\n')
+    rows = []
+    for n in args.ranks:
+        ranked = candidates(grid, n, model, args.halo, args.ranks_per_node)
+        for i, (dims, cost) in enumerate(ranked[:args.top]):
+            rows.append([n if i == 0 else '', 'x'.join(map(str, dims)),
+                         'x'.join(map(str, local_shape(grid, dims))), cost,
+                         imbalance(grid, dims)])
+
+    print(tabulate(rows, headers=['ranks', 'dims', 'subdomain',
+                                  'time' if model is not None else 'surface/volume',
+                                  'imbalance'], floatfmt='.4g'))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
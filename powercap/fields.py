@@ -0,0 +1,160 @@
+"""
+Regression check of gridded output fields against a reference run.
+
+Selected variables of a NetCDF output, e.g. the `tephra_grn_load` ground load
+and `tephra_col_mass` column mass of FALL3D, are compared with the same
+variables of a reference output of the same case. Both files are read in
+slabs along their first, i.e. time, dimension of at most `--chunk-mb`
+megabytes each, and the error norms are accumulated slab by slab, so that
+memory stays bounded whatever the size of the output and the check fits on a
+login node:
+
+    rel_l2   ||u - u_ref||_2 / ||u_ref||_2
+    rel_max  max|u - u_ref| / max|u_ref|
+
+Masked and non-finite values count as zero. A variable passes if both norms
+are within the tolerance.
+
+Reading NetCDF files requires the `netCDF4` package, which is only imported
+when a file is opened.
+
+    $ python -m powercap.fields Raikoke-2019.res.nc reference/Raikoke-2019.res.nc
+    $ python -m powercap.fields Raikoke-2019.res.nc reference/Raikoke-2019.res.nc -v tephra_col_mass --tolerance 1e-6
+"""
+
+import argparse
+import math
+import sys
+
+import numpy as np
+from tabulate import tabulate
+
+
+#: FALL3D ground load and column mass
+DEFAULT_VARIABLES = ['tephra_grn_load', 'tephra_col_mass']
+
+DEFAULT_TOLERANCE = 1e-3
+
+#: Default size of a slab in megabytes
+DEFAULT_CHUNK_MB = 256.0
+
+
+def open_dataset(path):
+    '''NetCDF dataset at `path`, opened read-only.'''
+    try:
+        import netCDF4
+    except ImportError:
+        raise ImportError('reading NetCDF files requires the netCDF4 package') from None
+
+    dataset = netCDF4.Dataset(path, 'r')
+    dataset.set_auto_mask(True)
+    return dataset
+
+
+def slabs(shape, itemsize, max_bytes):
+    '''Slices of the first dimension of at most `max_bytes` each, one entry at least.'''
+    if not shape:
+        yield ()
+        return
+
+    entry = itemsize * math.prod(shape[1:])
+    step = max(1, int(max_bytes // max(entry, 1)))
+    for start in range(0, shape[0], step):
+        yield slice(start, min(start + step, shape[0]))
+
+
+def _values(data):
+    data = np.ma.filled(np.ma.asarray(data, dtype=np.float64), 0.0)
+    return np.nan_to_num(data, nan=0.0, posinf=0.0, neginf=0.0)
+
+
+class Norms:
+    '''Error norms accumulated over the slabs of a variable.'''
+
+    def __init__(self):
+        self.diff_sq = self.ref_sq = 0.0
+        self.diff_max = self.ref_max = 0.0
+
+    def update(self, values, ref):
+        diff = _values(values) - _values(ref)
+        ref = _values(ref)
+        self.diff_sq += float(np.square(diff).sum())
+        self.ref_sq += float(np.square(ref).sum())
+        self.diff_max = max(self.diff_max, float(np.abs(diff).max(initial=0.0)))
+        self.ref_max = max(self.ref_max, float(np.abs(ref).max(initial=0.0)))
+
+    @staticmethod
+    def _relative(error, scale):
+        if scale > 0:
+            return error / scale
+
+        return 0.0 if error == 0 else math.inf
+
+    @property
+    def rel_l2(self):
+        return self._relative(math.sqrt(self.diff_sq), math.sqrt(self.ref_sq))
+
+    @property
+    def rel_max(self):
+        return self._relative(self.diff_max, self.ref_max)
+
+
+def compare(path, ref_path, variables=None, chunk_mb=DEFAULT_CHUNK_MB):
+    '''`{variable: Norms}` of the `variables` of `path` against the ones of `ref_path`.'''
+    variables = variables or DEFAULT_VARIABLES
+    max_bytes = chunk_mb * (1 << 20)
+    norms = {}
+    with open_dataset(path) as out, open_dataset(ref_path) as ref:
+        for name in variables:
+            for dataset, filename in ((out, path), (ref, ref_path)):
+                if name not in dataset.variables:
+                    raise ValueError(f'no variable {name!r} in {filename}; available: '
+                                     f'{", ".join(dataset.variables)}')
+
+            var, ref_var = out.variables[name], ref.variables[name]
+            if var.shape != ref_var.shape:
+                raise ValueError(f'{name!r} is {var.shape} in {path} '
+                                 f'but {ref_var.shape} in {ref_path}')
+
+            # Both slabs of a step are in memory at once
+            norms[name] = Norms()
+            for index in slabs(var.shape, var.dtype.itemsize, max_bytes / 2):
+                norms[name].update(var[index], ref_var[index])
+
+    return norms
+
+
+def failures(norms, tolerance=DEFAULT_TOLERANCE):
+    '''`(variable, norm, value)` of the norms above `tolerance`.'''
+    return [(name, key, getattr(n, key))
+            for name, n in norms.items() for key in ('rel_l2', 'rel_max')
+            if not getattr(n, key) <= tolerance]
+
+
+# ========================================================
+# Command line interface
+# ========================================================
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m powercap.fields',
+                                     description=__doc__.split('\n\n')[0])
+    parser.add_argument('output', help='NetCDF output of the run')
+    parser.add_argument('reference', help='NetCDF output of the reference run')
+    parser.add_argument('-v', '--variables', nargs='+', default=DEFAULT_VARIABLES,
+                        help='variables to compare (default: %(default)s)')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help='tolerance of the relative norms (default: %(default)s)')
+    parser.add_argument('--chunk-mb', type=float, default=DEFAULT_CHUNK_MB,
+                        help='size of the slabs read at once (default: %(default)s)')
+
+    args = parser.parse_args(argv)
+    norms = compare(args.output, args.reference, args.variables, args.chunk_mb)
+    failed = failures(norms, args.tolerance)
+    print(tabulate([[name, n.rel_l2, n.rel_max] for name, n in norms.items()],
+                   headers=['variable', 'rel_l2', 'rel_max'], floatfmt='.3g'))
+    print(f'\n{len(failed)} norms above {args.tolerance:g}')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
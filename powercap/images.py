@@ -0,0 +1,262 @@
+"""
+Cache of container images verified against the base images of their recipes.
+
+The HPCCM recipes under `applications/*/hpccm` build on the base images the
+cluster profiles pin by digest (see `powercap/clusters.py`), older recipes
+on the ones of their own `cluster_configs`:
+
+    cluster_configs = {
+        'thea': {
+            'digest_devel': 'sha256:da05...',
+            'digest_runtime': 'sha256:fb36...',
+            ...
+
+An image added to the cache is first checked against these pins: the
+definition file embedded in the SIF (`singularity inspect --deffile`) names
+the base image of each stage, e.g. `From: nvcr.io/nvidia/nvhpc@sha256:fb36...`
+or a local `nvhpc@sha256_fb36....sif`, and every one of them must be pinned
+for the cluster. A stage starting from a dependency layer image is checked
+against the base image the layer names in the definition (see
+`powercap/layers.py`). Images built from bases not named by digest
+are rejected, unless unpinned images are allowed (`--allow-unpinned`), in
+which case they are cached as `unpinned`. The image is then stored by the
+SHA-256 of its contents:
+
+    <cache>/<sha[:2]>/<sha>.sif
+    <cache>/<sha[:2]>/<sha>.json
+
+so that jobs run from an immutable copy, however the shared original is
+rebuilt in the meantime, and an image is verified once whatever the number of
+jobs using it. The digests of the originals are remembered by path, size and
+modification time (as in `powercap/refcache.py`).
+
+    $ python -m powercap.images pins applications/fall3d/hpccm/bb_recipe.py
+    $ python -m powercap.images --cache $WORK/powercap/images add fall3d.sif --recipe applications/fall3d/hpccm/bb_recipe.py --cluster thea
+    $ python -m powercap.images --cache $WORK/powercap/images list
+"""
+
+import argparse
+import ast
+import datetime
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import time
+import uuid
+
+from filelock import FileLock
+from tabulate import tabulate
+
+from powercap import clusters, refcache
+
+
+#: Container runtimes able to inspect a SIF, in order of preference
+RUNTIMES = ('apptainer', 'singularity')
+
+_FROM_DIGEST = re.compile(r'^\s*(?:From:|# Dependency layer \S+ [0-9a-f]{64} on)'
+                          r'\s*\S*?sha256[:_]([0-9a-f]{64})', re.MULTILINE | re.IGNORECASE)
+
+
+def recipe_pins(path):
+    '''`{cluster: {stage or image: digest}}` of the base images of an HPCCM recipe.
+
+    The recipe is parsed, not run, so that HPCCM need not be installed; without
+    `cluster_configs` of its own, it builds on the cluster profiles.
+    '''
+    with open(path) as fp:
+        tree = ast.parse(fp.read(), filename=path)
+
+    for node in tree.body:
+        if (isinstance(node, ast.Assign) and
+            any(isinstance(t, ast.Name) and t.id.lower() == 'cluster_configs' for t in node.targets)):
+            configs = ast.literal_eval(node.value)
+            return {cluster: {stage: config[f'digest_{stage}'] for stage in ('devel', 'runtime')
+                              if f'digest_{stage}' in config}
+                    for cluster, config in configs.items()}
+
+    return {name: profile.pins() for name, profile in clusters.load().items()}
+
+
+def deffile_digests(deffile):
+    '''Digests of the base images of the stages of a definition file, in order.'''
+    return [f'sha256:{digest}' for digest in _FROM_DIGEST.findall(deffile)]
+
+
+def inspect_deffile(image, runtime=None):
+    '''Definition file embedded in the SIF `image`.'''
+    runtime = runtime or next((r for r in RUNTIMES if shutil.which(r)), None)
+    if runtime is None:
+        raise RuntimeError(f'inspecting {image} requires one of: {", ".join(RUNTIMES)}')
+
+    return subprocess.run([runtime, 'inspect', '--deffile', image], capture_output=True,
+                          text=True, check=True).stdout
+
+
+def check_pins(image, digests, pins, allow_unpinned=False):
+    '''Raise if any of the base images `digests` of `image` is not in `pins`.
+
+    An image naming no base image by digest cannot be checked, and is only
+    accepted with `allow_unpinned`.
+    '''
+    if not digests and not allow_unpinned:
+        raise ValueError(f'{image}: no base image named by digest in its definition, '
+                         f'so it cannot be checked against the pins of its recipe')
+
+    unknown = [d for d in digests if d not in pins.values()]
+    if unknown:
+        raise ValueError(f'{image}: base images {", ".join(unknown)} are not pinned by its '
+                         f'recipe ({", ".join(f"{s}={d}" for s, d in pins.items())})')
+
+
+def verify(image, pins, runtime=None, allow_unpinned=False):
+    '''`(status, base images)` of `image` against `pins`; raises if not pinned.'''
+    digests = deffile_digests(inspect_deffile(image, runtime))
+    check_pins(image, digests, pins, allow_unpinned)
+    return 'verified' if digests else 'unpinned', digests
+
+
+class ImageCache:
+    '''Directory of container images keyed by the digests of their contents.'''
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+
+    def _lock(self):
+        os.makedirs(self.root, exist_ok=True)
+        return FileLock(os.path.join(self.root, '.lock'))
+
+    def digest(self, path):
+        return refcache.ReferenceCache(self.root).digests([path])[0]
+
+    def entry_path(self, digest, ext='.sif'):
+        digest = digest.split(':')[-1]
+        return os.path.join(self.root, digest[:2], f'{digest}{ext}')
+
+    def meta(self, digest):
+        with open(self.entry_path(digest, '.json')) as fp:
+            return json.load(fp)
+
+    def add(self, image, pins=None, runtime=None, allow_unpinned=False):
+        '''Metadata of the cached copy of `image`, verified against `pins` if given.'''
+        digest = f'sha256:{self.digest(image)}'
+        path = self.entry_path(digest)
+        if os.path.exists(path):
+            meta = self.meta(digest)
+            if pins is None:
+                return meta
+
+            if meta['status'] != 'unchecked':
+                # Inspected once, possibly against the pins of another cluster
+                check_pins(image, meta['base_images'], pins, allow_unpinned)
+                return meta
+
+        status, base_images = ('unchecked', [])
+        if pins is not None:
+            status, base_images = verify(image, pins, runtime, allow_unpinned)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._lock():
+            if not os.path.exists(path):
+                tmp = f'{path}.{uuid.uuid4().hex}'
+                shutil.copyfile(image, tmp)
+                os.chmod(tmp, 0o444)
+                os.replace(tmp, path)
+
+            meta = {
+                'digest': digest,
+                'source': os.path.abspath(image),
+                'size': os.path.getsize(path),
+                'status': status,
+                'base_images': base_images,
+                'added': time.time(),
+            }
+            tmp = f'{path}.{uuid.uuid4().hex}.json'
+            with open(tmp, 'w') as fp:
+                json.dump(meta, fp, indent=2, sort_keys=True)
+
+            os.replace(tmp, self.entry_path(digest, '.json'))
+
+        return meta
+
+    def entries(self):
+        '''Metadata of all images, oldest first.'''
+        ret = []
+        for prefix in sorted(os.listdir(self.root)) if os.path.isdir(self.root) else []:
+            if len(prefix) != 2 or not os.path.isdir(os.path.join(self.root, prefix)):
+                continue
+
+            for name in os.listdir(os.path.join(self.root, prefix)):
+                digest, ext = os.path.splitext(name)
+                if ext == '.json' and os.path.exists(self.entry_path(digest)):
+                    ret.append(self.meta(digest))
+
+        return sorted(ret, key=lambda m: m['added'])
+
+    def remove(self, digest):
+        for ext in ('.sif', '.json'):
+            if os.path.exists(self.entry_path(digest, ext)):
+                os.remove(self.entry_path(digest, ext))
+
+
+# ========================================================
+# Command line interface
+# ========================================================
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m powercap.images',
+                                     description=__doc__.split('\n\n')[0])
+    parser.add_argument('--cache', help='cache directory')
+    commands = parser.add_subparsers(dest='command', required=True)
+    pins_cmd = commands.add_parser('pins', help='list the base images pinned by recipes')
+    pins_cmd.add_argument('recipes', nargs='+')
+    add_cmd = commands.add_parser('add', help='verify and cache images')
+    add_cmd.add_argument('images', nargs='+')
+    add_cmd.add_argument('--recipe', help='HPCCM recipe pinning the base images')
+    add_cmd.add_argument('--cluster', help='cluster of the recipe the images are built for')
+    add_cmd.add_argument('--runtime', choices=RUNTIMES, help='container runtime inspecting them')
+    add_cmd.add_argument('--allow-unpinned', action='store_true',
+                         help='accept images naming no base image by digest')
+    commands.add_parser('list', help='list the cached images')
+    remove_cmd = commands.add_parser('remove', help='remove cached images')
+    remove_cmd.add_argument('digests', nargs='+', help='digests or digest prefixes')
+
+    args = parser.parse_args(argv)
+    if args.command == 'pins':
+        print(tabulate([[recipe, cluster, stage, digest]
+                        for recipe in args.recipes
+                        for cluster, pins in recipe_pins(recipe).items()
+                        for stage, digest in pins.items()],
+                       headers=['recipe', 'cluster', 'base image', 'digest']))
+        return 0
+
+    if not args.cache:
+        parser.error(f'{args.command} requires --cache')
+
+    cache = ImageCache(args.cache)
+    if args.command == 'add':
+        pins = None
+        if args.recipe:
+            if not args.cluster:
+                parser.error('--recipe requires --cluster')
+
+            pins = recipe_pins(args.recipe)[args.cluster]
+
+        for image in args.images:
+            meta = cache.add(image, pins, args.runtime, args.allow_unpinned)
+            print(f'{image}: {meta["status"]} {cache.entry_path(meta["digest"])}')
+    elif args.command == 'list':
+        print(tabulate([[m['digest'][7:19], m['status'], m['size'], m['source'],
+                         datetime.datetime.fromtimestamp(m['added']).isoformat(' ', 'seconds')]
+                        for m in cache.entries()],
+                       headers=['digest', 'status', 'bytes', 'source', 'added']))
+    else:
+        prefixes = [d.split(':')[-1] for d in args.digests]
+        for meta in cache.entries():
+            if any(meta['digest'][7:].startswith(p) for p in prefixes):
+                cache.remove(meta['digest'])
+
+
+if __name__ == '__main__':
+    sys.exit(main())
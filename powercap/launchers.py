@@ -0,0 +1,300 @@
+"""
+Composable job launchers.
+
+A launcher is named by a base launcher followed by an ordered stack of
+modifiers, each optionally taking an argument after a colon:
+
+    srun-pmix+nsys+powermon
+    mpirun-mapby+bind:core+gpu
+    srun-pmix+nsys:cuda,nvtx
+
+Base launchers are ReFrame's `srun` and `mpirun` and the ones registered by
+the site configurations with `register_base_launcher`, since their options
+depend on the system. Every base launcher is either of the `srun` or of the
+`mpirun` kind, which the modifiers use to pick the matching options. A
+modifier contributes to any of the parts of the launch, which is put
+together as
+
+    <prefix> <launcher> <options> <user options> <wrapper> <executable>
+
+Available modifiers:
+
+    nsys[:<trace>]        profile each rank with Nsight Systems
+    nsys-outer[:<trace>]  profile the launcher process with Nsight Systems
+    powermon[:<source>]   sample power on every node while the ranks run
+                          (`python -m powercap.power wrap`)
+    bind[:<unit>]         bind the ranks to CPU cores (or the given unit)
+    gpu[:<count>]         give each rank one GPU of the node, closest first
+    affinity[:<file>]     bind each rank to a GPU, to cores of the NUMA
+                          domain of its GPU and to a NIC of that domain
+                          (see `powercap/affinity.py`)
+
+The `gpu` and `affinity` modifiers place the ranks on the topology of the
+launcher, which `make_launcher` derives from the partition: its `processor`
+and `devices` entries, or the topology dump file named by the
+`topology_file` entry of its `extras`; `affinity:<file>` reads the topology
+from the given dump file instead.
+
+Composed launchers are registered with ReFrame the first time they are looked
+up through `getlauncher`, which the checks use in place of the one of
+`reframe.core.backends`. Launchers that used to be separate classes are kept
+as aliases, e.g. `srun-pmix-nsys` for `srun-pmix+nsys`.
+"""
+
+import os
+import sys
+import types
+
+from reframe.core.backends import getlauncher as _rfm_getlauncher
+from reframe.core.backends import register_launcher
+from reframe.core.exceptions import ConfigError
+from reframe.core.launchers import JobLauncher
+
+from powercap import affinity
+
+
+KINDS = ('srun', 'mpirun')
+
+# name -> (kind, command(job))
+_BASES = {}
+
+# name -> modifier(launcher, job, arg)
+_MODIFIERS = {}
+
+# name -> launcher specification
+_ALIASES = {}
+
+_PARTS = ('prefix', 'launcher', 'options', 'wrapper')
+
+
+def parse(name):
+    '''Split a launcher name into its base launcher and its `(modifier, arg)` list.'''
+    name = _ALIASES.get(name, name)
+    base, *mods = name.split('+')
+    if base not in _BASES:
+        raise ConfigError(f'no such base launcher: {base!r}')
+
+    modifiers = []
+    for mod in mods:
+        mod, _, arg = mod.partition(':')
+        if mod not in _MODIFIERS:
+            raise ConfigError(f'no such launcher modifier: {mod!r}')
+
+        modifiers.append((mod, arg or None))
+
+    return base, modifiers
+
+
+def kind_of(name):
+    '''Kind of the base launcher of `name`, i.e. `srun` or `mpirun`.'''
+    return _BASES[parse(name)[0]][0]
+
+
+def has_modifier(name, modifier):
+    return any(mod == modifier for mod, _ in parse(name)[1])
+
+
+class ComposedLauncher(JobLauncher):
+    '''A base launcher with a stack of modifiers.'''
+
+    base = None
+    modifiers = []
+
+    #: Node topology, see `powercap.affinity`
+    topology = None
+
+    @property
+    def kind(self):
+        return _BASES[self.base][0]
+
+    def parts(self, job):
+        kind, command = _BASES[self.base]
+        parts = {p: [] for p in _PARTS}
+        parts['launcher'] = list(command(job))
+        for mod, arg in self.modifiers:
+            for part, tokens in _MODIFIERS[mod](self, job, arg).items():
+                parts[part] += tokens
+
+        return parts
+
+    def command(self, job):
+        parts = self.parts(job)
+        return parts['prefix'] + parts['launcher'] + parts['options'] + parts['wrapper']
+
+    def run_command(self, job):
+        # User options, e.g. `--cpu-freq` of a cap sweep, go to the launcher
+        # and not to the wrapper commands of the modifiers
+        parts = self.parts(job)
+        tokens = []
+        if self.modifier:
+            tokens += [self.modifier, *self.modifier_options]
+
+        tokens += (parts['prefix'] + parts['launcher'] + parts['options'] +
+                   self.options + parts['wrapper'])
+        return ' '.join(tokens)
+
+
+def _compose(name):
+    base, modifiers = parse(name)
+    attrs = {'base': base, 'modifiers': modifiers}
+    cls = types.new_class(f'ComposedLauncher[{name}]', (ComposedLauncher,),
+                          exec_body=lambda ns: ns.update(attrs))
+    return register_launcher(name)(cls)
+
+
+def getlauncher(name):
+    '''Launcher class of `name`, composing and registering it if needed.'''
+    try:
+        return _rfm_getlauncher(name)
+    except ConfigError:
+        if '+' not in name:
+            raise
+
+    return _compose(name)
+
+
+def partition_topology(partition):
+    '''Node topology of a ReFrame system partition.'''
+    topology_file = partition.extras.get('topology_file')
+    if topology_file:
+        return affinity.load_topology(os.path.expandvars(topology_file))
+
+    num_gpus = sum(d.num_devices for d in partition.devices if d.type == 'gpu')
+    return affinity.topology_from_processor(partition.processor.info, num_gpus)
+
+
+def make_launcher(name, partition=None):
+    '''Launcher `name` placing the ranks on the nodes of `partition`.'''
+    launcher = getlauncher(name)()
+    if partition is not None and isinstance(launcher, ComposedLauncher):
+        launcher.topology = partition_topology(partition)
+
+    return launcher
+
+
+# ========================================================
+# Registration
+# ========================================================
+
+def register_base_launcher(name, kind):
+    '''Decorator registering `command(job)` as the base launcher `name`.'''
+    if kind not in KINDS:
+        raise ValueError(f'launcher kind must be one of {KINDS}: {kind!r}')
+
+    def _register(command):
+        _BASES[name] = (kind, command)
+        _compose(name)
+        return command
+
+    return _register
+
+
+def _register_builtin(name, kind):
+    # ReFrame's own launchers, usable as bases, e.g. `srun+affinity`
+    _BASES[name] = (kind, lambda job: _rfm_getlauncher(name)().command(job))
+
+
+_register_builtin('srun', 'srun')
+_register_builtin('mpirun', 'mpirun')
+
+
+def register_modifier(name):
+    '''Decorator registering `modifier(launcher, job, arg)` as the modifier `name`.
+
+    The modifier returns the tokens to add to each part of the launch, as a
+    dictionary keyed by `prefix`, `launcher`, `options` or `wrapper`.
+    '''
+    def _register(modifier):
+        _MODIFIERS[name] = modifier
+        return modifier
+
+    return _register
+
+
+def register_alias(name, spec):
+    '''Register the launcher `name` as another name for `spec`.'''
+    _ALIASES[name] = spec
+    _compose(name)
+
+
+# ========================================================
+# Modifiers
+# ========================================================
+
+_NSYS_OPTIONS = ['--stats=true', '--cuda-memory-usage=true']
+
+
+@register_modifier('nsys')
+def nsys(launcher, job, trace):
+    srun = launcher.kind == 'srun'
+    rank = '%q{SLURM_PROCID}' if srun else '%q{OMPI_COMM_WORLD_RANK}'
+    node = '%q{SLURM_NODEID}' if srun else '%h'
+    return {'wrapper': ['nsys profile',
+                        f'-o ${{PWD}}/output_{node}_{rank}',
+                        f'-t {trace or "cuda,nvtx,osrt,mpi"}',
+                        *_NSYS_OPTIONS,
+                        '--cudabacktrace=true']}
+
+
+@register_modifier('nsys-outer')
+def nsys_outer(launcher, job, trace):
+    return {'prefix': ['nsys profile', f'-t {trace or "cuda,nvtx,osrt,mpi"}',
+                       *_NSYS_OPTIONS]}
+
+
+@register_modifier('powermon')
+def powermon(launcher, job, source):
+    from powercap.mixins import powercap_command
+
+    return {'wrapper': [powercap_command(
+        sys.executable, 'power', 'wrap',
+        f'--source {source or "nvidia-smi"}',
+        '--output ${PWD}/powermon_%h.bin',
+        '--'
+    )]}
+
+
+@register_modifier('bind')
+def bind(launcher, job, unit):
+    if launcher.kind == 'srun':
+        return {'options': [f'--cpu-bind={unit or "cores"}']}
+
+    return {'options': [f'--bind-to {unit or "core"}']}
+
+
+def _placements(launcher, job, topology=None):
+    if topology is None:
+        topology = launcher.topology
+
+    if topology is None:
+        raise ConfigError(f'launcher {launcher.registered_name!r} has no node '
+                          f'topology: create it with make_launcher()')
+
+    tasks_per_node = job.num_tasks_per_node or job.num_tasks or 1
+    return affinity.rank_map(topology, tasks_per_node, job.num_cpus_per_task or 1)
+
+
+def _wrapper(placements, **apply):
+    wrapper = affinity.wrapper_command(placements, **apply)
+    return [wrapper] if wrapper else []
+
+
+@register_modifier('gpu')
+def gpu(launcher, job, count):
+    topology = affinity.topology_from_processor({}, int(count)) if count else None
+    placements = _placements(launcher, job, topology)
+    if launcher.kind == 'srun':
+        return {'options': affinity.srun_options(placements, cpus=False)}
+
+    return {'wrapper': _wrapper(placements, cpus=False, nics=False)}
+
+
+@register_modifier('affinity')
+def affinity_(launcher, job, topology_file):
+    topology = affinity.load_topology(topology_file) if topology_file else None
+    placements = _placements(launcher, job, topology)
+    if launcher.kind == 'srun':
+        return {'options': affinity.srun_options(placements),
+                'wrapper': _wrapper(placements, cpus=False, gpus=False)}
+
+    return {'wrapper': _wrapper(placements)}
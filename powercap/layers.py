@@ -0,0 +1,173 @@
+"""
+Dependency layers shared by the HPCCM recipes.
+
+A recipe adds the building blocks of the stack its application builds on
+(HDF5 and netCDF for FALL3D, OFED, UCX and OpenMPI for SPECFEM3D, ...) to a
+`Layer` rather than to `Stage0`:
+
+    netcdf = layers.Layer('fall3d-netcdf', USERARG.get('layers'),
+                          image=params['image_devel'], _distro=..., _arch=..., _as='devel')
+    netcdf += hdf5
+    ...
+    Stage0 += netcdf.devel()
+    Stage0 += generic_cmake(...)                  # the application
+    ...
+    Stage1 += netcdf.runtime(_from='devel')
+    Stage1 += Stage0.runtime(_from='devel')
+
+By default the blocks are emitted in place, and the definition is the one of
+the recipe alone. Given the `layers` user argument, the devel stage starts
+instead from the image of the layer, built once from its own definition and
+identified by the SHA-256 of it, i.e. of its base image and of the parameters
+of its building blocks, and names both in a comment:
+
+    <layers>/<name>-<key[:12]>.sif                Singularity
+    powercap-layers:<name>-<key[:12]>             Docker
+    # Dependency layer <name> <key> on nvcr.io/nvidia/nvhpc@sha256:...
+
+so that a change of the application, or of its build flags, does not rebuild
+the stack, and that recipes building on the same stack share its image. The
+layers a recipe used are recorded in `registry`, see `powercap/containers.py`.
+"""
+
+import hashlib
+
+import hpccm
+from hpccm.common import container_type
+from hpccm.primitives import baseimage, comment, environment
+
+
+#: Docker repository of the layer images
+DOCKER_REPOSITORY = 'powercap-layers'
+
+#: `{tag: Layer}` of the layers used by the recipes run so far
+registry = {}
+
+
+class Layer:
+    '''Building blocks of a stack built into an image of its own.
+
+    `layers` is the directory of the layer images (or any value, for Docker),
+    None to emit the blocks in the definition of the recipe; the other keyword
+    arguments are the ones of the `baseimage` of the stack.
+    '''
+
+    def __init__(self, name, layers=None, **base):
+        self.name = name
+        self.layers = layers
+        self.base = base
+        # Before the blocks: the base image sets the distribution they target
+        self.baseimage = baseimage(**base)
+        self.blocks = []
+        self.replayed = []
+        self.text = self.key = self.tag = None
+
+    def __iadd__(self, block):
+        return self.add(block)
+
+    def add(self, block, replay=False):
+        '''Add `block`, or a list of blocks; a replayed block, e.g. loading an
+        environment module, is also emitted on top of the layer image, as its
+        effect does not persist in it.
+        '''
+        blocks = block if isinstance(block, list) else [block]
+        self.blocks.extend(blocks)
+        if replay:
+            self.replayed.extend(blocks)
+
+        return self
+
+    def definition(self):
+        '''Definition of the layer image, for the current container type.'''
+        stage = hpccm.Stage()
+        stage += baseimage(**{k: v for k, v in self.base.items() if k != '_as'})
+        stage += self.blocks
+        return str(stage)
+
+    def devel(self):
+        '''Instructions of the devel stage, from its base image to the stack.'''
+        if self.layers is None:
+            return [self.baseimage, *self.blocks]
+
+        # Rendered now, with the configuration (container type, CPU target...) of the recipe
+        self.text = self.definition()
+        self.key = hashlib.sha256(self.text.encode()).hexdigest()
+        self.tag = f'{self.name}-{self.key[:12]}'
+        registry[self.tag] = self
+
+        base = dict(self.base)
+        if hpccm.config.g_ctype == container_type.DOCKER:
+            base['image'] = f'{DOCKER_REPOSITORY}:{self.tag}'
+        else:
+            base.update(image=f'{self.layers.rstrip("/")}/{self.tag}.sif', _bootstrap='localimage')
+
+        # The base image of the layer is named in the definition, so that the
+        # image is still checked against its pins (see `powercap/images.py`)
+        ret = [baseimage(**base),
+               comment(f'Dependency layer {self.name} {self.key} on {self.base["image"]}',
+                       reformat=False)]
+        # Singularity keeps neither the %environment nor the %post exports of
+        # the image it bootstraps from
+        for block in self.blocks:
+            if isinstance(block, environment) or block in self.replayed:
+                ret.append(block)
+            elif hasattr(block, 'environment_step') and block.environment_step():
+                ret.append(environment(variables=block.environment_step()))
+
+        return ret
+
+    def runtime(self, _from):
+        '''Instructions copying the runtime of the stack from the stage `_from`,
+        none if the blocks are in that stage already.
+        '''
+        if self.layers is None:
+            return []
+
+        stage = hpccm.Stage()
+        stage += self.blocks
+        return stage.runtime(_from=_from)
+
+
+# ========================================================
+# Stacks
+# ========================================================
+
+def mpi_stack(params):
+    '''Building blocks of the CUDA-aware OpenMPI over the network stack of the cluster.'''
+    from hpccm.building_blocks import (knem, mlnx_ofed, openmpi, packages, pmix, python, ucx,
+                                       xpmem)
+
+    blocks = [
+        packages(apt=['gcc', 'g++', 'gfortran', 'libz-dev'], epel=True),
+        python(python2=False),
+    ]
+    netconfig = params['network_stack']
+
+    # Mellanox OFED userspace libraries, KNEM headers, XPMEM userspace library
+    blocks.append(mlnx_ofed(version=netconfig['mlnx_ofed']))
+    knem_prefix = '/usr/local/knem' if netconfig['knem'] else False
+    if knem_prefix:
+        blocks.append(knem(prefix=knem_prefix))
+
+    xpmem_prefix = '/usr/local/xpmem' if netconfig['xpmem'] else False
+    if xpmem_prefix:
+        blocks.append(xpmem(prefix=xpmem_prefix))
+
+    ucx_prefix = '/usr/local/ucx'
+    blocks.append(ucx(prefix=ucx_prefix, repository='https://github.com/openucx/ucx.git',
+                      branch='v{}'.format(netconfig['ucx']), cuda=True, ofed=True,
+                      knem=knem_prefix, xpmem=xpmem_prefix))
+
+    pmix_prefix = 'internal'
+    if netconfig['pmix'] != 'internal':
+        pmix_prefix = '/usr/local/pmix'
+        blocks.append(pmix(prefix=pmix_prefix, version=netconfig['pmix']))
+
+    blocks.append(openmpi(prefix='/usr/local/openmpi', version=netconfig['ompi'],
+                          ucx=ucx_prefix, pmix=pmix_prefix, cuda=True, infiniband=True,
+                          configure_opts=['--disable-getpwuid',
+                                          '--enable-orterun-prefix-by-default',
+                                          '--enable-mpi-fortran=yes']))
+    blocks.append(environment(variables={'MPI_INC': '/usr/local/openmpi/include'},
+                              _export=True))
+    return blocks
@@ -0,0 +1,199 @@
+"""
+Shared scanning of application logs.
+
+All the patterns looked for in a file, for sanity checking as well as for
+performance variables, are looked for in one read of its contents. Each
+pattern is reduced to the longest literal any of its matches contains, e.g.
+`ends NORMALLY` for `^.*Task\\s+FALL3D\\s*:\\s*ends NORMALLY\\s*$`; the lines
+holding these literals are found with one plain substring search over the
+contents per distinct literal, which skips the bulk of a log far faster than
+any regular expression, an alternation of the literals included, and only
+these lines are matched against the patterns. Patterns without such a literal
+are combined into one alternation, run over the contents once. Files larger
+than `MMAP_THRESHOLD` are memory-mapped rather than read.
+
+Patterns apply to one line at a time, as with `re.MULTILINE`; each pattern
+gets the list of its matches in the order of the file, a match being the
+tuple of its groups, or the matched text if it has none.
+
+Scans are cached by path, size and modification time, so that the sanity and
+performance functions of a test share one scan of each file. The
+`log_scan` mixin (see `powercap/mixins.py`) does this for the ReFrame checks.
+
+    $ python -m powercap.logscan Raikoke-2019.Fall3d.log -e 'errors=^  Number of errors\\s*:\\s*(\\d+)'
+"""
+
+import argparse
+import mmap
+import os
+import re
+import sys
+import time
+
+try:
+    import re._parser as sre_parse
+except ImportError:
+    import sre_parse
+
+from tabulate import tabulate
+
+
+#: Files from this size on (bytes) are memory-mapped
+MMAP_THRESHOLD = 1 << 20
+
+
+class Scan:
+    '''Matches of named patterns in a file.'''
+
+    def __init__(self, path, matches):
+        self.path = path
+        self.matches = matches
+
+    def found(self, name):
+        return bool(self.matches[name])
+
+    def all(self, name, group=None, conv=None):
+        '''Every match of `name`, or its `group` (1-based), converted with `conv`.'''
+        values = [m if group is None else m[group - 1] for m in self.matches[name]]
+        return [conv(v) for v in values] if conv else values
+
+    def first(self, name, group=None, conv=None):
+        values = self.all(name, group, conv)
+        if not values:
+            raise KeyError(f'{name!r} not found in {self.path}')
+
+        return values[0]
+
+    def last(self, name, group=None, conv=None):
+        values = self.all(name, group, conv)
+        if not values:
+            raise KeyError(f'{name!r} not found in {self.path}')
+
+        return values[-1]
+
+
+#: Shortest literal worth a substring search
+MIN_LITERAL = 3
+
+
+def required_literal(pattern):
+    '''Longest literal every match of the bytes `pattern` contains, if any.'''
+    parsed = sre_parse.parse(pattern)
+    if parsed.state.flags & re.IGNORECASE:
+        return None
+
+    best, run = b'', []
+    for op, av in [*parsed, (None, None)]:
+        if op is sre_parse.LITERAL:
+            run.append(av)
+            continue
+
+        best = max(best, bytes(run), key=len)
+        run = []
+
+    return best if len(best) >= MIN_LITERAL else None
+
+
+def _decode(match):
+    groups = match.groups()
+    if not groups:
+        return match.group(0).decode(errors='replace')
+
+    return tuple(g.decode(errors='replace') if g is not None else None for g in groups)
+
+
+def _line_start(buf, pos):
+    return buf.rfind(b'\n', 0, pos) + 1
+
+
+def scan_buffer(buf, patterns, path=None):
+    '''Scan the bytes-like `buf` for the `{name: regex}` patterns.'''
+    compiled = {name: re.compile(p.encode(), re.MULTILINE) for name, p in patterns.items()}
+
+    # Line start -> names of the patterns to match on the line
+    lines = {}
+    literals = {}
+    rest = []
+    for name, regex in compiled.items():
+        literal = required_literal(regex.pattern)
+        if literal is None:
+            rest.append(name)
+        else:
+            literals.setdefault(literal, []).append(name)
+
+    for literal, names in literals.items():
+        pos = buf.find(literal)
+        while pos >= 0:
+            lines.setdefault(_line_start(buf, pos), set()).update(names)
+            end = buf.find(b'\n', pos)
+            pos = buf.find(literal, end) if end >= 0 else -1
+
+    if rest:
+        combined = re.compile(b'|'.join(b'(?:%s)' % compiled[n].pattern for n in rest),
+                              re.MULTILINE)
+        pos = 0
+        while (hit := combined.search(buf, pos)) is not None:
+            start = _line_start(buf, hit.start())
+            lines.setdefault(start, set()).update(rest)
+            end = buf.find(b'\n', hit.start())
+            if end < 0:
+                break
+
+            pos = end + 1
+
+    matches = {name: [] for name in patterns}
+    for start in sorted(lines):
+        end = buf.find(b'\n', start)
+        line = buf[start:end if end >= 0 else len(buf)]
+        for name in compiled:
+            if name in lines[start]:
+                matches[name] += [_decode(m) for m in compiled[name].finditer(line)]
+
+    return Scan(path, matches)
+
+
+_CACHE = {}
+
+
+def scan_file(path, patterns):
+    '''Scan the file at `path` for the `{name: regex}` patterns, once.'''
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns, tuple(sorted(patterns.items())))
+    if key in _CACHE:
+        return _CACHE[key]
+
+    with open(path, 'rb') as fp:
+        if stat.st_size >= MMAP_THRESHOLD:
+            with mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+                scan = scan_buffer(buf, patterns, path)
+        else:
+            scan = scan_buffer(fp.read(), patterns, path)
+
+    _CACHE[key] = scan
+    return scan
+
+
+# ========================================================
+# Command line interface
+# ========================================================
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m powercap.logscan',
+                                     description=__doc__.split('\n\n')[0])
+    parser.add_argument('file')
+    parser.add_argument('-e', '--pattern', action='append', required=True,
+                        metavar='NAME=REGEX', help='named pattern (repeatable)')
+
+    args = parser.parse_args(argv)
+    patterns = dict(p.split('=', 1) for p in args.pattern)
+    start = time.perf_counter()
+    scan = scan_file(args.file, patterns)
+    elapsed = time.perf_counter() - start
+    print(tabulate([[name, len(m), m[0] if m else '', m[-1] if m else '']
+                    for name, m in scan.matches.items()],
+                   headers=['pattern', 'matches', 'first', 'last']))
+    print(f'\nscanned {os.path.getsize(args.file)} bytes in {elapsed:.3f} s')
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,1099 @@
+"""
+ReFrame mixins shared by the application checks.
+
+The base classes under `applications/` inherit from these mixins to pick up
+common run-time instrumentation.
+"""
+
+import csv
+import glob
+import json
+import os
+import shlex
+import sys
+
+import reframe as rfm
+import reframe.utility.sanity as sn
+import reframe.utility.typecheck as typ
+from reframe.core.exceptions import SanityError
+from reframe.core.runtime import runtime
+from reframe.utility import ScopedDict
+
+from powercap import (abtest, baselines, buildcache, decomposition, fields, images, launchers,
+                      logscan, perflog, power, staging)
+
+
+# Repository root, so that jobs can run `python -m powercap.<tool>`
+POWERCAP_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def powercap_command(python, tool, *args):
+    '''Shell command running one of the `powercap` command line tools.'''
+    return ' '.join(['env', f'PYTHONPATH={POWERCAP_ROOT}', python, '-m', f'powercap.{tool}',
+                     *map(str, args)])
+
+
+def on_every_node(partition, command):
+    '''Shell command running `command` once on each node of the job.'''
+    if partition.scheduler.registered_name == 'slurm':
+        return ('srun --overlap --nodes=$SLURM_NNODES --ntasks-per-node=1 '
+                f'--cpus-per-task=1 {command}')
+
+    return command
+
+
+# Post-run commands keeping the exit status of the launch, the last failing
+# one if it is repeated, as the exit status of the job
+_SAVE_STATUS = 'POWERCAP_RC=$?; [ $POWERCAP_RC -eq 0 ] || POWERCAP_LAUNCH_STATUS=$POWERCAP_RC'
+_EXIT_STATUS = 'exit ${POWERCAP_LAUNCH_STATUS:-0}'
+
+
+def keep_launch_status(test):
+    '''Exit the job with the status of the launch rather than of the commands
+    following it, e.g. the `wait` on a sidecar.'''
+    cmds = [c for c in test.postrun_cmds if c not in (_SAVE_STATUS, _EXIT_STATUS)]
+    test.postrun_cmds = [_SAVE_STATUS, *cmds, _EXIT_STATUS]
+
+
+class power_sampling(rfm.RegressionMixin):
+    '''Sample node power while the job runs (see `powercap/power.py`).
+
+    One sampler per node is started before the pre-run commands and stopped
+    after the post-run commands. The launch of the main command is marked as
+    the `run` window, from which the energy to solution is derived; the
+    window markers are written even when sampling is disabled.
+    '''
+
+    #: Power source specification, e.g. ``nvidia-smi``, ``rapl,nvidia-smi``,
+    #: ``hwmon:grace/*Module*`` or ``file:<trace>``; empty to disable sampling.
+    #: ``auto`` samples the GPUs on partitions with GPU devices, else RAPL
+    power_source = variable(str, value='auto')
+
+    #: Sampling interval in seconds
+    power_interval = variable(float, value=0.1)
+
+    #: Ring buffer capacity in samples per node
+    power_capacity = variable(int, value=65536)
+
+    #: Python interpreter running the sampler on the compute nodes
+    power_python = variable(str, value=sys.executable)
+
+    power_buffer = 'power_%h.bin'
+    power_windows = 'power_window.txt'
+
+    @run_after('init')
+    def drop_power_perf_variables(self):
+        if not self.power_source:
+            for var in ('energy_J', 'avg_power_W', 'peak_power_W', 'energy_to_solution'):
+                self.perf_variables.pop(var, None)
+
+    @run_after('setup')
+    def resolve_power_source(self):
+        if self.power_source == 'auto':
+            gpus = any(d.type == 'gpu' for d in self.current_partition.devices)
+            self.power_source = 'nvidia-smi' if gpus else 'rapl'
+
+    def power_marker(self, label, edge):
+        '''Shell command recording the start or end of a timed window.'''
+        windows = os.path.join(self.stagedir, self.power_windows)
+        return f'echo "{label} {edge} $(date +%s.%N)" >> {windows}'
+
+    def launch_window_cmds(self):
+        '''Commands placed right before and right after the main launch.'''
+        return [self.power_marker('run', 'start')], [self.power_marker('run', 'end')]
+
+    @run_before('run', always_last=True)
+    def start_power_sampler(self):
+        start, stop = [], []
+        if self.power_source:
+            sampler = powercap_command(
+                self.power_python, 'power', 'sample',
+                f'--source {self.power_source}',
+                f'--interval {self.power_interval}',
+                f'--capacity {self.power_capacity}',
+                f'--output {os.path.join(self.stagedir, self.power_buffer)}'
+            )
+            # One sampler on each node of the allocation
+            sampler = on_every_node(self.current_partition, sampler)
+            start = [f'{sampler} &', 'POWER_SAMPLER_PID=$!']
+            stop = ['kill -TERM $POWER_SAMPLER_PID', 'wait $POWER_SAMPLER_PID']
+            self.keep_files = self.keep_files + [self.power_buffer.replace('%h', '*')]
+
+        pre, post = self.launch_window_cmds()
+        self.prerun_cmds = start + self.prerun_cmds + pre
+        self.postrun_cmds = post + self.postrun_cmds + stop
+        self.keep_files = self.keep_files + [self.power_windows]
+        keep_launch_status(self)
+
+    def window(self, label):
+        '''The `(start, end)` times of a window recorded during the run.'''
+        return power.read_windows(os.path.join(self.stagedir, self.power_windows))[label]
+
+    def power_summary(self, label=None):
+        buffers = glob.glob(os.path.join(self.stagedir, self.power_buffer.replace('%h', '*')))
+        window = None if label is None else self.window(label)
+        return power.summarize(buffers, window)
+
+    @performance_function('J')
+    def energy_J(self):
+        return self.power_summary()['energy_J']
+
+    @performance_function('W')
+    def avg_power_W(self):
+        return self.power_summary('run')['avg_power_W']
+
+    @performance_function('W')
+    def peak_power_W(self):
+        return self.power_summary('run')['peak_power_W']
+
+    @performance_function('J')
+    def energy_to_solution(self):
+        return self.power_summary('run')['energy_J']
+
+
+class cap_sweep(power_sampling):
+    '''Run the main launch once per cap level, back to back in one job.
+
+    The levels are swept in a shell loop around the main launch, so that the
+    allocation, the module loading and the pre-run steps (input staging,
+    meshing, container pull) are paid once for the whole sweep. By default
+    each level is passed to ``srun --cpu-freq`` (same values as the `cpufreq`
+    partition resource); other caps, e.g. GPU power limits, are applied with
+    `cap_command`. Every level is recorded as a `step@<level>` window and
+    reported as `step_time@<level>` and, if power is sampled,
+    `energy_to_solution@<level>` and `avg_power_W@<level>`.
+
+    The performance variables of the application itself refer to the last
+    level, the ones of the `run` window to the whole sweep.
+    '''
+
+    #: Cap levels, e.g. ``-S cap_levels=2100000,1500000,1000000``; empty runs once
+    cap_levels = variable(typ.List[str], value=[])
+
+    #: Shell command applying a cap level before each step, `{cap}` is
+    #: replaced with the level, e.g. ``nvidia-smi -pl {cap}``
+    cap_command = variable(str, value='')
+
+    #: Idle time in seconds after each step, so that the power and clocks
+    #: settle before the next level
+    cap_settle = variable(float, value=10.0)
+
+    @run_after('init')
+    def add_cap_perf_variables(self):
+        if not self.cap_levels:
+            return
+
+        for level in self.cap_levels:
+            self.perf_variables[f'step_time@{level}'] = sn.make_performance_function(
+                self.step_time, 's', level
+            )
+            if self.power_source:
+                self.perf_variables[f'energy_to_solution@{level}'] = \
+                    sn.make_performance_function(self.step_energy, 'J', level)
+                self.perf_variables[f'avg_power_W@{level}'] = \
+                    sn.make_performance_function(self.step_power, 'W', level)
+
+        # The time limit of the test is the one of a single step
+        if self.time_limit:
+            num_levels = len(self.cap_levels)
+            self.time_limit = num_levels * (self.time_limit + self.cap_settle)
+
+    @run_before('run', always_last=True)
+    def apply_cap_levels(self):
+        if not self.cap_levels or self.cap_command:
+            return
+
+        launcher = self.job.launcher
+        if (getattr(launcher, 'kind', None) != 'srun' and
+            launcher.command(self.job)[:1] != ['srun']):
+            raise ValueError(
+                f'cannot apply cap levels with launcher '
+                f'{self.job.launcher.registered_name!r}: set cap_command'
+            )
+
+        self.job.launcher.options += ['--cpu-freq=$POWERCAP_CAP']
+
+    def launch_window_cmds(self):
+        pre, post = super().launch_window_cmds()
+        if not self.cap_levels:
+            return pre, post
+
+        levels = ' '.join(shlex.quote(level) for level in self.cap_levels)
+        pre = pre + [f'for POWERCAP_CAP in {levels}; do']
+        if self.cap_command:
+            pre.append(self.cap_command.format(cap='$POWERCAP_CAP'))
+
+        pre.append(self.power_marker('step@$POWERCAP_CAP', 'start'))
+        post = [
+            self.power_marker('step@$POWERCAP_CAP', 'end'),
+            f'sleep {self.cap_settle}',
+            'done'
+        ] + post
+        return pre, post
+
+    def step_time(self, level):
+        start, end = self.window(f'step@{level}')
+        return end - start
+
+    def step_energy(self, level):
+        return self.power_summary(f'step@{level}')['energy_J']
+
+    def step_power(self, level):
+        return self.power_summary(f'step@{level}')['avg_power_W']
+
+
+class perf_baselines(rfm.RegressionMixin):
+    '''Take the performance references from a baselines file.
+
+    The file is built from the perflogs with `python -m powercap.baselines
+    build` (see `powercap/baselines.py`). References set by the test itself
+    take precedence; variables without a baseline are not checked.
+    '''
+
+    #: Baselines file; relative paths are taken from the repository root
+    baseline_file = variable(str, value='baselines.json')
+
+    @run_after('setup')
+    def set_baseline_references(self):
+        tree = baselines.load(os.path.join(POWERCAP_ROOT, self.baseline_file))
+        refs = baselines.references(tree, self.current_partition.fullname,
+                                    self.current_environ.name,
+                                    perflog.normalize_name(self.display_name))
+        if not refs:
+            return
+
+        cpufreq = perflog.cpufreq_of(self)
+        found = {}
+        for var in self.perf_variables:
+            key = var if cpufreq is None or '@' in var else f'{var}@{cpufreq}'
+            if key in refs:
+                found[var] = refs[key]
+
+        # References of the test, in the scope of the partition or an enclosing
+        # one, take precedence over the baselines
+        fullname = self.current_partition.fullname
+        current = self.reference
+        if not isinstance(current, ScopedDict):
+            current = ScopedDict(current)
+
+        own = current.scope(fullname)
+        reference = {scope: dict(refs) for scope, refs in current.data.items()}
+        reference.setdefault(fullname, {}).update(
+            {var: ref for var, ref in found.items() if var not in own})
+        self.reference = reference
+
+
+# Build system attributes taken into account by the build cache
+_BUILD_OPTIONS = (
+    'commands', 'config_opts', 'make_opts', 'options', 'makefile', 'cc',
+    'cxx', 'ftn', 'nvcc', 'cppflags', 'cflags', 'cxxflags', 'fflags',
+    'ldflags', 'flags_from_environ'
+)
+
+
+class cached_build(rfm.RegressionMixin):
+    '''Restore the build products from a shared cache if possible.
+
+    The cache key (see `powercap/buildcache.py`) covers the source revision
+    returned by `build_cache_source()`, the build options, the pre- and
+    post-build commands, the modules and environment variables and the
+    processor and device architectures of the partition. On a hit the build is
+    replaced by a copy of the cached products into `build_cache_root()`;
+    on a miss the products are stored once the build passed its sanity check.
+    '''
+
+    #: Shared cache directory, empty to always build
+    build_cache_dir = variable(str, value=os.environ.get('POWERCAP_BUILD_CACHE', ''))
+
+    #: Size of the cache in GiB beyond which least recently used builds are evicted
+    build_cache_max_size = variable(float, value=50.0)
+
+    #: Build products, relative to `build_cache_root()`
+    build_cache_paths = variable(typ.List[str], value=[])
+
+    #: Python interpreter storing and restoring the products in the build job
+    build_cache_python = variable(str, value=sys.executable)
+
+    build_cache_key = None
+    build_cache_hit = False
+    build_cache_key_inputs = None
+
+    def build_cache_source(self):
+        '''Revision of the sources, e.g. a release or a commit.'''
+        return None
+
+    def build_cache_root(self):
+        '''Directory the `build_cache_paths` are relative to.'''
+        return self.stagedir
+
+    def build_cache_inputs(self):
+        build_system = self.build_system
+        partition = self.current_partition
+        inputs = {
+            'source': self.build_cache_source(),
+            'build_system': type(build_system).__name__,
+            'build_options': {name: getattr(build_system, name)
+                              for name in _BUILD_OPTIONS if hasattr(build_system, name)},
+            'prebuild_cmds': self.prebuild_cmds,
+            'postbuild_cmds': self.postbuild_cmds,
+            'modules': [*self.current_environ.modules, *self.modules],
+            'env_vars': self.env_vars,
+            'environ': self.current_environ.name,
+            'processor': partition.processor.arch,
+            'devices': [d.arch for d in partition.devices],
+            'paths': self.build_cache_paths,
+        }
+
+        # Stage directories are the same for every session of a given prefix
+        return json.loads(json.dumps(inputs, default=str)
+                          .replace(runtime().stage_prefix, '$STAGE'))
+
+    def build_cache_command(self, *args):
+        return powercap_command(self.build_cache_python, 'buildcache',
+                                f'--cache {self.build_cache_dir}', *args)
+
+    @run_before('compile', always_last=True)
+    def use_build_cache(self):
+        if not self.build_cache_dir or not self.build_cache_paths:
+            return
+
+        self.build_cache_key_inputs = self.build_cache_inputs()
+        self.build_cache_key = buildcache.build_key(self.build_cache_key_inputs)
+        root = self.build_cache_root()
+        if self.build_cache_key in buildcache.BuildCache(self.build_cache_dir):
+            self.build_cache_hit = True
+
+            # Keep the attributes the tests read from the build, e.g. `builddir`
+            attrs = dict(vars(self.build_system))
+            self.build_system = 'CustomBuild'
+            vars(self.build_system).update(attrs)
+            self.build_system.commands = [
+                self.build_cache_command('restore', f'--key {self.build_cache_key}',
+                                         f'--root {root}')
+            ]
+            self.prebuild_cmds = []
+            self.postbuild_cmds = []
+
+    @run_after('sanity')
+    def store_build(self):
+        '''Store the products of a build that passed its sanity check.'''
+        if self.build_cache_key is None or self.build_cache_hit or self.is_dry_run():
+            return
+
+        root = self.build_cache_root()
+        missing = [path for path in self.build_cache_paths
+                   if not os.path.exists(os.path.join(root, path))]
+        if self.build_job.exitcode != 0 or missing:
+            raise SanityError(f'build not stored: exit code {self.build_job.exitcode}, '
+                              f'missing products: {", ".join(missing) or "none"}')
+
+        buildcache.BuildCache(self.build_cache_dir).store(
+            self.build_cache_key, root, self.build_cache_paths, self.build_cache_key_inputs,
+            self.build_cache_max_size * buildcache.GiB
+        )
+
+    def assert_build_restored(self):
+        return sn.assert_found(rf'^restored {self.build_cache_key}', self.stdout)
+
+
+class cached_fetch(rfm.RegressionMixin):
+    '''Fetch the sources through the shared artifact cache.
+
+    Fetch fixtures must implement `artifact_args()`, the arguments of
+    `python -m powercap.artifacts` (see `powercap/artifacts.py`) reproducing
+    their download, which is checked at init; when a cache directory is set,
+    their command is replaced with it. In offline mode a missing artifact
+    fails the fetch immediately.
+    '''
+
+    #: Shared cache directory, empty to download directly
+    artifact_cache_dir = variable(str, value=os.environ.get('POWERCAP_ARTIFACT_CACHE', ''))
+
+    #: Never download, only use cached artifacts
+    artifact_offline = variable(typ.Bool, value=os.environ.get('POWERCAP_OFFLINE', '0') != '0')
+
+    #: Python interpreter running the fetch
+    artifact_python = variable(str, value=sys.executable)
+
+    def artifact_args(self):
+        '''Arguments of `python -m powercap.artifacts` reproducing the download.'''
+        return None
+
+    @run_after('init')
+    def check_artifact_args(self):
+        if type(self).artifact_args is cached_fetch.artifact_args:
+            raise ValueError(f'{type(self).__name__} does not implement artifact_args(): '
+                             'its download cannot go through the artifact cache')
+
+    @run_before('run')
+    def use_artifact_cache(self):
+        if not self.artifact_cache_dir:
+            if self.artifact_offline:
+                raise ValueError('offline mode requires an artifact cache: '
+                                 'set artifact_cache_dir or POWERCAP_ARTIFACT_CACHE')
+
+            return
+
+        self.executable = powercap_command(
+            self.artifact_python, 'artifacts', f'--cache {self.artifact_cache_dir}',
+            *(['--offline'] if self.artifact_offline else []), *self.artifact_args()
+        )
+        self.executable_opts = []
+
+
+class domain_decomposition(rfm.RegressionMixin):
+    '''Choose the Cartesian decomposition of the ranks of a test.
+
+    `decompose()` goes through `powercap.decomposition.choose()`: the
+    decompositions are ranked on the ranks per node of the test, with a cost
+    model fitted to its past runs if `decomposition_store` is set and their
+    decomposition can be read back from their command line, and the choice
+    is recorded in `decomposition_cache` if set.
+    '''
+
+    #: Perflog store of past runs; relative paths are taken from the repository root
+    decomposition_store = variable(str, value='')
+
+    #: Cache file of the decompositions chosen so far, empty to always decide anew
+    decomposition_cache = variable(str, value=os.environ.get('POWERCAP_DECOMPOSITION_CACHE', ''))
+
+    def decomposition_model(self, grid, dims_pattern, halo=1):
+        store = os.path.join(POWERCAP_ROOT, self.decomposition_store)
+        if not self.decomposition_store or dims_pattern is None or not os.path.isdir(store):
+            return None
+
+        table = perflog.read_perflogs(store, perf_var='elapsed_time',
+                                      test=type(self).__name__,
+                                      system=self.current_system.name)
+        samples = decomposition.samples_from_perflogs(table, grid, dims_pattern)
+        return decomposition.CostModel.fit(samples, halo)
+
+    def decompose(self, app, grid, num_ranks, dims_pattern=None, halo=1):
+        '''One factor of `num_ranks` per dimension of `grid`.'''
+        cache = None
+        if self.decomposition_cache:
+            cache = decomposition.DecompositionCache(
+                os.path.join(POWERCAP_ROOT, self.decomposition_cache)
+            )
+
+        ranks_per_node = self.num_tasks_per_node
+        if not isinstance(ranks_per_node, int):
+            ranks_per_node = None
+
+        return decomposition.choose(app, grid, num_ranks, ranks_per_node,
+                                    self.decomposition_model(grid, dims_pattern, halo),
+                                    cache, halo)
+
+
+class log_scan(rfm.RegressionMixin):
+    '''Sanity and performance captures from one shared scan of each log.
+
+    Tests return every pattern they look for from `log_patterns()`, by file
+    and name; `assert_scanned()` and `extract_scanned()` then read the matches
+    from one scan of each file (see `powercap/logscan.py`).
+    '''
+
+    def log_patterns(self):
+        '''`{file: {name: regex}}`, the files relative to the stage directory.'''
+        return {}
+
+    def scanned(self, filename):
+        return logscan.scan_file(os.path.join(self.stagedir, filename),
+                                 self.log_patterns()[filename])
+
+    @sn.deferrable
+    def assert_scanned(self, filename, name):
+        if not self.scanned(filename).found(name):
+            raise SanityError(f'{name!r} not found in {filename}')
+
+        return True
+
+    @sn.deferrable
+    def extract_scanned(self, filename, name, group=None, conv=None, which='first'):
+        '''The `first` or `last` match of `name`, or `all` of them.'''
+        scan = self.scanned(filename)
+        if not scan.found(name):
+            raise SanityError(f'{name!r} not found in {filename}')
+
+        return getattr(scan, which)(name, group, conv)
+
+
+class progress_telemetry(rfm.RegressionMixin):
+    '''Record the progress of the application while it runs.
+
+    A sidecar follows the standard output of the job and writes the step rate
+    and the time to completion to `progress.csv`, together with the power
+    window in force (see `powercap/progress.py`). With `progress_stall` set, a
+    run making no progress for that many seconds is cancelled.
+    '''
+
+    #: Progress regex or preset of `powercap.progress.PATTERNS`; empty to disable
+    progress_pattern = variable(str, value='')
+
+    #: Total number of steps, if the application does not print it
+    progress_total = variable(int, value=0)
+
+    #: Seconds without progress after which the run is cancelled, 0 to never
+    progress_stall = variable(float, value=0.0)
+
+    #: Python interpreter running the sidecar
+    progress_python = variable(str, value=sys.executable)
+
+    progress_file = 'progress.csv'
+
+    def progress_stall_command(self):
+        if self.current_partition.scheduler.registered_name == 'slurm':
+            return 'scancel $SLURM_JOB_ID'
+
+        return 'pkill -TERM -P $$'
+
+    @run_before('run', always_last=True)
+    def start_progress_sidecar(self):
+        if not self.progress_pattern:
+            return
+
+        args = [os.path.join(self.stagedir, self.job.stdout),
+                f'--pattern {shlex.quote(self.progress_pattern)}',
+                f'--output {os.path.join(self.stagedir, self.progress_file)}']
+        if isinstance(self, power_sampling):
+            args.append(f'--windows {os.path.join(self.stagedir, self.power_windows)}')
+        if self.progress_total:
+            args.append(f'--total {self.progress_total}')
+        if self.progress_stall:
+            args += [f'--stall {self.progress_stall}',
+                     f'--on-stall "{self.progress_stall_command()}"']
+
+        sidecar = powercap_command(self.progress_python, 'progress', 'watch', *args)
+        self.prerun_cmds = [f'{sidecar} &', 'PROGRESS_PID=$!'] + self.prerun_cmds
+        self.postrun_cmds = self.postrun_cmds + ['kill -TERM $PROGRESS_PID',
+                                                 'wait $PROGRESS_PID']
+        self.keep_files = self.keep_files + [self.progress_file]
+        keep_launch_status(self)
+
+
+class field_regression(rfm.RegressionMixin):
+    '''Compare the output fields of the run with the ones of a reference run.
+
+    With `field_reference` set, the `field_variables` of the NetCDF output
+    returned by `field_output()` are compared with the ones of the reference
+    output, slab by slab (see `powercap/fields.py`). Their relative L2 and max
+    norms are reported as `<variable>_rel_l2` and `<variable>_rel_max`, and
+    `assert_fields()` fails if any is above `field_tolerance`. Tests setting a
+    reference must implement `field_output()`.
+    '''
+
+    #: NetCDF output of a reference run of the same case; empty to disable
+    field_reference = variable(str, value='')
+
+    #: Variables to compare
+    field_variables = variable(typ.List[str], value=fields.DEFAULT_VARIABLES)
+
+    #: Tolerance of the relative norms
+    field_tolerance = variable(float, value=fields.DEFAULT_TOLERANCE)
+
+    #: Size in megabytes of the slabs read at once
+    field_chunk_mb = variable(float, value=fields.DEFAULT_CHUNK_MB)
+
+    _field_norms = None
+
+    def field_output(self):
+        '''NetCDF output of the run, absolute or relative to the stage directory.
+
+        It may contain environment variables; None if the test has no output
+        to compare, the default.
+        '''
+        return None
+
+    @run_after('init')
+    def add_field_perf_variables(self):
+        if not self.field_reference:
+            return
+
+        if type(self).field_output is field_regression.field_output:
+            raise ValueError(f'{type(self).__name__} does not implement field_output(): '
+                             'field_reference cannot be set')
+
+        for name in self.field_variables:
+            for key in ('rel_l2', 'rel_max'):
+                self.perf_variables[f'{name}_{key}'] = sn.make_performance_function(
+                    self.field_norm, '', name, key
+                )
+
+    def field_norms(self):
+        # The fields are read once for the sanity and the performance stage
+        if self._field_norms is None:
+            output = os.path.expandvars(self.field_output())
+            self._field_norms = fields.compare(os.path.join(self.stagedir, output),
+                                               os.path.expandvars(self.field_reference),
+                                               self.field_variables, self.field_chunk_mb)
+
+        return self._field_norms
+
+    @sn.deferrable
+    def assert_fields(self):
+        if not self.field_reference:
+            return True
+
+        try:
+            norms = self.field_norms()
+        except (OSError, ValueError) as err:
+            raise SanityError(str(err)) from None
+
+        failed = fields.failures(norms, self.field_tolerance)
+        if failed:
+            raise SanityError(', '.join(f'{name} {key}={value:.3g}'
+                                        for name, key, value in failed) +
+                              f' above {self.field_tolerance:g}')
+
+        return True
+
+    @sn.deferrable
+    def field_norm(self, name, key):
+        return getattr(self.field_norms()[name], key)
+
+
+class cached_pipeline(rfm.RegressionMixin):
+    '''Run the pre-processing stages of the application through a shared cache.
+
+    Tests pass the stages run before the main launch, in order, e.g. a mesher
+    and a database generator, to `pipeline_cmds()` and run the commands it
+    returns. The cache key of a stage (see `powercap/buildcache.py`) covers
+    its own inputs and the key of the stage before it; its products are
+    stored after it ran. The job restores the products of the last stage
+    found in the cache and only runs the stages after it, so that repeats of
+    the same case, e.g. a solver-only rerun or the jobs of a cap sweep, skip
+    the pre-processing altogether.
+
+    A stage only runs once the one before it succeeded or was restored. Each
+    stage is timed in `pipeline.csv` and reported as `stage_time_<name>`, the
+    restore time being counted to the restored stage; `stages_restored` is
+    the number of stages taken from the cache.
+    '''
+
+    #: Shared cache directory, empty to run every stage
+    pipeline_cache_dir = variable(str, value=os.environ.get('POWERCAP_PIPELINE_CACHE', ''))
+
+    #: Size of the cache in GiB beyond which least recently used entries are evicted
+    pipeline_cache_max_size = variable(float, value=200.0)
+
+    #: Python interpreter storing and restoring the products in the job
+    pipeline_cache_python = variable(str, value=sys.executable)
+
+    pipeline_file = 'pipeline.csv'
+
+    def pipeline_command(self, *args):
+        return powercap_command(self.pipeline_cache_python, 'buildcache',
+                                f'--cache {self.pipeline_cache_dir}', *args)
+
+    def pipeline_cmds(self, stages):
+        '''Shell commands running `stages` through the cache.
+
+        Every stage is a `(name, commands, inputs, products)` tuple: `inputs`
+        is anything JSON serializable its products depend on, e.g. the digests
+        of its input files, and `products` are relative to the stage directory.
+        '''
+        records = os.path.join(self.stagedir, self.pipeline_file)
+        now = 'date +%s.%N'
+        elapsed = f'$(awk "BEGIN {{print $({now}) - $PIPELINE_T0}}")'
+        keys = []
+        for name, _, inputs, _ in stages:
+            keys.append(buildcache.build_key({'stage': name, 'inputs': inputs,
+                                              'previous': keys[-1] if keys else None}))
+
+        cmds = [f'echo stage,status,seconds > {records}', 'PIPELINE_DONE=0']
+        if self.pipeline_cache_dir:
+            # Restore the last stage cached, the earlier ones come with it
+            cmds.append(f'PIPELINE_T0=$({now})')
+            for i in reversed(range(len(stages))):
+                restore = self.pipeline_command('restore', f'--key {keys[i]}',
+                                                f'--root {self.stagedir}')
+                cmds += [f'{"if" if i == len(stages) - 1 else "elif"} {restore}; then',
+                         f'    PIPELINE_DONE={i + 1}']
+                for j, (name, *_) in enumerate(stages[:i + 1]):
+                    cmds.append(f'    echo "{name},restored,{elapsed if j == i else 0}" '
+                                f'>> {records}')
+
+            cmds.append('fi')
+
+        for i, (name, commands, _, products) in enumerate(stages):
+            # A stage runs on the products of the one before it, so it only
+            # runs once that one is done; only the products of a successful
+            # stage are stored
+            cmds += [f'if [ $PIPELINE_DONE -eq {i} ]; then',
+                     f'    PIPELINE_T0=$({now})',
+                     f'    if {" && ".join(commands)}; then',
+                     f'        echo "{name},run,{elapsed}" >> {records}',
+                     f'        PIPELINE_DONE={i + 1}']
+            if self.pipeline_cache_dir:
+                cmds.append('        ' + self.pipeline_command(
+                    'store', f'--key {keys[i]}', f'--root {self.stagedir}',
+                    f'--max-size {self.pipeline_cache_max_size}', *products
+                ))
+
+            cmds += ['    else',
+                     f'        echo "{name},failed,{elapsed}" >> {records}',
+                     '    fi',
+                     'fi']
+
+        self.keep_files = self.keep_files + [self.pipeline_file]
+        for name, *_ in stages:
+            # Not `@`, which separates the level of a cap sweep
+            self.perf_variables[f'stage_time_{name}'] = sn.make_performance_function(
+                self.stage_time, 's', name
+            )
+
+        self.perf_variables['stages_restored'] = sn.make_performance_function(
+            self.stages_restored, 'count'
+        )
+        return cmds
+
+    def pipeline_records(self):
+        with open(os.path.join(self.stagedir, self.pipeline_file)) as fp:
+            return list(csv.DictReader(fp))
+
+    @sn.deferrable
+    def stage_time(self, name):
+        for record in self.pipeline_records():
+            if record['stage'] == name:
+                if record['status'] == 'failed':
+                    raise SanityError(f'stage {name!r} failed')
+
+                return float(record['seconds'])
+
+        raise SanityError(f'stage {name!r} did not run')
+
+    @sn.deferrable
+    def stages_restored(self):
+        return len(self.restored_stages())
+
+    def restored_stages(self):
+        '''Names of the stages taken from the cache, which did not run in this job.'''
+        return {r['stage'] for r in self.pipeline_records() if r['status'] == 'restored'}
+
+
+class node_local_inputs(rfm.RegressionMixin):
+    '''Stage large read-only inputs once per node into node-local storage.
+
+    Tests list the inputs in `staged_inputs` and run the commands of
+    `input_staging_cmds()` after their inputs are linked: on every node the
+    inputs are copied, by content, into `staging_root` (see
+    `powercap/staging.py`) and their links are pointed at the local copies,
+    so that the ranks of a node no longer read them from the shared file
+    system. Inputs already staged on a node by an earlier job are reused.
+
+    The slowest node's staging time is reported as `staging_time` and the
+    bytes read from the shared file system as `staged_bytes`.
+    '''
+
+    #: Inputs to stage, relative to the directory they are linked from
+    staged_inputs = variable(typ.List[str], value=[])
+
+    #: Node-local store, empty to read the inputs from the shared file system
+    staging_root = variable(str, value=os.environ.get('POWERCAP_STAGING_ROOT',
+                                                      staging.DEFAULT_ROOT))
+
+    #: Size of the store in GiB beyond which least recently used inputs are evicted
+    staging_max_size = variable(float, value=32.0)
+
+    #: Python interpreter staging the inputs on the compute nodes
+    staging_python = variable(str, value=sys.executable)
+
+    staging_file = 'staging.csv'
+
+    def staging_enabled(self):
+        return bool(self.staging_root and self.staged_inputs)
+
+    def staging_mount_points(self):
+        '''Mount points making the staged inputs visible inside a container.'''
+        return [(self.staging_root, self.staging_root)] if self.staging_enabled() else []
+
+    def input_staging_cmds(self, link_dir=None, source_dir=None):
+        '''Shell commands staging the inputs linked from `link_dir`.
+
+        The inputs are read from `source_dir`, by default the resources
+        directory of the test; `link_dir` defaults to the stage directory. Both
+        may contain shell variables; the commands run in the job script, before
+        the launch. The links are only updated once every node has staged.
+        '''
+        if not self.staging_enabled():
+            return []
+
+        link_dir = link_dir or self.stagedir
+        source_dir = source_dir or os.path.join(self.prefix, self.sourcesdir)
+        sources = [os.path.join(source_dir, name) for name in self.staged_inputs]
+        report = os.path.join(self.stagedir, self.staging_file)
+        stage = powercap_command(
+            self.staging_python, 'staging', 'stage', *sources,
+            f'--root {self.staging_root}', f'--max-size {self.staging_max_size}',
+            f'--report {report}'
+        )
+        link = powercap_command(self.staging_python, 'staging', 'link', *sources,
+                                f'--root {self.staging_root}', f'--link-dir {link_dir}')
+        self.perf_variables['staging_time'] = sn.make_performance_function(
+            self.staging_time, 's'
+        )
+        self.perf_variables['staged_bytes'] = sn.make_performance_function(
+            self.staged_bytes, 'B'
+        )
+        return [f'rm -f {report}', on_every_node(self.current_partition, stage), link]
+
+    @run_before('run')
+    def keep_staging_report(self):
+        if self.staging_enabled():
+            self.keep_files = self.keep_files + [self.staging_file]
+
+    def staging_records(self):
+        with open(os.path.join(self.stagedir, self.staging_file)) as fp:
+            return list(csv.DictReader(fp, fieldnames=['host', 'files', 'bytes', 'seconds']))
+
+    @sn.deferrable
+    def staging_time(self):
+        return max(float(r['seconds']) for r in self.staging_records())
+
+    @sn.deferrable
+    def staged_bytes(self):
+        return sum(int(r['bytes']) for r in self.staging_records())
+
+
+class cached_image(rfm.RegressionMixin):
+    '''Run the container mode from a verified, cached and optionally node-local image.
+
+    Tests set their container image to `cached_image_path(image)` and run the
+    commands of `container_image_cmds()` before anything uses the container.
+    With a cache directory set, the image is verified against the base images
+    pinned by `image_recipe` for the current system and copied into the cache
+    (see `powercap/images.py`); with `image_node_local`, it is further copied
+    once per node into node-local storage (see `powercap/staging.py`), so that
+    the ranks no longer open it on the shared file system.
+
+    The start of the container on every node, `exec true` with the options of
+    the run, is timed before the launch and reported as
+    `container_start_time`, apart from the time of the application itself.
+    '''
+
+    #: Shared cache directory, empty to run the image in place
+    image_cache_dir = variable(str, value=os.environ.get('POWERCAP_IMAGE_CACHE', ''))
+
+    #: HPCCM recipe pinning the base images of the image, empty not to verify it
+    image_recipe = variable(str, value='')
+
+    #: Accept an image whose definition names no base image by digest
+    image_allow_unpinned = variable(typ.Bool, value=False)
+
+    #: Copy the image to node-local storage before the launch
+    image_node_local = variable(typ.Bool,
+                                value=os.environ.get('POWERCAP_IMAGE_NODE_LOCAL', '0') != '0')
+
+    #: Node-local store of the images
+    image_staging_root = variable(str, value=os.environ.get('POWERCAP_STAGING_ROOT',
+                                                            staging.DEFAULT_ROOT))
+
+    #: Time the start of the container before the launch
+    container_start_probe = variable(typ.Bool, value=True)
+
+    #: Python interpreter copying the image on the compute nodes
+    image_python = variable(str, value=sys.executable)
+
+    image_digest = None
+    image_entry = None
+    container_start_file = 'container_start.txt'
+
+    def cached_image_path(self, image):
+        '''Path the container platform runs `image` from.
+
+        Environment variables in `image` are expanded to reach it from here.
+        '''
+        if not self.image_cache_dir:
+            if self.image_node_local:
+                raise ValueError('node-local images require an image cache: '
+                                 'set image_cache_dir or POWERCAP_IMAGE_CACHE')
+
+            return image
+
+        pins = None
+        if self.image_recipe:
+            pins = images.recipe_pins(self.image_recipe).get(self.current_system.name)
+            if pins is None:
+                raise ValueError(f'{self.image_recipe} pins no base images for '
+                                 f'{self.current_system.name!r}')
+
+        cache = images.ImageCache(self.image_cache_dir)
+        self.image_digest = cache.add(os.path.expandvars(image), pins,
+                                      allow_unpinned=self.image_allow_unpinned)['digest']
+        self.image_entry = cache.entry_path(self.image_digest)
+        if self.image_node_local:
+            # Stored by the same digest on every node
+            return staging.NodeStore(self.image_staging_root).object_path(
+                self.image_digest.split(':')[-1]
+            )
+
+        return self.image_entry
+
+    def container_image_cmds(self, platform=None, label=''):
+        '''Shell commands preparing the image of `platform` on every node.
+
+        `platform` is the container platform of the test by default; its
+        image comes from the last `cached_image_path()`. A `label` tells the
+        start times of several platforms apart.
+        '''
+        cmds = []
+        if self.image_node_local and self.image_entry:
+            cmds.append(on_every_node(self.current_partition, powercap_command(
+                self.image_python, 'staging', 'stage', self.image_entry,
+                f'--root {self.image_staging_root}'
+            )))
+
+        if self.container_start_probe:
+            platform = platform or self.container_platform
+            command, platform.command = platform.command, 'true'
+            probe = platform.launch_command(self.stagedir)
+            platform.command = command
+
+            start_file = self.container_start_file
+            if label:
+                start_file = start_file.replace('.txt', f'_{label}.txt')
+            now = 'date +%s.%N'
+            cmds += [f'CONTAINER_T0=$({now})',
+                     on_every_node(self.current_partition, probe),
+                     f'awk "BEGIN {{print $({now}) - $CONTAINER_T0}}" > '
+                     f'{os.path.join(self.stagedir, start_file)}']
+            self.keep_files = self.keep_files + [start_file]
+            # Not `@`, which separates the level of a cap sweep
+            name = f'container_start_time_{label}' if label else 'container_start_time'
+            self.perf_variables[name] = sn.make_performance_function(
+                self.container_start_time, 's', start_file
+            )
+
+        return cmds
+
+    @sn.deferrable
+    def container_start_time(self, start_file):
+        with open(os.path.join(self.stagedir, start_file)) as fp:
+            return float(fp.read())
+
+
+class ab_comparison(rfm.RegressionMixin):
+    '''Compare execution modes or container images within one allocation.
+
+    In A/B mode the test passes the launch command of each of its `ab_arms`,
+    e.g. `baremetal` and `container:<image>`, to `use_ab_harness()`, which
+    replaces the application with a harness running `ab_rounds` rounds of one
+    trial per arm, in a random order every round (see `powercap/abtest.py`).
+    The trials are recorded in `ab_trials.csv`; each arm runs in its own
+    `ab/<arm>` directory.
+
+    Every arm is reported with the median time of its trials as
+    `trial_time_<arm>` and, against the baseline arm, with the mean paired
+    difference in percent, `time_diff_<arm>`, and the p-value of the paired
+    t-test, `time_p_<arm>`; with power sampling, the same for energy.
+    '''
+
+    #: Arms, as `<execution mode>[:<image>]`
+    ab_arms = variable(typ.List[str], value=['baremetal', 'container'])
+
+    #: Trials of each arm
+    ab_rounds = variable(int, value=5)
+
+    #: Seed of the order of the trials, random if None
+    ab_seed = variable(int, type(None), value=None)
+
+    #: Arm the others are compared with, the first one if empty
+    ab_baseline = variable(str, value='')
+
+    ab_file = 'ab_trials.csv'
+    ab_script = 'ab_trials.sh'
+    _ab_results = None
+
+    def ab_modes(self):
+        return {arm.partition(':')[0] for arm in self.ab_arms}
+
+    def ab_workdir(self, arm):
+        return os.path.join(self.stagedir, 'ab', abtest.arm_name(arm))
+
+    def use_ab_harness(self, trials, inputs=()):
+        '''Run the `{arm: launch command}` trials in place of the application.
+
+        The `inputs` of the stage directory are linked into the directory of
+        every arm.
+        '''
+        records = os.path.join(self.stagedir, self.ab_file)
+        lines = ['#!/bin/bash', f': > {records}']
+        for arm in self.ab_arms:
+            workdir = self.ab_workdir(arm)
+            lines.append(f'mkdir -p {workdir}')
+            # Relative, to resolve within the stage directory mounted in containers too
+            lines += [f'ln -sfn {os.path.relpath(os.path.join(self.stagedir, name), workdir)} '
+                      f'{workdir}/' for name in inputs]
+
+        for r, arm in abtest.schedule(self.ab_arms, self.ab_rounds, self.ab_seed):
+            lines += [f'cd {self.ab_workdir(arm)}',
+                      'start=$(date +%s.%N)',
+                      trials[arm],
+                      'status=$?',
+                      f'echo "{r},{abtest.arm_name(arm)},$status,$start,$(date +%s.%N)" '
+                      f'>> {records}']
+
+        with open(os.path.join(self.stagedir, self.ab_script), 'w') as fp:
+            fp.write('\n'.join(lines) + '\n')
+
+        # The trials launch themselves
+        self.executable = f'bash {os.path.join(self.stagedir, self.ab_script)}'
+        self.executable_opts = []
+        self.job.launcher = launchers.getlauncher('local')()
+        self.keep_files = self.keep_files + [self.ab_file, self.ab_script]
+
+        metrics = [('time', 'seconds')]
+        if getattr(self, 'power_source', ''):
+            metrics.append(('energy', 'energy_J'))
+
+        baseline = abtest.arm_name(self.ab_baseline or self.ab_arms[0])
+        for arm in map(abtest.arm_name, self.ab_arms):
+            for label, metric in metrics:
+                # Not `@`, which separates the level of a cap sweep
+                self.perf_variables[f'trial_{label}_{arm}'] = sn.make_performance_function(
+                    self.ab_value(metric, arm, 'median'), 's' if metric == 'seconds' else 'J'
+                )
+                if arm != baseline:
+                    self.perf_variables[f'{label}_diff_{arm}'] = sn.make_performance_function(
+                        self.ab_value(metric, arm, 'rel_diff', 100), '%'
+                    )
+                    self.perf_variables[f'{label}_p_{arm}'] = sn.make_performance_function(
+                        self.ab_value(metric, arm, 'p'), ''
+                    )
+
+    def ab_trials(self):
+        buffers = []
+        if getattr(self, 'power_source', ''):
+            buffers = sorted(glob.glob(os.path.join(self.stagedir,
+                                                    self.power_buffer.replace('%h', '*'))))
+
+        return abtest.read_trials(os.path.join(self.stagedir, self.ab_file), buffers)
+
+    def ab_results(self, metric):
+        # The power buffers are integrated once for all the variables
+        if self._ab_results is None:
+            trials = self.ab_trials()
+            baseline = abtest.arm_name(self.ab_baseline or self.ab_arms[0])
+            self._ab_results = {m: abtest.compare(trials, baseline, m).set_index('arm')
+                                for m in trials.columns.intersection(abtest.METRICS)}
+
+        return self._ab_results[metric]
+
+    @sn.deferrable
+    def ab_value(self, metric, arm, column, scale=1):
+        return float(self.ab_results(metric).loc[arm, column]) * scale
+
+    @sn.deferrable
+    def assert_trials(self):
+        trials = self.ab_trials()
+        failed = trials[trials['status'] != 0]
+        if not failed.empty:
+            raise SanityError(f'{len(failed)} of {len(trials)} trials failed: ' +
+                              ', '.join(f'{t.arm} (round {t.round}, exit {t.status})'
+                                        for t in failed.head(3).itertuples()))
+
+        if len(trials) != self.ab_rounds * len(self.ab_arms):
+            raise SanityError(f'{len(trials)} trials recorded, '
+                              f'{self.ab_rounds * len(self.ab_arms)} expected')
+
+        return True
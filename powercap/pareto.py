@@ -0,0 +1,158 @@
+"""
+Time-versus-energy analysis across cap levels.
+
+For every test case, i.e. system, partition, environment, test and number of
+GPUs, the repeats at each cap level (`cpufreq` column of the perflogs) are
+reduced to their median time and energy, from which the energy-delay products
+EDP = E*T and ED2P = E*T^2 are derived. A cap level is Pareto-optimal when no
+other level of the same test case is at least as fast while using less energy.
+The recommended cap is the one using the least energy whose slowdown over the
+uncapped run stays within the budget.
+
+The uncapped run is the one without a cap level, or at `high`/`performance`;
+if there is none, the highest numeric level is taken as the reference. The
+levels of a cap sweep are the windows of its steps (`step_time@<level>`,
+`energy_to_solution@<level>`); its variables without a level cover the whole
+sweep and are left out.
+
+    $ python -m powercap.pareto --store perfstore -n fall3d_raikoke_large_test
+    $ python -m powercap.pareto --store perfstore -t step_time --max-slowdown 5
+    $ python -m powercap.pareto applications/fall3d/log/*.log -o pareto.csv
+"""
+
+import argparse
+import sys
+
+import numpy as np
+import pandas as pd
+from tabulate import tabulate
+
+from powercap import perflog
+
+
+# A test case, whose cap levels are compared with each other
+CASE_KEYS = ['system', 'partition', 'environ', 'test', 'num_gpus']
+
+# Identity of one job, possibly sweeping several cap levels
+JOB_KEYS = CASE_KEYS + ['hash', 'timestamp']
+
+# Identity of one run, pairing its time and energy records
+RUN_KEYS = CASE_KEYS + ['cap', 'hash', 'timestamp']
+
+UNCAPPED = 'uncapped'
+
+_UNCAPPED_LEVELS = (UNCAPPED, 'high', 'performance')
+
+
+def cap_table(table, time_var='elapsed_time', energy_var='energy_to_solution'):
+    '''Median time and energy per test case and cap level.
+
+    `table` holds perflog rows (see `perflog.SCHEMA`), as a `pyarrow.Table`
+    or a `pandas.DataFrame`. Runs lacking either variable are ignored, as are
+    the variables of a cap sweep as a whole, e.g. its energy over all levels.
+    '''
+    df = table if isinstance(table, pd.DataFrame) else table.to_pandas()
+    df = df[df['perf_var'].isin([time_var, energy_var])]
+    swept = (df.assign(_capped=df['cpufreq'].notna())
+               .groupby(JOB_KEYS, dropna=False)['_capped'].transform('any'))
+    df = df[df['cpufreq'].notna() | ~swept]
+    df = df.assign(cap=df['cpufreq'].fillna(UNCAPPED))
+    runs = (df.groupby(RUN_KEYS + ['perf_var'], dropna=False)['perf_value']
+              .first()
+              .unstack('perf_var')
+              .reindex(columns=[time_var, energy_var])
+              .dropna()
+              .rename(columns={time_var: 'time', energy_var: 'energy'}))
+    caps = runs.groupby(CASE_KEYS + ['cap'], dropna=False).agg(
+        runs=('time', 'size'),
+        time=('time', 'median'),
+        energy=('energy', 'median'),
+    )
+    return caps.reset_index()
+
+
+def analyze(caps, max_slowdown=0.05):
+    '''Add EDP, ED2P, slowdown, Pareto and recommendation columns.
+
+    `caps` is the output of `cap_table()`; `max_slowdown` is the accepted
+    relative slowdown over the uncapped run, e.g. 0.05 for 5%.
+    '''
+    caps = caps.copy()
+    caps['edp'] = caps['energy'] * caps['time']
+    caps['ed2p'] = caps['edp'] * caps['time']
+
+    # Reference run of each test case: uncapped, or else the highest level
+    level = pd.to_numeric(caps['cap'], errors='coerce').fillna(-np.inf)
+    uncapped = caps['cap'].str.lower().isin(_UNCAPPED_LEVELS)
+    caps['_order'] = np.where(uncapped, np.inf, level)
+    cases = caps.groupby(CASE_KEYS, dropna=False)
+    reference = caps.loc[cases['_order'].idxmax(), CASE_KEYS + ['cap', 'time', 'energy']]
+    reference = reference.rename(columns={'cap': 'reference',
+                                          'time': '_ref_time',
+                                          'energy': '_ref_energy'})
+    caps = caps.merge(reference, on=CASE_KEYS, how='left')
+    caps['slowdown'] = caps['time'] / caps['_ref_time'] - 1
+    caps['saving'] = 1 - caps['energy'] / caps['_ref_energy']
+
+    # Sorted by time, a level is Pareto-optimal if it uses less energy than
+    # every faster level of the same test case
+    caps = caps.sort_values(CASE_KEYS + ['time', 'energy'], ignore_index=True)
+    cases = caps.groupby(CASE_KEYS, dropna=False)
+    caps['_best'] = cases['energy'].cummin()
+    faster_best = caps.groupby(CASE_KEYS, dropna=False)['_best'].shift(fill_value=np.inf)
+    caps['pareto'] = caps['energy'] < faster_best
+
+    within = caps[caps['slowdown'] <= max_slowdown]
+    best = within.groupby(CASE_KEYS, dropna=False)['energy'].idxmin()
+    caps['recommended'] = caps.index.isin(best)
+    return caps.drop(columns=['_order', '_ref_time', '_ref_energy', '_best'])
+
+
+def recommendations(caps):
+    '''The recommended cap level of each test case.'''
+    return caps[caps['recommended']].drop(columns=['pareto', 'recommended'])
+
+
+# ========================================================
+# Command line interface
+# ========================================================
+
+def _print(df):
+    print(tabulate(df, headers='keys', showindex=False, floatfmt='.4g'))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m powercap.pareto',
+                                     description=__doc__.split('\n\n')[0])
+    perflog.add_source_args(parser)
+    perflog.add_filter_args(parser)
+    parser.add_argument('-t', '--time-var', default='elapsed_time',
+                        help='time performance variable (default: %(default)s)')
+    parser.add_argument('-E', '--energy-var', default='energy_to_solution',
+                        help='energy performance variable (default: %(default)s)')
+    parser.add_argument('-b', '--max-slowdown', type=float, default=5.0,
+                        help='accepted slowdown over the uncapped run in percent '
+                             '(default: %(default)s)')
+    parser.add_argument('--pareto-only', action='store_true',
+                        help='only list the Pareto-optimal cap levels')
+    parser.add_argument('-o', '--output', help='write the full table as CSV')
+
+    args = parser.parse_args(argv)
+    table = perflog.perflogs_from_args(args, perf_var=[args.time_var, args.energy_var])
+    caps = analyze(cap_table(table, args.time_var, args.energy_var),
+                   args.max_slowdown / 100)
+    if caps.empty:
+        print(f'no runs with both {args.time_var!r} and {args.energy_var!r}',
+              file=sys.stderr)
+        return 1
+
+    if args.output:
+        caps.to_csv(args.output, index=False)
+
+    _print(caps[caps['pareto']] if args.pareto_only else caps)
+    print(f'\nRecommended caps (slowdown <= {args.max_slowdown:g}%)\n')
+    _print(recommendations(caps))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
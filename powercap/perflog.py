@@ -0,0 +1,684 @@
+"""
+Columnar store for ReFrame performance logs.
+
+Performance records are appended to a Parquet dataset with one row per
+performance variable, partitioned by system, partition and test:
+
+    <root>/system=<system>/partition=<partition>/test=<test>/<fragment>.parquet
+
+Every session writes new fragments; existing files are never rewritten, except
+by an explicit `compact`. The `_index.parquet` file at the root records, for
+each fragment, the `num_gpus`, `cpufreq` and performance variable values it
+contains and the time range it covers. Queries read the index first and only
+open the fragments that can match, so filtering a scaling table out of months
+of sweeps does not rescan the whole history.
+
+ReFrame writes to the store through the `perfstore` perflog handler registered
+in `configuration/*.py`:
+
+    "handlers_perflog": [
+        {
+            "type": "perfstore",
+            "basedir": "./perfstore",
+            "level": "info",
+        }
+    ]
+
+Existing CSV perflogs written by the `filelog` handler can be imported, and
+the store queried, from the command line:
+
+    $ python -m powercap.perflog --store perfstore import applications/fall3d/log/*.log
+    $ python -m powercap.perflog --store perfstore scaling -n fall3d_raikoke_large_test -v elapsed_time
+"""
+
+import argparse
+import datetime
+import logging
+import os
+import re
+import sys
+import urllib.parse
+import uuid
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from filelock import FileLock
+from tabulate import tabulate
+
+
+log = logging.getLogger(__name__)
+
+# One row per performance variable of a test case
+SCHEMA = pa.schema([
+    ('timestamp', pa.timestamp('s', tz='UTC')),
+    ('system', pa.string()),
+    ('partition', pa.string()),
+    ('environ', pa.string()),
+    ('test', pa.string()),
+    ('name', pa.string()),
+    ('hash', pa.string()),
+    ('result', pa.string()),
+    ('num_gpus', pa.int32()),
+    ('num_tasks', pa.int32()),
+    ('num_tasks_per_node', pa.int32()),
+    ('num_cpus_per_task', pa.int32()),
+    ('cpufreq', pa.string()),
+    ('nodelist', pa.string()),
+    ('executable', pa.string()),
+    ('executable_opts', pa.string()),
+    ('perf_var', pa.string()),
+    ('perf_value', pa.float64()),
+    ('perf_unit', pa.string()),
+    ('perf_ref', pa.float64()),
+    ('perf_lower', pa.float64()),
+    ('perf_upper', pa.float64()),
+])
+
+# One row per fragment
+INDEX_SCHEMA = pa.schema([
+    ('path', pa.string()),
+    ('system', pa.string()),
+    ('partition', pa.string()),
+    ('test', pa.string()),
+    ('num_rows', pa.int64()),
+    ('num_gpus', pa.list_(pa.int32())),
+    ('cpufreq', pa.list_(pa.string())),
+    ('perf_var', pa.list_(pa.string())),
+    ('time_min', pa.timestamp('s', tz='UTC')),
+    ('time_max', pa.timestamp('s', tz='UTC')),
+])
+
+PARTITION_KEYS = ('system', 'partition', 'test')
+
+# Index columns holding the set of values found in a fragment
+INDEXED_LISTS = ('num_gpus', 'cpufreq', 'perf_var')
+
+# e.g. 'fall3d_raikoke_large_test %num_gpus=4 /bd4223ae @thea:gh+default'
+_INFO = re.compile(r'^(?P<name>.+?)\s+/(?P<hash>[0-9a-f]+)\s+'
+                   r'@(?P<system>[^:]+):(?P<partition>[^+]+)\+(?P<environ>\S+)$')
+_NUM_GPUS = re.compile(r'num_gpus=(\d+)')
+_REPEAT_NO = re.compile(r'\s*%[$.]repeat_no=\d+')
+
+
+# ========================================================
+# Conversion helpers
+# ========================================================
+
+def _to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _to_str(value):
+    if value is None or value in ('', 'None', 'null'):
+        return None
+
+    if isinstance(value, (list, tuple)):
+        return ' '.join(map(str, value))
+
+    return str(value)
+
+
+def _to_utc(value):
+    if value is None:
+        return None
+
+    if isinstance(value, (int, float)):
+        return datetime.datetime.fromtimestamp(value, datetime.timezone.utc)
+
+    try:
+        value = datetime.datetime.fromisoformat(value)
+    except ValueError:
+        return None
+
+    if value.tzinfo is None:
+        return value.replace(tzinfo=datetime.timezone.utc)
+
+    return value.astimezone(datetime.timezone.utc)
+
+
+def normalize_name(name):
+    '''Strip the `--repeat` parameter, so that repeats share the same name.'''
+    return _REPEAT_NO.sub('', name).strip()
+
+
+def num_gpus_from_name(name):
+    match = _NUM_GPUS.search(name or '')
+    return int(match.group(1)) if match else None
+
+
+# ========================================================
+# Store
+# ========================================================
+
+class PerflogStore:
+    '''Append-only Parquet store of performance records.'''
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+
+    @property
+    def index_path(self):
+        return os.path.join(self.root, '_index.parquet')
+
+    def _lock(self):
+        os.makedirs(self.root, exist_ok=True)
+        return FileLock(os.path.join(self.root, '_index.lock'))
+
+    def _read_index(self):
+        if not os.path.exists(self.index_path):
+            return INDEX_SCHEMA.empty_table()
+
+        return pq.read_table(self.index_path, schema=INDEX_SCHEMA)
+
+    def _write_index(self, index):
+        tmp = f'{self.index_path}.{uuid.uuid4().hex}'
+        pq.write_table(index, tmp)
+        os.replace(tmp, self.index_path)
+
+    def _write_fragment(self, key, rows):
+        dirname = os.path.join(*(
+            f'{k}={urllib.parse.quote(v or "_", safe="")}'
+            for k, v in zip(PARTITION_KEYS, key)
+        ))
+        os.makedirs(os.path.join(self.root, dirname), exist_ok=True)
+        stamp = datetime.datetime.now().strftime('%Y%m%dT%H%M%S')
+        path = os.path.join(dirname, f'{stamp}-{uuid.uuid4().hex[:8]}.parquet')
+        table = pa.Table.from_pylist(rows, schema=SCHEMA)
+        tmp = os.path.join(self.root, f'{path}.tmp')
+        pq.write_table(table, tmp, compression='zstd')
+        os.replace(tmp, os.path.join(self.root, path))
+        return self._index_entry(path, key, table)
+
+    @staticmethod
+    def _index_entry(path, key, table):
+        entry = dict(zip(PARTITION_KEYS, key))
+        entry['path'] = path
+        entry['num_rows'] = table.num_rows
+        for col in INDEXED_LISTS:
+            entry[col] = sorted(v for v in set(table[col].to_pylist())
+                                if v is not None)
+
+        entry['time_min'] = pc.min(table['timestamp']).as_py()
+        entry['time_max'] = pc.max(table['timestamp']).as_py()
+        return entry
+
+    def append(self, rows):
+        '''Append performance records, given as dicts following `SCHEMA`.'''
+        groups = {}
+        for row in rows:
+            groups.setdefault(tuple(row[k] for k in PARTITION_KEYS), []).append(row)
+
+        entries = [self._write_fragment(key, grp) for key, grp in groups.items()]
+        if not entries:
+            return
+
+        with self._lock():
+            index = pa.concat_tables([
+                self._read_index(),
+                pa.Table.from_pylist(entries, schema=INDEX_SCHEMA)
+            ])
+            self._write_index(index)
+
+    def fragments(self, **filters):
+        '''Return the fragment paths that may contain rows matching `filters`.'''
+        index = self._read_index()
+        mask = pa.array([True] * index.num_rows, type=pa.bool_())
+        for col in PARTITION_KEYS:
+            if filters.get(col) is not None:
+                mask = pc.and_(mask, pc.is_in(index[col], _value_set(filters[col], pa.string())))
+
+        for col in INDEXED_LISTS:
+            if filters.get(col) is not None:
+                values = _value_set(filters[col], index.schema.field(col).type.value_type)
+                mask = pc.and_(mask, _list_any_in(index[col], values))
+
+        if filters.get('since') is not None:
+            mask = pc.and_(mask, pc.greater_equal(index['time_max'], _timestamp_scalar(filters['since'])))
+
+        if filters.get('until') is not None:
+            mask = pc.and_(mask, pc.less_equal(index['time_min'], _timestamp_scalar(filters['until'])))
+
+        return [os.path.join(self.root, p)
+                for p in index.filter(mask)['path'].to_pylist()]
+
+    def query(self, columns=None, **filters):
+        '''Return the rows matching `filters` as a `pyarrow.Table`.
+
+        Filters are given as keyword arguments named after the `SCHEMA`
+        columns; a filter value can be a scalar or a list of accepted values.
+        `since` and `until` restrict the timestamp range.
+        '''
+        paths = self.fragments(**filters)
+        if not paths:
+            table = SCHEMA.empty_table()
+            return table.select(columns) if columns else table
+
+        dataset = ds.dataset(paths, schema=SCHEMA, format='parquet')
+        return dataset.to_table(columns=columns, filter=_row_filter(filters))
+
+    def scaling_table(self, perf_var, by=('num_gpus', 'cpufreq'), **filters):
+        '''Aggregate `perf_var` over repeats, grouped by test case and `by`.'''
+        table = self.query(perf_var=perf_var, **filters)
+        keys = ['system', 'partition', 'test', *by, 'perf_unit']
+        table = table.group_by(keys).aggregate([
+            ('perf_value', 'count'),
+            ('perf_value', 'min'),
+            ('perf_value', 'approximate_median'),
+            ('perf_value', 'mean'),
+            ('perf_value', 'max'),
+        ])
+        return table.sort_by([(k, 'ascending') for k in keys[:-1]])
+
+    def reindex(self):
+        '''Rebuild the index by scanning all fragments.'''
+        with self._lock():
+            entries = []
+            for dirpath, _, filenames in os.walk(self.root):
+                for f in sorted(filenames):
+                    if not f.endswith('.parquet') or f == '_index.parquet':
+                        continue
+
+                    path = os.path.relpath(os.path.join(dirpath, f), self.root)
+                    table = pq.read_table(os.path.join(self.root, path), schema=SCHEMA)
+                    key = tuple(table[k][0].as_py() for k in PARTITION_KEYS)
+                    entries.append(self._index_entry(path, key, table))
+
+            self._write_index(pa.Table.from_pylist(entries, schema=INDEX_SCHEMA))
+
+    def compact(self):
+        '''Merge the fragments of every partition into a single file.'''
+        with self._lock():
+            groups = {}
+            for entry in self._read_index().to_pylist():
+                key = tuple(entry[k] for k in PARTITION_KEYS)
+                groups.setdefault(key, []).append(entry['path'])
+
+            entries = []
+            for key, paths in groups.items():
+                table = ds.dataset([os.path.join(self.root, p) for p in paths],
+                                   schema=SCHEMA, format='parquet').to_table()
+                entries.append(self._write_fragment(key, table.to_pylist()))
+                for p in paths:
+                    os.remove(os.path.join(self.root, p))
+
+            self._write_index(pa.Table.from_pylist(entries, schema=INDEX_SCHEMA))
+
+
+def _value_set(values, type):
+    if not isinstance(values, (list, tuple, set)):
+        values = [values]
+
+    return pa.array(list(values), type=type)
+
+
+def _list_any_in(lists, values):
+    '''Element-wise: does any item of each list belong to `values`?'''
+    lists = lists.combine_chunks()
+    hits = pc.is_in(pc.list_flatten(lists), value_set=values)
+    parents = pc.filter(pc.list_parent_indices(lists), hits)
+    return pc.is_in(pa.array(range(len(lists)), type=parents.type), value_set=parents)
+
+
+def _timestamp_scalar(value):
+    return pa.scalar(_to_utc(value), type=pa.timestamp('s', tz='UTC'))
+
+
+def _row_filter(filters):
+    expr = None
+    for col, value in filters.items():
+        if value is None:
+            continue
+
+        if col == 'since':
+            term = ds.field('timestamp') >= _timestamp_scalar(value)
+        elif col == 'until':
+            term = ds.field('timestamp') <= _timestamp_scalar(value)
+        else:
+            term = ds.field(col).isin(_value_set(value, SCHEMA.field(col).type))
+
+        expr = term if expr is None else expr & term
+
+    return expr
+
+
+# ========================================================
+# ReFrame perflog handler
+# ========================================================
+
+def cpufreq_of(check):
+    '''The CPU frequency a ReFrame test runs at, if it sets one.'''
+    cpufreq = getattr(check, 'cpufreq', None)
+    if cpufreq is None:
+        cpufreq = check.extra_resources.get('cpufreq', {}).get('cpufreq')
+
+    return cpufreq
+
+
+def rows_from_record(record):
+    '''Convert a ReFrame perflog record into store rows.'''
+    check = record.__rfm_check__
+    perfvalues = record.check_perfvalues or {}
+    if getattr(record, 'check_perf_var', None) is not None:
+        # Multiline records carry one performance variable each
+        perfvalues = {k: v for k, v in perfvalues.items()
+                      if k.split(':', 2)[-1] == record.check_perf_var}
+
+    completion_time = getattr(record, 'check_job_completion_time_unix', None)
+    cpufreq = cpufreq_of(check)
+
+    try:
+        nodelist = ','.join(check.job.nodelist or [])
+    except AttributeError:
+        nodelist = None
+
+    common = {
+        'timestamp': _to_utc(completion_time or record.created),
+        'system': record.check_system,
+        'partition': record.check_partition,
+        'environ': record.check_environ,
+        'test': type(check).__name__,
+        'name': normalize_name(check.display_name),
+        'hash': check.hashcode,
+        'result': record.check_result,
+        'num_gpus': _to_int(getattr(check, 'num_gpus', None)),
+        'num_tasks': _to_int(check.num_tasks),
+        'num_tasks_per_node': _to_int(check.num_tasks_per_node),
+        'num_cpus_per_task': _to_int(check.num_cpus_per_task),
+        'cpufreq': _to_str(cpufreq),
+        'nodelist': _to_str(nodelist),
+        'executable': _to_str(check.executable),
+        'executable_opts': _to_str(check.executable_opts),
+    }
+    rows = []
+    for key, (value, ref, lower, upper, unit) in perfvalues.items():
+        # Cap sweeps report one `<var>@<level>` variable per level
+        var, _, level = key.split(':', 2)[-1].partition('@')
+        rows.append({
+            **common,
+            'cpufreq': level or common['cpufreq'],
+            'perf_var': var,
+            'perf_value': _to_float(value),
+            'perf_unit': _to_str(unit),
+            'perf_ref': _to_float(ref),
+            'perf_lower': _to_float(lower),
+            'perf_upper': _to_float(upper),
+        })
+
+    return rows
+
+
+class PerfStoreHandler(logging.Handler):
+    '''Logging handler writing performance records into a `PerflogStore`.
+
+    Every record is written as it is logged, so that the runs of a session
+    that is killed are kept. With `batch_size`, rows are buffered until that
+    many are pending or the handler is flushed, e.g. when ReFrame shuts down
+    logging.
+    '''
+
+    def __init__(self, root, batch_size=None):
+        super().__init__()
+        self.store = PerflogStore(root)
+        self.batch_size = batch_size
+        self._rows = []
+
+    def emit(self, record):
+        try:
+            self._rows += rows_from_record(record)
+            if not self.batch_size or len(self._rows) >= self.batch_size:
+                self.flush()
+        except Exception:
+            self.handleError(record)
+
+    def flush(self):
+        self.acquire()
+        try:
+            rows, self._rows = self._rows, []
+            if rows:
+                self.store.append(rows)
+        finally:
+            self.release()
+
+    def close(self):
+        self.flush()
+        super().close()
+
+
+def create_perfstore_handler(site_config, config_prefix):
+    '''Create a `perfstore` handler; register with `register_log_handler`.'''
+    basedir = site_config.get(f'{config_prefix}/basedir') or './perfstore'
+    root = os.path.join(site_config.get('systems/0/prefix'),
+                        os.path.expandvars(basedir))
+    return PerfStoreHandler(root, site_config.get(f'{config_prefix}/batch_size'))
+
+
+# ========================================================
+# Legacy CSV perflogs
+# ========================================================
+
+def read_filelog(path):
+    '''Parse a perflog written by ReFrame's `filelog` handler into store rows.
+
+    Both the comma- and pipe-delimited formats of `configuration/*.py` are
+    supported, including files with several header blocks. List-valued
+    columns are joined with the delimiter by ReFrame, so in comma-delimited
+    files any surplus fields are attributed to `job_nodelist`; the test
+    identity is taken from the `info` column whenever it is present.
+    '''
+    default_test = os.path.splitext(os.path.basename(path))[0]
+    rows = []
+    header = delim = None
+    with open(path) as fp:
+        for lineno, line in enumerate(fp, start=1):
+            line = line.rstrip('\n')
+            if not line.strip():
+                continue
+
+            if line.startswith('asctime'):
+                delim = '|' if line.count('|') > line.count(',') else ','
+                header = line.split(delim)
+                continue
+
+            if header is None:
+                continue
+
+            fields = line.split(delim)
+            surplus = len(fields) - len(header)
+            if surplus > 0 and 'job_nodelist' in header:
+                i = header.index('job_nodelist')
+                fields[i:i + surplus + 1] = [delim.join(fields[i:i + surplus + 1])]
+            elif surplus != 0:
+                log.warning(f'{path}:{lineno}: expected {len(header)} fields, '
+                            f'found {len(fields)}; skipping')
+                continue
+
+            rows += _rows_from_filelog_record(dict(zip(header, fields)),
+                                              default_test)
+
+    return rows
+
+
+def _rows_from_filelog_record(record, default_test):
+    info = _INFO.match(record.get('info', ''))
+    if info:
+        name = normalize_name(info['name'])
+        ident = {
+            'system': info['system'],
+            'partition': info['partition'],
+            'environ': info['environ'],
+            'test': name.split()[0],
+            'name': name,
+            'hash': info['hash'],
+        }
+    else:
+        ident = {
+            'system': record.get('system'),
+            'partition': record.get('partition'),
+            'environ': record.get('environ'),
+            'test': default_test,
+            'name': default_test,
+            'hash': None,
+        }
+
+    num_gpus = (num_gpus_from_name(ident['name']) or
+                _to_int(record.get('num_tasks')) or
+                _to_int(record.get('num_tasks_per_node')))
+    common = {
+        **ident,
+        'timestamp': (_to_utc(record.get('job_completion_time')) or
+                      _to_utc(record.get('asctime'))),
+        'result': _to_str(record.get('result')),
+        'num_gpus': num_gpus,
+        'num_tasks': _to_int(record.get('num_tasks')),
+        'num_tasks_per_node': _to_int(record.get('num_tasks_per_node')),
+        'num_cpus_per_task': _to_int(record.get('num_cpus_per_task')),
+        'cpufreq': _to_str(record.get('cpufreq')),
+        'nodelist': _to_str(record.get('job_nodelist')),
+        'executable': _to_str(record.get('executable')),
+        'executable_opts': _to_str(record.get('executable_opts')),
+    }
+    rows = []
+    for col, value in record.items():
+        if not col.endswith('_value') or f'{col[:-6]}_unit' not in record:
+            continue
+
+        var = col[:-6]
+        rows.append({
+            **common,
+            'perf_var': var,
+            'perf_value': _to_float(value),
+            'perf_unit': _to_str(record.get(f'{var}_unit')),
+            'perf_ref': _to_float(record.get(f'{var}_ref')),
+            'perf_lower': _to_float(record.get(f'{var}_lower_thres')),
+            'perf_upper': _to_float(record.get(f'{var}_upper_thres')),
+        })
+
+    return rows
+
+
+def read_perflogs(store=None, files=(), columns=None, **filters):
+    '''Rows matching `filters` from a store and from filelog CSV perflogs.
+
+    Returns a single `pyarrow.Table` following `SCHEMA`, so that the analysis
+    tools work the same on the store and on perflogs that were never imported.
+    '''
+    tables = []
+    if store is not None:
+        tables.append(PerflogStore(store).query(**filters))
+
+    expr = _row_filter(filters)
+    for f in files:
+        table = pa.Table.from_pylist(read_filelog(f), schema=SCHEMA)
+        tables.append(table if expr is None else table.filter(expr))
+
+    table = pa.concat_tables(tables) if tables else SCHEMA.empty_table()
+    return table.select(columns) if columns else table
+
+
+# ========================================================
+# Command line interface
+# ========================================================
+
+QUERY_COLUMNS = ['timestamp', 'name', 'system', 'partition', 'environ',
+                 'num_gpus', 'cpufreq', 'perf_var', 'perf_value', 'perf_unit']
+
+
+def add_filter_args(parser):
+    '''Add the test case filter options shared by the command line tools.'''
+    parser.add_argument('-n', '--test', action='append',
+                        help='test class name (repeatable)')
+    parser.add_argument('-s', '--system', action='append')
+    parser.add_argument('-p', '--partition', action='append')
+    parser.add_argument('-e', '--environ', action='append')
+    parser.add_argument('-g', '--num-gpus', type=int, action='append')
+    parser.add_argument('-f', '--cpufreq', action='append')
+    parser.add_argument('--since', help='ISO 8601 date/time')
+    parser.add_argument('--until', help='ISO 8601 date/time')
+
+
+def add_source_args(parser):
+    '''Add the perflog source options shared by the analysis tools.'''
+    parser.add_argument('logs', nargs='*',
+                        help='filelog CSV perflogs read in addition to the store')
+    parser.add_argument('--store',
+                        help='root directory of the store '
+                             '(default: perfstore, unless perflogs are given)')
+
+
+def perflogs_from_args(args, **filters):
+    '''Read the perflogs selected by the `add_source_args` options.'''
+    store = args.store
+    if store is None and not args.logs:
+        store = 'perfstore'
+
+    return read_perflogs(store, args.logs, **filters_from_args(args), **filters)
+
+
+def filters_from_args(args):
+    return {
+        'test': args.test,
+        'system': args.system,
+        'partition': args.partition,
+        'environ': args.environ,
+        'num_gpus': args.num_gpus,
+        'cpufreq': args.cpufreq,
+        'since': args.since,
+        'until': args.until,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m powercap.perflog',
+                                     description=__doc__.split('\n\n')[0])
+    parser.add_argument('--store', default='perfstore',
+                        help='root directory of the store (default: %(default)s)')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    import_cmd = commands.add_parser('import', help='import filelog CSV perflogs')
+    import_cmd.add_argument('files', nargs='+')
+
+    query_cmd = commands.add_parser('query', help='print matching records')
+    add_filter_args(query_cmd)
+    query_cmd.add_argument('-v', '--perf-var', action='append')
+
+    scaling_cmd = commands.add_parser('scaling', help='print a scaling table')
+    add_filter_args(scaling_cmd)
+    scaling_cmd.add_argument('-v', '--perf-var', required=True)
+
+    commands.add_parser('reindex', help='rebuild the fragment index')
+    commands.add_parser('compact', help='merge fragments per partition')
+
+    args = parser.parse_args(argv)
+    store = PerflogStore(args.store)
+    if args.command == 'import':
+        for f in args.files:
+            rows = read_filelog(f)
+            store.append(rows)
+            print(f'{f}: imported {len(rows)} record(s)')
+    elif args.command == 'query':
+        table = store.query(columns=QUERY_COLUMNS, perf_var=args.perf_var,
+                            **filters_from_args(args))
+        print(tabulate(table.to_pylist(), headers='keys'))
+    elif args.command == 'scaling':
+        table = store.scaling_table(args.perf_var, **filters_from_args(args))
+        print(tabulate(table.to_pylist(), headers='keys'))
+    elif args.command == 'reindex':
+        store.reindex()
+    elif args.command == 'compact':
+        store.compact()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,578 @@
+"""
+Power sampling alongside a running job.
+
+A sampler reads a power counter source at a fixed interval and streams the
+samples into a fixed-size binary ring buffer, one file per node. The buffer
+header keeps the running energy integral, the peak power and the sampled time
+range, so totals stay exact even after old samples have been overwritten.
+
+Sources are selected with a specification string; several sources separated
+by commas are summed, e.g. CPU packages plus GPUs:
+
+    rapl                  RAPL package energy counters, /sys/class/powercap
+    hwmon[:<pattern>]     hwmon power sensors (uW), optionally only those whose
+                          '<hwmon name>/<sensor label>' matches the glob pattern
+    nvidia-smi            `nvidia-smi --query-gpu=power.draw` of all GPUs, streamed
+                          by a single process at the sampling interval
+    file:<path>           replay watt values from a text file (for testing)
+
+For example, on a node:
+
+    $ python -m powercap.power sample --source rapl,nvidia-smi --interval 0.1 --output power_%h.bin &
+    $ python -m powercap.power summary power_*.bin --windows power_window.txt
+
+Reads that fail are logged and skipped, so that a sensor glitch leaves a gap
+in the samples rather than ending the sampling.
+
+The sampler can also wrap the command of each rank, sampling on the first
+local rank of every node only, which is what the `powermon` launcher modifier
+does (see `powercap/launchers.py`):
+
+    $ srun python -m powercap.power wrap --output powermon_%h.bin -- ./app
+
+The `power_sampling` mixin in `powercap/mixins.py` starts and stops the
+sampler around the launched job and derives its performance variables from
+`summarize()`.
+"""
+
+import argparse
+import fnmatch
+import glob
+import logging
+import mmap
+import os
+import re
+import signal
+import socket
+import struct
+import subprocess
+import sys
+import threading
+import time
+
+
+log = logging.getLogger(__name__)
+
+
+# ========================================================
+# Power counter sources
+# ========================================================
+
+def _read_number(path):
+    with open(path) as fp:
+        return int(fp.read().strip())
+
+
+class RaplSource:
+    '''Package power from the RAPL energy counters (sub-zones are skipped).'''
+
+    def __init__(self, root='/sys/class/powercap'):
+        self.zones = [z for z in sorted(glob.glob(os.path.join(root, 'intel-rapl:*')))
+                      if re.fullmatch(r'intel-rapl:\d+', os.path.basename(z))]
+        if not self.zones:
+            raise OSError(f'no RAPL zones found under {root}')
+
+        self.max_energy = [_read_number(os.path.join(z, 'max_energy_range_uj'))
+                           for z in self.zones]
+        self._last = None
+
+    def read(self):
+        now = time.monotonic()
+        energy = [_read_number(os.path.join(z, 'energy_uj')) for z in self.zones]
+        last, self._last = self._last, (now, energy)
+        if last is None:
+            return None
+
+        delta = 0
+        for e, e0, emax in zip(energy, last[1], self.max_energy):
+            # Counters wrap around at max_energy_range_uj
+            delta += e - e0 if e >= e0 else e + emax - e0
+
+        return delta / 1e6 / (now - last[0])
+
+
+class HwmonSource:
+    '''Sum of hwmon power sensors (`power*_input` or `power*_average`).'''
+
+    def __init__(self, pattern=None, root='/sys/class/hwmon'):
+        self.sensors = []
+        for hwmon in sorted(glob.glob(os.path.join(root, 'hwmon*'))):
+            try:
+                with open(os.path.join(hwmon, 'name')) as fp:
+                    name = fp.read().strip()
+            except OSError:
+                name = os.path.basename(hwmon)
+
+            for path in sorted(glob.glob(os.path.join(hwmon, 'power*_input')) +
+                               glob.glob(os.path.join(hwmon, 'power*_average'))):
+                prefix = path.rsplit('_', 1)[0]
+                label = ''
+                for suffix in ('_label', '_oem_info'):
+                    if os.path.exists(prefix + suffix):
+                        with open(prefix + suffix) as fp:
+                            label = fp.read().strip()
+
+                        break
+
+                if pattern is None or fnmatch.fnmatch(f'{name}/{label}', pattern):
+                    self.sensors.append(path)
+
+        if not self.sensors:
+            raise OSError(f'no hwmon power sensors matching {pattern!r} under {root}')
+
+    def read(self):
+        return sum(_read_number(p) for p in self.sensors) / 1e6
+
+
+def parse_nvidia_smi_csv(text):
+    '''Return the watt values of `nvidia-smi --format=csv` output.'''
+    watts = []
+    for line in text.splitlines():
+        for field in line.split(','):
+            field = field.strip().removesuffix('W').strip()
+            try:
+                watts.append(float(field))
+            except ValueError:
+                # Header, timestamps or '[N/A]'
+                continue
+
+    return watts
+
+
+class NvidiaSmiSource:
+    '''Total board power of all GPUs as reported by `nvidia-smi`.
+
+    Once started, a single `nvidia-smi` process reports every GPU at the
+    sampling interval; `read()` returns the total of the last complete report,
+    or None before the first one.
+    '''
+
+    def __init__(self, command='nvidia-smi'):
+        self.command = command
+        self._process = None
+        self._watts = {}
+        self._total = None
+
+    def start(self, interval):
+        self._process = subprocess.Popen(
+            [self.command, '--query-gpu=index,power.draw', '--format=csv,noheader,nounits',
+             f'--loop-ms={max(1, round(interval * 1000))}'],
+            stdout=subprocess.PIPE, text=True
+        )
+        threading.Thread(target=self._follow, daemon=True).start()
+
+    def _follow(self):
+        reported = set()
+        for line in self._process.stdout:
+            index, _, watts = line.partition(',')
+            index = index.strip()
+            if index in reported:
+                # The GPUs are listed in turn; a repeat starts the next report
+                self._total = sum(self._watts.values())
+                reported.clear()
+
+            reported.add(index)
+            try:
+                self._watts[index] = float(watts)
+            except ValueError:
+                # '[N/A]' while a reading is unavailable: keep the last one
+                continue
+
+    def read(self):
+        if self._process is None:
+            raise RuntimeError('nvidia-smi source read before it was started')
+
+        if self._process.poll() is not None:
+            raise OSError(f'{self.command} exited with status {self._process.returncode}')
+
+        return self._total
+
+    def close(self):
+        if self._process is not None and self._process.poll() is None:
+            self._process.terminate()
+            self._process.wait()
+
+
+class FileSource:
+    '''Replay the watt values of a text file, one sample per line.
+
+    Lines may hold several comma-separated values, in the style of the
+    `nvidia-smi` CSV output, which are summed. The trace is replayed cyclically.
+    '''
+
+    def __init__(self, path):
+        with open(path) as fp:
+            self.samples = [sum(parse_nvidia_smi_csv(line)) for line in fp
+                            if line.strip() and not line.startswith('#')]
+
+        if not self.samples:
+            raise ValueError(f'no samples found in {path}')
+
+        self._next = 0
+
+    def read(self):
+        watts = self.samples[self._next % len(self.samples)]
+        self._next += 1
+        return watts
+
+
+class CompositeSource:
+    '''Sum of several sources; no sample until all of them have one.'''
+
+    def __init__(self, sources):
+        self.sources = sources
+
+    def start(self, interval):
+        for s in self.sources:
+            start_source(s, interval)
+
+    def read(self):
+        watts = [s.read() for s in self.sources]
+        return None if None in watts else sum(watts)
+
+    def close(self):
+        for s in self.sources:
+            close_source(s)
+
+
+SOURCES = {
+    'rapl': RaplSource,
+    'hwmon': HwmonSource,
+    'nvidia-smi': NvidiaSmiSource,
+    'file': FileSource,
+}
+
+
+def make_source(spec):
+    '''Create a source from a specification such as `rapl,nvidia-smi`.'''
+    sources = []
+    for item in spec.split(','):
+        name, _, arg = item.strip().partition(':')
+        try:
+            source_cls = SOURCES[name]
+        except KeyError:
+            raise ValueError(f'unknown power source {name!r}; '
+                             f'available sources: {", ".join(SOURCES)}') from None
+
+        sources.append(source_cls(arg) if arg else source_cls())
+
+    return sources[0] if len(sources) == 1 else CompositeSource(sources)
+
+
+def start_source(source, interval):
+    '''Start the background reader of `source`, if it has one.'''
+    if hasattr(source, 'start'):
+        source.start(interval)
+
+
+def close_source(source):
+    '''Stop the background reader of `source`, if it has one.'''
+    if hasattr(source, 'close'):
+        source.close()
+
+
+# ========================================================
+# Ring buffer
+# ========================================================
+
+MAGIC = b'PWRB'
+VERSION = 1
+
+# magic, version, record size, capacity, samples written,
+# energy (J), peak power (W), first and last sample time (s since the epoch)
+HEADER = struct.Struct('<4sHHIQdddd')
+HEADER_SIZE = 64
+
+# sample time (s since the epoch), power (W)
+RECORD = struct.Struct('<df')
+
+
+class RingBuffer:
+    '''Memory-mapped ring buffer of power samples.
+
+    Open with `RingBuffer.create()` for writing and `RingBuffer(path)` for
+    reading. `count` is the number of samples ever written; only the last
+    `capacity` of them are retained.
+    '''
+
+    def __init__(self, path, writable=False):
+        self.path = path
+        self._fp = open(path, 'r+b' if writable else 'rb')
+        access = mmap.ACCESS_WRITE if writable else mmap.ACCESS_READ
+        self._map = mmap.mmap(self._fp.fileno(), 0, access=access)
+        (magic, version, record_size, self.capacity, self.count,
+         self.energy, self.peak, self.t_first, self.t_last) = HEADER.unpack_from(self._map)
+        if magic != MAGIC or version != VERSION or record_size != RECORD.size:
+            raise ValueError(f'{path}: not a power ring buffer')
+
+        self._last = self._sample(self.count - 1) if self.count else None
+
+    @classmethod
+    def create(cls, path, capacity):
+        with open(path, 'wb') as fp:
+            fp.write(HEADER.pack(MAGIC, VERSION, RECORD.size, capacity,
+                                 0, 0.0, 0.0, 0.0, 0.0).ljust(HEADER_SIZE, b'\0'))
+            fp.truncate(HEADER_SIZE + capacity * RECORD.size)
+
+        return cls(path, writable=True)
+
+    def _sample(self, i):
+        return RECORD.unpack_from(self._map, HEADER_SIZE + (i % self.capacity) * RECORD.size)
+
+    def append(self, t, watts):
+        if self._last is None:
+            self.t_first = t
+        else:
+            t0, w0 = self._last
+            self.energy += 0.5 * (w0 + watts) * (t - t0)
+
+        self.peak = max(self.peak, watts)
+        self.t_last = t
+        RECORD.pack_into(self._map, HEADER_SIZE + (self.count % self.capacity) * RECORD.size,
+                         t, watts)
+        self.count += 1
+        self._last = (t, watts)
+        HEADER.pack_into(self._map, 0, MAGIC, VERSION, RECORD.size, self.capacity,
+                         self.count, self.energy, self.peak, self.t_first, self.t_last)
+
+    def samples(self):
+        '''Return the retained samples as a list of `(time, watts)`, oldest first.'''
+        start = max(0, self.count - self.capacity)
+        return [self._sample(i) for i in range(start, self.count)]
+
+    def close(self):
+        self._map.close()
+        self._fp.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# ========================================================
+# Sampler
+# ========================================================
+
+def run_sampler(source, buffer, interval, stop):
+    '''Sample `source` into `buffer` every `interval` seconds until `stop` is set.
+
+    Failed reads are skipped; the first of a series is logged, and so is the
+    recovery.
+    '''
+    start_source(source, interval)
+    deadline = time.monotonic()
+    failed = 0
+    try:
+        while not stop.is_set():
+            try:
+                watts = source.read()
+            except Exception as err:
+                if not failed:
+                    log.warning(f'power read failed, skipping: {err}')
+
+                failed += 1
+            else:
+                if failed:
+                    log.warning(f'power reads resumed after {failed} failures')
+                    failed = 0
+
+                if watts is not None:
+                    buffer.append(time.time(), watts)
+
+            deadline += interval
+            stop.wait(max(0.0, deadline - time.monotonic()))
+    finally:
+        close_source(source)
+
+
+# ========================================================
+# Analysis
+# ========================================================
+
+def read_windows(path):
+    '''Read `<label> start|end <time>` markers into `{label: (start, end)}`.'''
+    windows = {}
+    with open(path) as fp:
+        for line in fp:
+            label, edge, t = line.split()
+            start, end = windows.get(label, (None, None))
+            if edge == 'start':
+                start = float(t)
+            else:
+                end = float(t)
+
+            windows[label] = (start, end)
+
+    return windows
+
+
+def _integrate(samples, start, end):
+    '''Trapezoidal energy and peak power of `samples` within `[start, end]`.'''
+    def interp(t, a, b):
+        return a[1] + (b[1] - a[1]) * (t - a[0]) / (b[0] - a[0])
+
+    energy, peak = 0.0, None
+    for a, b in zip(samples, samples[1:]):
+        lo, hi = max(a[0], start), min(b[0], end)
+        if hi <= lo:
+            continue
+
+        w_lo, w_hi = interp(lo, a, b), interp(hi, a, b)
+        energy += 0.5 * (w_lo + w_hi) * (hi - lo)
+        peak = max(w_lo, w_hi) if peak is None else max(peak, w_lo, w_hi)
+
+    return energy, peak
+
+
+def summarize(paths, window=None):
+    '''Summarize the power samples of one buffer per node.
+
+    Without a `window` the totals of the whole sampling period are returned.
+    With a `(start, end)` window, the samples are integrated over that time
+    range; if it is no longer fully retained in a buffer, the energy of that
+    node is estimated from its mean power over the whole period. For
+    multi-node runs `peak_power_W` is the sum of the per-node peaks, i.e. an
+    upper bound of the peak of the total power.
+    '''
+    energy = peak = 0.0
+    t_first, t_last = [], []
+    for path in paths:
+        with RingBuffer(path) as buffer:
+            if buffer.count < 2:
+                raise ValueError(f'{path}: not enough power samples')
+
+            t_first.append(buffer.t_first)
+            t_last.append(buffer.t_last)
+            if window is None:
+                energy += buffer.energy
+                peak += buffer.peak
+                continue
+
+            samples = buffer.samples()
+            if samples[0][0] <= window[0]:
+                e, p = _integrate(samples, *window)
+            else:
+                e = buffer.energy / (buffer.t_last - buffer.t_first) * (window[1] - window[0])
+                p = buffer.peak
+
+            energy += e
+            peak += p or 0.0
+
+    if not paths:
+        raise ValueError('no power buffers found')
+
+    start, end = window or (min(t_first), max(t_last))
+    return {
+        'energy_J': energy,
+        'avg_power_W': energy / (end - start),
+        'peak_power_W': peak,
+        'duration_s': end - start,
+    }
+
+
+# ========================================================
+# Command line interface
+# ========================================================
+
+def _sample(args):
+    source = make_source(args.source)
+    output = args.output.replace('%h', socket.gethostname())
+    stop = threading.Event()
+    for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+        signal.signal(signum, lambda *_: stop.set())
+
+    with RingBuffer.create(output, args.capacity) as buffer:
+        run_sampler(source, buffer, args.interval, stop)
+
+
+# Node-local rank, as set by the common launchers
+_LOCAL_RANK_VARS = ('SLURM_LOCALID', 'OMPI_COMM_WORLD_LOCAL_RANK',
+                    'MPI_LOCALRANKID', 'PMI_LOCAL_RANK')
+
+
+def local_rank():
+    for var in _LOCAL_RANK_VARS:
+        if var in os.environ:
+            return int(os.environ[var])
+
+    return 0
+
+
+def _wrap(args):
+    command = args.argv[1:] if args.argv[:1] == ['--'] else args.argv
+    if not command:
+        print('error: no command to run', file=sys.stderr)
+        return 2
+
+    if local_rank() != 0:
+        os.execvp(command[0], command)
+
+    source = make_source(args.source)
+    output = args.output.replace('%h', socket.gethostname())
+    stop = threading.Event()
+    with RingBuffer.create(output, args.capacity) as buffer:
+        sampler = threading.Thread(target=run_sampler,
+                                   args=(source, buffer, args.interval, stop))
+        sampler.start()
+        try:
+            return subprocess.call(command)
+        finally:
+            stop.set()
+            sampler.join()
+
+
+def _summary(args):
+    windows = read_windows(args.windows) if args.windows else {}
+    print(f'{"window":<16} {"energy_J":>14} {"avg_power_W":>12} '
+          f'{"peak_power_W":>12} {"duration_s":>10}')
+    for label, window in [('all', None), *windows.items()]:
+        s = summarize(args.buffers, window)
+        print(f'{label:<16} {s["energy_J"]:>14.1f} {s["avg_power_W"]:>12.1f} '
+              f'{s["peak_power_W"]:>12.1f} {s["duration_s"]:>10.1f}')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m powercap.power',
+                                     description=__doc__.split('\n\n')[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    sample_cmd = commands.add_parser('sample', help='sample power until terminated')
+    sample_cmd.add_argument('--source', default='nvidia-smi',
+                            help='power source specification (default: %(default)s)')
+    sample_cmd.add_argument('--interval', type=float, default=0.1,
+                            help='sampling interval in seconds (default: %(default)s)')
+    sample_cmd.add_argument('--capacity', type=int, default=65536,
+                            help='ring buffer capacity in samples (default: %(default)s)')
+    sample_cmd.add_argument('--output', default='power_%h.bin',
+                            help="ring buffer file; '%%h' expands to the host name")
+
+    wrap_cmd = commands.add_parser(
+        'wrap', help='run a command, sampling power on the first local rank'
+    )
+    wrap_cmd.add_argument('--source', default='nvidia-smi',
+                          help='power source specification (default: %(default)s)')
+    wrap_cmd.add_argument('--interval', type=float, default=0.1,
+                          help='sampling interval in seconds (default: %(default)s)')
+    wrap_cmd.add_argument('--capacity', type=int, default=65536,
+                          help='ring buffer capacity in samples (default: %(default)s)')
+    wrap_cmd.add_argument('--output', default='powermon_%h.bin',
+                          help="ring buffer file; '%%h' expands to the host name")
+    wrap_cmd.add_argument('argv', metavar='command', nargs=argparse.REMAINDER)
+
+    summary_cmd = commands.add_parser('summary', help='summarize ring buffers')
+    summary_cmd.add_argument('buffers', nargs='+')
+    summary_cmd.add_argument('--windows', help='file of time window markers')
+
+    args = parser.parse_args(argv)
+    if args.command == 'sample':
+        _sample(args)
+    elif args.command == 'wrap':
+        return _wrap(args)
+    else:
+        _summary(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,289 @@
+r"""
+Live progress telemetry of a running application.
+
+A sidecar follows the standard output of the job while it is written and
+picks up the progress lines of the application, e.g. SPECFEM's
+`time step : N / M`. Every progress line appends a row to a CSV time series:
+
+    time,step,total,steps_per_s,eta_s,window,event
+
+with the step rate over the last `--rate-window` seconds, the estimated time
+to completion if the total number of steps is known, and the power window the
+job is in (see `power_window.txt` in `powercap/mixins.py`), e.g. the cap level
+of a cap sweep, so that step rate drops can be put next to the cap in force.
+Rows can also be sent as JSON datagrams to a UDP socket.
+
+If the step does not advance for `--stall` seconds, a `stall` event is
+recorded and the `--on-stall` shell command is run, e.g. to cancel a hung job
+instead of waiting for its time limit; a `resume` event follows if the
+application makes progress again. The time counts from the first progress
+line, or from the opening of the `run` window if that comes first, so that
+the pre-run commands, e.g. the staging of inputs, are not taken for a stall.
+
+Progress patterns are regular expressions with a `step` and an optional
+`total` named group, or one of the presets of `PATTERNS`:
+
+    $ python -m powercap.progress watch rfm_job.out --pattern specfem --stall 600 --on-stall 'scancel $SLURM_JOB_ID' &
+    $ python -m powercap.progress watch rfm_job.out --pattern '^\s*(?P<step>\d+)\s' --total 100 --udp localhost:9999 &
+    $ python -m powercap.progress summary progress.csv
+"""
+
+import argparse
+import collections
+import csv
+import json
+import os
+import re
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+from tabulate import tabulate
+
+
+PATTERNS = {
+    # time step :     100 /    5000
+    'specfem': r'time step\s*:\s*(?P<step>\d+)\s*/\s*(?P<total>\d+)',
+}
+
+COLUMNS = ['time', 'step', 'total', 'steps_per_s', 'eta_s', 'window', 'event']
+
+
+class Tracker:
+    '''Step rate and time to completion over a sliding time window.'''
+
+    def __init__(self, rate_window=60.0, total=None):
+        self.rate_window = rate_window
+        self.total = total
+        self.history = collections.deque()
+
+    def update(self, t, step, total=None):
+        if self.history and step < self.history[-1][1]:
+            # Restarted, e.g. the next level of a cap sweep
+            self.history.clear()
+
+        self.history.append((t, step))
+        while len(self.history) > 2 and t - self.history[0][0] > self.rate_window:
+            self.history.popleft()
+
+        total = total or self.total
+        rate = eta = None
+        (t0, s0), (t1, s1) = self.history[0], self.history[-1]
+        if t1 > t0:
+            rate = (s1 - s0) / (t1 - t0)
+            if total and rate > 0:
+                eta = (total - step) / rate
+
+        return {'time': t, 'step': step, 'total': total, 'steps_per_s': rate, 'eta_s': eta}
+
+
+def current_window(path):
+    '''Label of the innermost window of a marker file still open, if any.'''
+    if not path or not os.path.exists(path):
+        return None
+
+    open_windows = []
+    with open(path) as fp:
+        for line in fp:
+            label, edge, _ = line.split()
+            if edge == 'start':
+                open_windows.append(label)
+            elif label in open_windows:
+                open_windows.remove(label)
+
+    return open_windows[-1] if open_windows else None
+
+
+def window_start(path, label):
+    '''Time the window `label` of a marker file was first opened, if it was.'''
+    if not path or not os.path.exists(path):
+        return None
+
+    with open(path) as fp:
+        for line in fp:
+            name, edge, t = line.split()
+            if name == label and edge == 'start':
+                return float(t)
+
+    return None
+
+
+def follow(path, interval, stop):
+    '''Complete lines appended to `path` until `stop` is set.'''
+    fp = None
+    pending = ''
+    while not stop.is_set():
+        if fp is None:
+            if not os.path.exists(path):
+                stop.wait(interval)
+                continue
+
+            fp = open(path, errors='replace')
+
+        if os.path.getsize(path) < fp.tell():
+            # Truncated
+            fp.seek(0)
+            pending = ''
+
+        data = fp.read()
+        if not data:
+            yield None
+            stop.wait(interval)
+            continue
+
+        *lines, pending = (pending + data).split('\n')
+        yield from lines
+
+    if fp is not None:
+        fp.close()
+
+
+class Watcher:
+    '''Follow an output file and record the progress of the application.'''
+
+    def __init__(self, path, pattern, output, total=None, rate_window=60.0,
+                 stall=None, on_stall=None, windows=None, udp=None):
+        self.path = path
+        self.regex = re.compile(PATTERNS.get(pattern, pattern))
+        self.output = output
+        self.tracker = Tracker(rate_window, total)
+        self.stall = stall
+        self.on_stall = on_stall
+        self.windows = windows
+        self.udp = udp
+        # Armed by the first progress line or the opening of the run window
+        self.last_progress = None
+        self.last_step = None
+        self.stalled = False
+
+    def emit(self, writer, sock, row):
+        row = {**row, 'window': current_window(self.windows)}
+        writer.writerow(row)
+        if sock is not None:
+            sock.sendto(json.dumps(row).encode(), self.udp)
+
+    def check_stall(self, writer, sock, now):
+        if self.last_progress is None:
+            self.last_progress = window_start(self.windows, 'run')
+            if self.last_progress is None:
+                return
+
+        if self.stall and not self.stalled and now - self.last_progress > self.stall:
+            self.stalled = True
+            self.emit(writer, sock, {'time': now, 'step': self.last_step, 'event': 'stall'})
+            if self.on_stall:
+                subprocess.Popen(self.on_stall, shell=True)
+
+    def run(self, interval, stop):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM) if self.udp else None
+        with open(self.output, 'w', newline='', buffering=1) as fp:
+            writer = csv.DictWriter(fp, COLUMNS)
+            writer.writeheader()
+            for line in follow(self.path, interval, stop):
+                now = time.time()
+                match = self.regex.search(line) if line else None
+                if match is None:
+                    self.check_stall(writer, sock, now)
+                    continue
+
+                groups = match.groupdict()
+                step = int(groups['step'])
+                total = int(groups['total']) if groups.get('total') else None
+                row = self.tracker.update(now, step, total)
+                if step != self.last_step:
+                    self.last_progress = now
+                    self.last_step = step
+                    if self.stalled:
+                        self.stalled = False
+                        row['event'] = 'resume'
+
+                self.emit(writer, sock, row)
+
+        if sock is not None:
+            sock.close()
+
+
+# ========================================================
+# Analysis
+# ========================================================
+
+def read_progress(path):
+    with open(path, newline='') as fp:
+        return list(csv.DictReader(fp))
+
+
+def summarize(rows):
+    '''`{window: {'steps', 'mean_steps_per_s', 'min_steps_per_s', 'stalls'}}`.'''
+    summary = {}
+    for row in rows:
+        s = summary.setdefault(row['window'] or '-', {'rates': [], 'steps': 0, 'stalls': 0})
+        if row['event'] == 'stall':
+            s['stalls'] += 1
+        if row['steps_per_s']:
+            s['rates'].append(float(row['steps_per_s']))
+        if row['step']:
+            s['steps'] = max(s['steps'], int(row['step']))
+
+    return {window: {'steps': s['steps'],
+                     'mean_steps_per_s': sum(s['rates']) / len(s['rates']) if s['rates'] else None,
+                     'min_steps_per_s': min(s['rates']) if s['rates'] else None,
+                     'stalls': s['stalls']}
+            for window, s in summary.items()}
+
+
+# ========================================================
+# Command line interface
+# ========================================================
+
+def _udp_address(text):
+    host, _, port = text.rpartition(':')
+    return host or 'localhost', int(port)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m powercap.progress',
+                                     description=__doc__.split('\n\n')[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    watch_cmd = commands.add_parser('watch', help='record progress until terminated')
+    watch_cmd.add_argument('file', help='output file of the application')
+    watch_cmd.add_argument('--pattern', required=True,
+                           help=f'progress regex or one of {", ".join(PATTERNS)}')
+    watch_cmd.add_argument('--total', type=int, help='total number of steps, if not printed')
+    watch_cmd.add_argument('--output', default='progress.csv',
+                           help='time series file (default: %(default)s)')
+    watch_cmd.add_argument('--interval', type=float, default=1.0,
+                           help='polling interval in seconds (default: %(default)s)')
+    watch_cmd.add_argument('--rate-window', type=float, default=60.0,
+                           help='seconds the step rate is averaged over (default: %(default)s)')
+    watch_cmd.add_argument('--stall', type=float,
+                           help='seconds without progress after which the run is stalled')
+    watch_cmd.add_argument('--on-stall', help='shell command run on a stall')
+    watch_cmd.add_argument('--windows', help='file of time window markers')
+    watch_cmd.add_argument('--udp', type=_udp_address, metavar='HOST:PORT',
+                           help='also send the rows as JSON datagrams')
+
+    summary_cmd = commands.add_parser('summary', help='summarize a time series by window')
+    summary_cmd.add_argument('file')
+
+    args = parser.parse_args(argv)
+    if args.command == 'watch':
+        stop = threading.Event()
+        for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+            signal.signal(signum, lambda *_: stop.set())
+
+        Watcher(args.file, args.pattern, args.output, args.total, args.rate_window,
+                args.stall, args.on_stall, args.windows, args.udp).run(args.interval, stop)
+    else:
+        summary = summarize(read_progress(args.file))
+        print(tabulate([[w, s['steps'], s['mean_steps_per_s'], s['min_steps_per_s'], s['stalls']]
+                        for w, s in summary.items()],
+                       headers=['window', 'steps', 'mean steps/s', 'min steps/s', 'stalls'],
+                       floatfmt='.3g'))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,178 @@
+"""
+Binary cache of reference solutions.
+
+Reference data, e.g. the seismograms of a SPECFEM3D reference solution, is
+parsed from its source files once and stored as a NumPy array under the
+SHA-256 of the kind of data, of the contents of the source files and of the
+loader parameters:
+
+    <cache>/<key[:2]>/<key>.npy
+    <cache>/<key[:2]>/<key>.json
+
+Later checks against the same reference memory-map the array, read-only,
+instead of parsing the sources again. The digests of the sources are
+remembered by path, size and modification time in `<cache>/digests.json`, so
+that a hit only costs a `stat` of each source. Entries are written to a
+temporary file and renamed into place, so concurrent checks never see a
+partial array.
+
+    $ python -m powercap.refcache --cache $WORK/refcache list
+    $ python -m powercap.seismograms REF_SOLUTION OUTPUT_FILES --cache $WORK/refcache
+"""
+
+import argparse
+import datetime
+import hashlib
+import json
+import os
+import sys
+import time
+import uuid
+
+import numpy as np
+from filelock import FileLock
+from tabulate import tabulate
+
+
+def file_digest(path):
+    '''SHA-256 of the contents of the file at `path`.'''
+    sha = hashlib.sha256()
+    with open(path, 'rb') as fp:
+        for block in iter(lambda: fp.read(1 << 20), b''):
+            sha.update(block)
+
+    return sha.hexdigest()
+
+
+class ReferenceCache:
+    '''Directory of reference arrays keyed by the digests of their sources.'''
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+
+    def _lock(self):
+        os.makedirs(self.root, exist_ok=True)
+        return FileLock(os.path.join(self.root, '.lock'))
+
+    def _digests_file(self):
+        return os.path.join(self.root, 'digests.json')
+
+    def _read_digests(self):
+        if not os.path.exists(self._digests_file()):
+            return {}
+
+        with open(self._digests_file()) as fp:
+            return json.load(fp)
+
+    def digests(self, paths):
+        '''SHA-256 of each of `paths`, hashing only the new or modified files.'''
+        known = self._read_digests()
+        ret, new = [], {}
+        for path in paths:
+            stat = os.stat(path)
+            stamp = f'{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns}'
+            if stamp not in known:
+                new[stamp] = file_digest(path)
+
+            ret.append(known.get(stamp) or new[stamp])
+
+        if new:
+            with self._lock():
+                known = {**self._read_digests(), **new}
+                tmp = f'{self._digests_file()}.{uuid.uuid4().hex}'
+                with open(tmp, 'w') as fp:
+                    json.dump(known, fp, indent=2, sort_keys=True)
+
+                os.replace(tmp, self._digests_file())
+
+        return ret
+
+    def key(self, kind, paths, params=None):
+        sources = [[os.path.basename(p), d] for p, d in zip(paths, self.digests(paths))]
+        data = json.dumps({'kind': kind, 'sources': sources, 'params': params or {}},
+                          sort_keys=True)
+        return hashlib.sha256(data.encode()).hexdigest()
+
+    def entry_path(self, key, ext='.npy'):
+        return os.path.join(self.root, key[:2], f'{key}{ext}')
+
+    def load(self, kind, paths, loader, params=None):
+        '''Array of `loader(paths)`, memory-mapped from the cache if stored.'''
+        paths = list(paths)
+        key = self.key(kind, paths, params)
+        path = self.entry_path(key)
+        if os.path.exists(path):
+            return np.load(path, mmap_mode='r')
+
+        array = np.ascontiguousarray(loader(paths))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f'{path}.{uuid.uuid4().hex}.npy'
+        np.save(tmp, array)
+        meta = {
+            'key': key,
+            'kind': kind,
+            'sources': [os.path.abspath(p) for p in paths],
+            'params': params or {},
+            'shape': list(array.shape),
+            'dtype': str(array.dtype),
+            'size': os.path.getsize(tmp),
+            'created': time.time(),
+        }
+        with open(f'{tmp}.json', 'w') as fp:
+            json.dump(meta, fp, indent=2, sort_keys=True)
+
+        os.replace(f'{tmp}.json', self.entry_path(key, '.json'))
+        os.replace(tmp, path)
+        return np.load(path, mmap_mode='r')
+
+    def entries(self):
+        '''Metadata of all entries, oldest first.'''
+        ret = []
+        for prefix in sorted(os.listdir(self.root)) if os.path.isdir(self.root) else []:
+            if len(prefix) != 2 or not os.path.isdir(os.path.join(self.root, prefix)):
+                continue
+
+            for name in os.listdir(os.path.join(self.root, prefix)):
+                key, ext = os.path.splitext(name)
+                if ext == '.json' and os.path.exists(self.entry_path(key)):
+                    with open(self.entry_path(key, '.json')) as fp:
+                        ret.append(json.load(fp))
+
+        return sorted(ret, key=lambda m: m['created'])
+
+    def remove(self, key):
+        for ext in ('.npy', '.json'):
+            if os.path.exists(self.entry_path(key, ext)):
+                os.remove(self.entry_path(key, ext))
+
+
+# ========================================================
+# Command line interface
+# ========================================================
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m powercap.refcache',
+                                     description=__doc__.split('\n\n')[0])
+    parser.add_argument('--cache', required=True, help='cache directory')
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('list', help='list the cached references')
+    remove_cmd = commands.add_parser('remove', help='remove cached references')
+    remove_cmd.add_argument('keys', nargs='+', help='keys or key prefixes')
+
+    args = parser.parse_args(argv)
+    cache = ReferenceCache(args.cache)
+    if args.command == 'list':
+        print(tabulate([[m['key'][:12], m['kind'], 'x'.join(map(str, m['shape'])),
+                         m['size'], len(m['sources']), os.path.dirname(m['sources'][0]),
+                         datetime.datetime.fromtimestamp(m['created']).isoformat(' ', 'seconds')]
+                        for m in cache.entries()],
+                       headers=['key', 'kind', 'shape', 'bytes', 'sources', 'directory',
+                                'created']))
+    else:
+        for meta in cache.entries():
+            if any(meta['key'].startswith(k) for k in args.keys):
+                cache.remove(meta['key'])
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,151 @@
+"""
+Strong-scaling report from the performance logs.
+
+The repeats of a test case at each number of GPUs are aggregated into their
+median, interquartile range and coefficient of variation. Speedup and parallel
+efficiency are relative to the smallest number of GPUs of each series, i.e.
+of each system, partition, environment, test and cap level. For every series
+Amdahl's law, T(p) = T0 * (s + (1 - s) / p), is fitted to the median times and
+Gustafson's law, S(p) = p - a * (p - 1), to the speedups, p being the number
+of GPUs relative to the smallest one; the first number of GPUs at which the
+efficiency drops below the threshold is flagged.
+
+With an energy variable, the number of GPUs with the lowest median energy to
+solution is reported as well.
+
+    $ python -m powercap.scaling applications/fall3d/log/fall3d_raikoke_large_test_spack.log
+    $ python -m powercap.scaling applications/mini-specfem/thea_benchmark.log -v end_time_iteration_loop
+    $ python -m powercap.scaling --store perfstore -n fall3d_raikoke_large_test -E energy_to_solution
+"""
+
+import argparse
+import sys
+
+import numpy as np
+import pandas as pd
+from tabulate import tabulate
+
+from powercap import perflog
+
+
+# A strong-scaling series, over the number of GPUs
+SERIES_KEYS = ['system', 'partition', 'environ', 'test', 'cap']
+
+
+def _series(df):
+    return df.groupby(SERIES_KEYS, dropna=False)
+
+
+def _values(table, perf_var):
+    df = table if isinstance(table, pd.DataFrame) else table.to_pandas()
+    df = df[(df['perf_var'] == perf_var) & df['num_gpus'].notna()]
+    return df.assign(cap=df['cpufreq'].fillna('-'))
+
+
+def scaling_points(table, perf_var='elapsed_time', energy_var=None):
+    '''Repeat statistics, speedup and efficiency per series and number of GPUs.'''
+    df = _values(table, perf_var)
+    points = df.groupby(SERIES_KEYS + ['num_gpus'], dropna=False)['perf_value'].agg(
+        runs='size',
+        median='median',
+        q1=lambda v: v.quantile(0.25),
+        q3=lambda v: v.quantile(0.75),
+        mean='mean',
+        std='std',
+    ).reset_index()
+    points['iqr'] = points['q3'] - points['q1']
+    points['cv'] = points['std'] / points['mean']
+    points = points.drop(columns=['q1', 'q3', 'mean', 'std'])
+
+    points = points.sort_values(SERIES_KEYS + ['num_gpus'], ignore_index=True)
+    series = _series(points)
+    points['p'] = points['num_gpus'] / series['num_gpus'].transform('first')
+    points['speedup'] = series['median'].transform('first') / points['median']
+    points['efficiency'] = points['speedup'] / points['p']
+
+    if energy_var is not None:
+        energy = _values(table, energy_var)
+        energy = energy.groupby(SERIES_KEYS + ['num_gpus'], dropna=False)['perf_value'].median()
+        points = points.merge(energy.rename('energy').reset_index(),
+                              on=SERIES_KEYS + ['num_gpus'], how='left')
+
+    return points
+
+
+def scaling_fits(points, threshold=0.7):
+    '''Amdahl and Gustafson fits and efficiency limit of every series.
+
+    `points` is the output of `scaling_points()`. Both fits are closed-form
+    least squares over all series at once.
+    '''
+    pts = points.assign(
+        x=1 / points['p'],
+        y=points['median'],
+        dx=points['p'] - 1,
+        dy=points['p'] - points['speedup'],
+    )
+    pts['xy'] = pts['x'] * pts['y']
+    pts['xx'] = pts['x'] ** 2
+    pts['dxdy'] = pts['dx'] * pts['dy']
+    pts['dxdx'] = pts['dx'] ** 2
+    sums = _series(pts)[['x', 'y', 'xy', 'xx', 'dxdy', 'dxdx']].sum()
+    sums['n'] = _series(pts).size()
+
+    # Amdahl: T = a + b / p, serial fraction s = a / (a + b)
+    var = sums['xx'] - sums['x'] ** 2 / sums['n']
+    b = (sums['xy'] - sums['x'] * sums['y'] / sums['n']) / var.where(var > 0)
+    a = (sums['y'] - b * sums['x']) / sums['n']
+    fits = pd.DataFrame({'points': sums['n']})
+    fits['amdahl_serial'] = a / (a + b)
+    fits['amdahl_max_speedup'] = 1 / fits['amdahl_serial'].where(fits['amdahl_serial'] > 0)
+
+    # Gustafson: S = p - alpha * (p - 1)
+    fits['gustafson_serial'] = sums['dxdy'] / sums['dxdx'].where(sums['dxdx'] > 0)
+
+    below = points[points['efficiency'] < threshold]
+    fits['efficiency_limit'] = _series(below)['num_gpus'].min()
+    fits['max_num_gpus'] = _series(points)['num_gpus'].max()
+    if 'energy' in points:
+        best = points.loc[_series(points.dropna(subset=['energy']))['energy'].idxmin()]
+        fits['min_energy_num_gpus'] = best.set_index(SERIES_KEYS)['num_gpus']
+
+    return fits.reset_index()
+
+
+# ========================================================
+# Command line interface
+# ========================================================
+
+def _print(df):
+    print(tabulate(df, headers='keys', showindex=False, floatfmt='.4g'))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m powercap.scaling',
+                                     description=__doc__.split('\n\n')[0])
+    perflog.add_source_args(parser)
+    perflog.add_filter_args(parser)
+    parser.add_argument('-v', '--perf-var', default='elapsed_time',
+                        help='time performance variable (default: %(default)s)')
+    parser.add_argument('-E', '--energy-var',
+                        help='energy performance variable, e.g. energy_to_solution')
+    parser.add_argument('-t', '--threshold', type=float, default=0.7,
+                        help='parallel efficiency threshold (default: %(default)s)')
+
+    args = parser.parse_args(argv)
+    perf_vars = [args.perf_var] + ([args.energy_var] if args.energy_var else [])
+    table = perflog.perflogs_from_args(args, perf_var=perf_vars)
+    points = scaling_points(table, args.perf_var, args.energy_var)
+    if points.empty:
+        print(f'no {args.perf_var!r} records with a number of GPUs', file=sys.stderr)
+        return 1
+
+    fits = scaling_fits(points, args.threshold)
+    points['flag'] = np.where(points['efficiency'] < args.threshold, '<', '')
+    _print(points.drop(columns=['p']))
+    print(f'\nScaling fits (efficiency threshold {args.threshold:g})\n')
+    _print(fits)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
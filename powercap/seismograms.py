@@ -0,0 +1,222 @@
+"""
+Verification of SPECFEM3D seismograms against a reference solution.
+
+The traces are the ASCII `<network>.<station>.<channel>.semd` files, i.e. time
+and displacement columns, written by the solver to `OUTPUT_FILES`. All the
+traces of the reference are loaded, in parallel processes, stacked into one
+`(traces, samples)` array with the matching traces of the run and compared in
+one batched pass:
+
+    l2         ||u - u_ref|| / ||u_ref||
+    amplitude  |max|u| - max|u_ref|| / max|u_ref|
+    cc         peak of the normalized cross-correlation of u and u_ref
+    lag        lag of the peak, in samples
+
+The errors are relative to the largest trace of the station, as in the former
+`Check_result.py`: components that are numerical noise, e.g. the radial and
+vertical ones of LOH.1 on the strike line of its source, would otherwise get
+relative errors of order one. For the same reason the cross-correlation is
+only computed for traces of at least `CC_MIN_AMPLITUDE` of the peak of their
+station. A run passes if every trace is within the tolerances.
+
+The reference traces can be taken from a binary cache (see
+`powercap/refcache.py`), so that the repeated checks of a cap sweep do not
+parse them again.
+
+    $ python -m powercap.seismograms REF_SOLUTION OUTPUT_FILES
+    $ python -m powercap.seismograms REF_SOLUTION OUTPUT_FILES --l2 1e-4 --show all
+    $ python -m powercap.seismograms REF_SOLUTION OUTPUT_FILES --cache $WORK/refcache
+"""
+
+import argparse
+import concurrent.futures
+import glob
+import os
+import sys
+
+import numpy as np
+from tabulate import tabulate
+
+from powercap import refcache
+
+
+#: Default tolerances; `cc` is a lower bound, the others upper bounds, `lag`
+#: of its absolute value
+TOLERANCES = {'l2': 1e-3, 'amplitude': 1e-5, 'cc': 0.999, 'lag': 0}
+
+#: Traces below this fraction of the peak of their station have no `cc`
+CC_MIN_AMPLITUDE = 1e-2
+
+#: Fewer files than this are read in the calling process
+PARALLEL_THRESHOLD = 16
+
+
+def trace_files(directory, pattern='*.semd'):
+    '''`{trace name: path}` of the traces of `directory`, sorted by name.'''
+    paths = sorted(glob.glob(os.path.join(directory, pattern)))
+    return {os.path.basename(p): p for p in paths}
+
+
+def station_of(name):
+    '''`XX.STA0010` of the trace `XX.STA0010.CXY.semd`.'''
+    return '.'.join(name.split('.')[:2])
+
+
+def read_trace(path):
+    '''`(samples, 2)` array of the time and value columns of an ASCII trace.'''
+    return np.loadtxt(path, dtype=np.float64, ndmin=2)
+
+
+def load(paths, workers=None):
+    '''Times and `(traces, samples)` values of the traces at `paths`.'''
+    paths = list(paths)
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    if workers > 1 and len(paths) >= PARALLEL_THRESHOLD:
+        with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+            chunksize = max(1, len(paths) // (4 * workers))
+            traces = list(pool.map(read_trace, paths, chunksize=chunksize))
+    else:
+        traces = [read_trace(p) for p in paths]
+
+    lengths = {len(t) for t in traces}
+    if len(lengths) > 1:
+        raise ValueError(f'traces of different lengths: {sorted(lengths)}')
+
+    return traces[0][:, 0], np.stack([t[:, 1] for t in traces])
+
+
+def load_stacked(paths, workers=None):
+    '''Times followed by the values of the traces at `paths`, as one array.'''
+    times, values = load(paths, workers)
+    return np.vstack([times, values])
+
+
+def _station_max(values, stations):
+    '''Maximum of `values` over the traces of each station, per trace.'''
+    _, index = np.unique(stations, return_inverse=True)
+    peak = np.zeros(index.max() + 1)
+    np.maximum.at(peak, index, values)
+    return peak[index]
+
+
+def misfits(ref, sol, stations):
+    '''`{'l2', 'amplitude', 'cc', 'lag'}` arrays of the `(traces, samples)` arrays.'''
+    ref_norm = np.linalg.norm(ref, axis=1)
+    sol_norm = np.linalg.norm(sol, axis=1)
+    ref_peak = np.abs(ref).max(axis=1)
+    sol_peak = np.abs(sol).max(axis=1)
+
+    station_norm = _station_max(ref_norm, stations)
+    station_peak = _station_max(ref_peak, stations)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        l2 = np.linalg.norm(sol - ref, axis=1) / station_norm
+        amplitude = np.abs(sol_peak - ref_peak) / station_peak
+
+        # Cross-correlation of every pair at once, zero-padded against wrap-around
+        nsamples = ref.shape[1]
+        nfft = 1 << (2 * nsamples - 1).bit_length()
+        xcorr = np.fft.irfft(np.fft.rfft(sol, nfft) * np.conj(np.fft.rfft(ref, nfft)), nfft)
+        peak = xcorr.argmax(axis=1)
+        cc = xcorr[np.arange(len(ref)), peak] / (ref_norm * sol_norm)
+        lag = np.where(peak < nsamples, peak, peak - nfft)
+
+    small = ref_peak < CC_MIN_AMPLITUDE * station_peak
+    return {'l2': l2, 'amplitude': amplitude,
+            'cc': np.where(small, np.nan, cc), 'lag': np.where(small, 0, lag)}
+
+
+def failures(names, result, tolerances=None):
+    '''`(trace, misfit, value)` of the misfits out of `tolerances`.'''
+    tolerances = {**TOLERANCES, **(tolerances or {})}
+    failed = []
+    for i, name in enumerate(names):
+        for key in ('l2', 'amplitude'):
+            if not result[key][i] <= tolerances[key]:
+                failed.append((name, key, result[key][i]))
+
+        cc = result['cc'][i]
+        if not np.isnan(cc) and cc < tolerances['cc']:
+            failed.append((name, 'cc', cc))
+
+        if abs(result['lag'][i]) > tolerances['lag']:
+            failed.append((name, 'lag', result['lag'][i]))
+
+    return failed
+
+
+def compare(ref_dir, out_dir, pattern='*.semd', workers=None, cache=None):
+    '''Names and misfits of the traces of `out_dir` against the ones of `ref_dir`.
+
+    The reference traces are read through `cache`, a `ReferenceCache`, if given.
+    '''
+    refs = trace_files(ref_dir, pattern)
+    if not refs:
+        raise ValueError(f'no {pattern} traces in {ref_dir}')
+
+    outs = trace_files(out_dir, pattern)
+    missing = [name for name in refs if name not in outs]
+    if missing:
+        raise ValueError(f'traces missing from {out_dir}: {", ".join(missing)}')
+
+    names = list(refs)
+    if cache is not None:
+        stacked = cache.load('seismograms', refs.values(),
+                             lambda paths: load_stacked(paths, workers))
+        ref_times, ref = stacked[0], stacked[1:]
+    else:
+        ref_times, ref = load(refs.values(), workers)
+
+    times, sol = load([outs[n] for n in names], workers)
+    if ref.shape != sol.shape or not np.allclose(times, ref_times):
+        raise ValueError(f'traces of {out_dir} are not sampled as the ones of {ref_dir}')
+
+    return names, misfits(ref, sol, [station_of(n) for n in names])
+
+
+def summary(result):
+    '''Worst value of each misfit over the traces.'''
+    return {'l2': np.nanmax(result['l2']),
+            'amplitude': np.nanmax(result['amplitude']),
+            'cc': np.nanmin(result['cc']) if not np.isnan(result['cc']).all() else None,
+            'lag': int(np.abs(result['lag']).max())}
+
+
+# ========================================================
+# Command line interface
+# ========================================================
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m powercap.seismograms',
+                                     description=__doc__.split('\n\n')[0])
+    parser.add_argument('reference', help='directory of the reference traces')
+    parser.add_argument('output', help='directory of the traces of the run')
+    parser.add_argument('--pattern', default='*.semd',
+                        help='trace files to compare (default: %(default)s)')
+    parser.add_argument('--workers', type=int, help='parallel readers (default: CPUs)')
+    parser.add_argument('--cache', help='binary cache of the reference traces')
+    for key, value in TOLERANCES.items():
+        parser.add_argument(f'--{key}', type=float, default=value,
+                            help=f'tolerance of the {key} misfit (default: %(default)s)')
+
+    parser.add_argument('--show', choices=['failed', 'all'], default='failed',
+                        help='traces to list (default: %(default)s)')
+
+    args = parser.parse_args(argv)
+    cache = refcache.ReferenceCache(args.cache) if args.cache else None
+    names, result = compare(args.reference, args.output, args.pattern, args.workers, cache)
+    failed = failures(names, result, {key: getattr(args, key) for key in TOLERANCES})
+    shown = names if args.show == 'all' else sorted({name for name, *_ in failed})
+    rows = [[name, *(result[key][names.index(name)] for key in ('l2', 'amplitude', 'cc', 'lag'))]
+            for name in shown]
+    if rows:
+        print(tabulate(rows, headers=['trace', 'l2', 'amplitude', 'cc', 'lag'], floatfmt='.3g'))
+        print()
+
+    print(f'{len(names)} traces, {len(failed)} misfits out of tolerance')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
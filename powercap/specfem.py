@@ -0,0 +1,148 @@
+"""
+SPECFEM3D input files and throughput.
+
+The size of a run is read from its `DATA` directory: the number of ranks
+`NPROC` and of time steps `NSTEP` from `Par_file`, and the number of spectral
+elements of a regular mesh from `meshfem3D_files/Mesh_Par_file`, i.e.
+`NEX_XI` by `NEX_ETA` elements per layer times the top layer of its regions:
+
+    #NEX_XI_BEGIN  #NEX_XI_END  #NEX_ETA_BEGIN  #NEX_ETA_END  #NZ_BEGIN #NZ_END  #material_id
+    1              256          1               256           132       136      1
+
+Together with the time of the solver time loop this gives the element updates
+per second of a run, which compares runs of different cases and rank counts.
+
+The inputs of the pre-processing stages, `xmeshfem3D` and
+`xgenerate_databases`, are the parameters of `Par_file` but the ones only the
+solver reads, e.g. `NSTEP`, and the other files of `DATA` but the sources and
+stations; their products are cached by these inputs (see `cached_pipeline` in
+`powercap/mixins.py`).
+
+    $ python -m powercap.specfem applications/specfem3d_cartesian/loh1_256x256/DATA
+"""
+
+import argparse
+import glob
+import os
+import sys
+
+from tabulate import tabulate
+
+from powercap import refcache
+
+
+#: Parameters of `Par_file` only the solver reads, and their prefixes
+SOLVER_ONLY = ('NSTEP', 'NTSTEP_BETWEEN_', 'SAVE_SEISMOGRAMS_', 'USE_BINARY_FOR_SEISMOGRAMS',
+               'WRITE_SEISMOGRAMS_BY_MAIN', 'SAVE_ALL_SEISMOS_IN_ONE_FILE')
+
+#: Files of `DATA` only the solver reads
+SOLVER_FILES = ('CMTSOLUTION', 'FORCESOLUTION', 'STATIONS', 'STATIONS_FILTERED')
+
+
+def _lines(path):
+    '''Lines of a SPECFEM parameter file without comments and blank lines.'''
+    with open(path) as fp:
+        for line in fp:
+            line = line.split('#', 1)[0].strip()
+            if line:
+                yield line
+
+
+def read_par_file(path):
+    '''`{name: value}` of the `NAME = value` lines of a parameter file, as strings.'''
+    params = {}
+    for line in _lines(path):
+        name, sep, value = line.partition('=')
+        if sep:
+            params[name.strip()] = value.strip()
+
+    return params
+
+
+def fortran_bool(value):
+    return value.strip().lower() in ('.true.', 'true', 't')
+
+
+def mesh_regions(path):
+    '''Regions of a `Mesh_Par_file`, as tuples of their seven integers.'''
+    lines = _lines(path)
+    for line in lines:
+        name, _, value = line.partition('=')
+        if name.strip() == 'NREGIONS':
+            return [tuple(int(v) for v in next(lines).split()[:7])
+                    for _ in range(int(value))]
+
+    return []
+
+
+def mesh_elements(path):
+    '''Number of spectral elements of the mesh of a `Mesh_Par_file`.'''
+    params = read_par_file(path)
+    if not fortran_bool(params.get('USE_REGULAR_MESH', '.true.')):
+        raise ValueError(f'{path}: only regular meshes are supported')
+
+    # Regions may share their boundary layers, the top one is the last layer
+    nz = max(region[5] for region in mesh_regions(path))
+    return int(params['NEX_XI']) * int(params['NEX_ETA']) * nz
+
+
+def _digests(data_dir, paths):
+    return {os.path.relpath(p, data_dir): refcache.file_digest(p) for p in sorted(paths)}
+
+
+def mesher_inputs(data_dir):
+    '''Inputs of `xmeshfem3D`: the pre-processing parameters and the mesh files.'''
+    params = read_par_file(os.path.join(data_dir, 'Par_file'))
+    mesh_files = glob.glob(os.path.join(data_dir, 'meshfem3D_files', '**'), recursive=True)
+    return {
+        'Par_file': {name: value for name, value in params.items()
+                     if not name.startswith(SOLVER_ONLY)},
+        'meshfem3D_files': _digests(data_dir, [p for p in mesh_files if os.path.isfile(p)]),
+    }
+
+
+def databases_inputs(data_dir):
+    '''Inputs of `xgenerate_databases` besides the mesh, i.e. the model files.'''
+    mesh_dir = os.path.join(data_dir, 'meshfem3D_files')
+    files = [p for p in glob.glob(os.path.join(data_dir, '**'), recursive=True)
+             if os.path.isfile(p) and not p.startswith(mesh_dir + os.sep) and
+             os.path.basename(p) not in ('Par_file', *SOLVER_FILES)]
+    return {'DATA': _digests(data_dir, files)}
+
+
+class Case:
+    '''Size of the run of a SPECFEM3D `DATA` directory.'''
+
+    def __init__(self, data_dir):
+        self.data_dir = data_dir
+        params = read_par_file(os.path.join(data_dir, 'Par_file'))
+        self.nproc = int(params['NPROC'])
+        self.nstep = int(params['NSTEP'])
+        self.dt = float(params['DT'].lower().replace('d', 'e'))
+
+        mesh_par_file = os.path.join(data_dir, 'meshfem3D_files', 'Mesh_Par_file')
+        self.elements = mesh_elements(mesh_par_file) if os.path.exists(mesh_par_file) else None
+
+    def element_updates_per_s(self, loop_time):
+        '''Element updates per second of a solver time loop of `loop_time` seconds.'''
+        return self.elements * self.nstep / loop_time
+
+
+# ========================================================
+# Command line interface
+# ========================================================
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m powercap.specfem',
+                                     description=__doc__.split('\n\n')[0])
+    parser.add_argument('data_dir', nargs='+', help='DATA directory of a case')
+
+    args = parser.parse_args(argv)
+    cases = [Case(d) for d in args.data_dir]
+    print(tabulate([[c.data_dir, c.nproc, c.nstep, c.dt, c.elements,
+                     c.elements // c.nproc if c.elements else None] for c in cases],
+                   headers=['case', 'NPROC', 'NSTEP', 'DT', 'elements', 'elements/rank']))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
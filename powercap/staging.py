@@ -0,0 +1,266 @@
+"""
+Node-local staging of large read-only inputs.
+
+Inputs read by every rank, e.g. the meteorological NetCDF of FALL3D, are
+copied once per node from the shared file system into node-local storage
+(`/dev/shm` by default) and stored by content:
+
+    <root>/objects/<sha[:2]>/<sha>
+    <root>/index.json
+
+The index maps the path, size and modification time of a source to the
+SHA-256 of its contents, so that a source already staged on the node is
+neither read nor copied again; a new source is hashed while it is copied, in
+a single read. Identical contents under different names or paths are stored
+once. Once every node has staged them, the inputs are linked from the given
+directory to their objects; since the object path only depends on the
+contents, the same link resolves to the local copy on every node.
+
+Objects are written to a temporary file and renamed into place, under a lock,
+so that concurrent jobs on a node share them safely; beyond `--max-size` the
+least recently used objects are evicted. Every run appends a `host,files,
+copied_bytes,seconds` line to the `--report` file.
+
+    $ srun --ntasks-per-node=1 python -m powercap.staging stage $DATA/Raikoke-2019.gfs.nc --report staging.csv
+    $ python -m powercap.staging link $DATA/Raikoke-2019.gfs.nc --link-dir $PWD
+    $ python -m powercap.staging list --root /dev/shm/powercap-inputs
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import socket
+import sys
+import time
+import uuid
+
+from filelock import FileLock
+from tabulate import tabulate
+
+
+DEFAULT_ROOT = '/dev/shm/powercap-inputs'
+
+GiB = 1 << 30
+
+
+class NodeStore:
+    '''Content-addressed store of input files on the local node.'''
+
+    def __init__(self, root=DEFAULT_ROOT):
+        self.root = os.path.abspath(root)
+
+    def _lock(self):
+        os.makedirs(self.root, exist_ok=True)
+        return FileLock(os.path.join(self.root, '.lock'))
+
+    def _index_file(self):
+        return os.path.join(self.root, 'index.json')
+
+    def _read_index(self):
+        if not os.path.exists(self._index_file()):
+            return {}
+
+        with open(self._index_file()) as fp:
+            return json.load(fp)
+
+    def _write_index(self, index):
+        tmp = f'{self._index_file()}.{uuid.uuid4().hex}'
+        with open(tmp, 'w') as fp:
+            json.dump(index, fp, indent=2, sort_keys=True)
+
+        os.replace(tmp, self._index_file())
+
+    def object_path(self, digest):
+        return os.path.join(self.root, 'objects', digest[:2], digest)
+
+    @staticmethod
+    def stamp(path):
+        stat = os.stat(path)
+        return f'{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns}'
+
+    def lookup(self, path):
+        '''Object of the source at `path` if staged and complete, else None.'''
+        digest = self._read_index().get(self.stamp(path))
+        if digest is None:
+            return None
+
+        obj = self.object_path(digest)
+        if not os.path.exists(obj) or os.path.getsize(obj) != os.path.getsize(path):
+            return None
+
+        return obj
+
+    def stage(self, path):
+        '''Object holding the contents of `path`, and the number of bytes copied.'''
+        if (os.path.dirname(os.path.dirname(path)) == os.path.join(self.root, 'objects') and
+            os.path.exists(path)):
+            # Already an object of this node, e.g. the target of a link staged before
+            obj = path
+        else:
+            obj = self.lookup(path)
+
+        if obj is not None:
+            try:
+                os.utime(obj)
+            except PermissionError:
+                # Staged by another user, it is only evicted earlier
+                pass
+
+            return obj, 0
+
+        os.makedirs(os.path.join(self.root, 'objects'), exist_ok=True)
+        tmp = os.path.join(self.root, 'objects', f'.tmp-{uuid.uuid4().hex}')
+        sha = hashlib.sha256()
+        copied = 0
+        with open(path, 'rb') as src, open(tmp, 'wb') as dst:
+            for block in iter(lambda: src.read(16 << 20), b''):
+                sha.update(block)
+                dst.write(block)
+                copied += len(block)
+
+        os.chmod(tmp, 0o444)
+        obj = self.object_path(sha.hexdigest())
+        with self._lock():
+            os.makedirs(os.path.dirname(obj), exist_ok=True)
+            if os.path.exists(obj):
+                # Same contents staged under another name or concurrently
+                os.remove(tmp)
+            else:
+                os.rename(tmp, obj)
+
+            index = self._read_index()
+            index[self.stamp(path)] = sha.hexdigest()
+            self._write_index(index)
+
+        return obj, copied
+
+    def objects(self):
+        '''`(path, size, last used)` of the objects, least recently used first.'''
+        ret = []
+        top = os.path.join(self.root, 'objects')
+        for prefix in sorted(os.listdir(top)) if os.path.isdir(top) else []:
+            if len(prefix) != 2:
+                continue
+
+            for name in os.listdir(os.path.join(top, prefix)):
+                stat = os.stat(os.path.join(top, prefix, name))
+                ret.append((os.path.join(top, prefix, name), stat.st_size, stat.st_mtime))
+
+        return sorted(ret, key=lambda o: o[2])
+
+    def evict(self, max_size, keep=()):
+        '''Remove least recently used objects, but `keep`, until `max_size` bytes remain.'''
+        evicted = []
+        with self._lock():
+            objects = self.objects()
+            total = sum(size for _, size, _ in objects)
+            for path, size, _ in objects:
+                if total <= max_size:
+                    break
+
+                if path not in keep:
+                    os.remove(path)
+                    total -= size
+                    evicted.append(path)
+
+            if evicted:
+                index = self._read_index()
+                self._write_index({s: d for s, d in index.items()
+                                   if self.object_path(d) not in evicted})
+
+        return evicted
+
+
+def link(target, link_path):
+    '''Point `link_path` at `target`, replacing it atomically.'''
+    tmp = f'{link_path}.{uuid.uuid4().hex}'
+    os.symlink(target, tmp)
+    os.replace(tmp, link_path)
+
+
+def stage_inputs(paths, root=DEFAULT_ROOT, max_size=None):
+    '''Stage `paths` on this node; returns `{path: object}` and the bytes copied.
+
+    The paths are the sources of the inputs, not links shared by the nodes,
+    which may point at an object another node staged.
+    '''
+    store = NodeStore(root)
+    objects, copied = {}, 0
+    for path in paths:
+        objects[path], n = store.stage(os.path.realpath(path))
+        copied += n
+
+    if max_size is not None:
+        store.evict(max_size, keep=set(objects.values()))
+
+    return objects, copied
+
+
+def link_inputs(paths, link_dir, root=DEFAULT_ROOT):
+    '''Link the inputs staged from `paths` from `link_dir` to their objects.'''
+    store = NodeStore(root)
+    objects = {}
+    for path in paths:
+        objects[path] = store.lookup(os.path.realpath(path))
+        if objects[path] is None:
+            raise FileNotFoundError(f'{path} is not staged in {store.root}')
+
+        link(objects[path], os.path.join(link_dir, os.path.basename(path)))
+
+    return objects
+
+
+# ========================================================
+# Command line interface
+# ========================================================
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m powercap.staging',
+                                     description=__doc__.split('\n\n')[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    stage_cmd = commands.add_parser('stage', help='stage inputs on this node')
+    stage_cmd.add_argument('paths', nargs='+')
+    stage_cmd.add_argument('--root', default=DEFAULT_ROOT,
+                           help='node-local store (default: %(default)s)')
+    stage_cmd.add_argument('--max-size', type=float,
+                           help='evict objects beyond this size in GiB')
+    stage_cmd.add_argument('--report', help='CSV file to append the staging time to')
+
+    link_cmd = commands.add_parser('link', help='link staged inputs to their objects')
+    link_cmd.add_argument('paths', nargs='+')
+    link_cmd.add_argument('--root', default=DEFAULT_ROOT)
+    link_cmd.add_argument('--link-dir', required=True, help='directory to link the inputs from')
+
+    list_cmd = commands.add_parser('list', help='list the objects of this node')
+    list_cmd.add_argument('--root', default=DEFAULT_ROOT)
+
+    args = parser.parse_args(argv)
+    if args.command == 'stage':
+        start = time.time()
+        max_size = None if args.max_size is None else args.max_size * GiB
+        objects, copied = stage_inputs(args.paths, args.root, max_size)
+        elapsed = time.time() - start
+        if args.report:
+            with open(args.report, 'a') as fp:
+                fp.write(f'{socket.gethostname()},{len(objects)},{copied},{elapsed:.3f}\n')
+
+        for path, obj in objects.items():
+            print(f'{path} -> {obj}')
+    elif args.command == 'link':
+        for path, obj in link_inputs(args.paths, args.link_dir, args.root).items():
+            print(f'{os.path.join(args.link_dir, os.path.basename(path))} -> {obj}')
+    else:
+        store = NodeStore(args.root)
+        print(tabulate([[path, size, time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(used))]
+                        for path, size, used in store.objects()],
+                       headers=['object', 'bytes', 'last used']))
+        usage = shutil.disk_usage(store.root) if os.path.isdir(store.root) else None
+        if usage:
+            print(f'\n{usage.free / GiB:.1f} GiB free on {store.root}')
+
+
+if __name__ == '__main__':
+    sys.exit(main())
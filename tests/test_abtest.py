@@ -0,0 +1,49 @@
+'''Offline tests of the comparison of interleaved A/B trials.
+
+    $ python -m unittest discover tests
+'''
+
+import math
+import os
+import tempfile
+import unittest
+
+from powercap import abtest
+
+
+def write_trials(path, order, seconds):
+    '''Trials of the `(round, arm)` schedule `order`, lasting `seconds[arm] + round`.'''
+    with open(path, 'w') as fp:
+        start = 0.0
+        for r, arm in order:
+            end = start + seconds[arm] + r
+            fp.write(f'{r},{abtest.arm_name(arm)},0,{start},{end}\n')
+            start = end
+
+
+class TestCompare(unittest.TestCase):
+
+    def test_baseline_not_first_trial(self):
+        order = abtest.schedule(['baremetal', 'container'], 4, seed=3)
+        self.assertEqual(order[0][1], 'container')
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'ab_trials.csv')
+            write_trials(path, order, {'baremetal': 10.0, 'container': 11.0})
+            results = abtest.compare(abtest.read_trials(path), 'baremetal').set_index('arm')
+
+        self.assertEqual(list(results.index), ['baremetal', 'container'])
+        self.assertTrue(math.isnan(results.loc['baremetal', 'mean_diff']))
+        self.assertAlmostEqual(results.loc['container', 'mean_diff'], 1.0)
+        self.assertEqual(results.loc['container', 'pairs'], 4)
+        self.assertFalse(math.isnan(results.loc['container', 'p']))
+
+    def test_missing_baseline(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'ab_trials.csv')
+            write_trials(path, [(0, 'container')], {'container': 1.0})
+            with self.assertRaises(ValueError):
+                abtest.compare(abtest.read_trials(path), 'baremetal')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+'''Offline tests of the baselines built from the performance history.
+
+    $ python -m unittest discover tests
+'''
+
+import unittest
+
+import pandas as pd
+
+from powercap import baselines
+
+
+def history(var, unit, values):
+    '''Perflog rows of `var` taking `values` in successive passing runs.'''
+    return pd.DataFrame({
+        'system': 'thea', 'partition': 'gh', 'environ': 'default',
+        'name': 'specfem3d_small', 'perf_var': var, 'cpufreq': None,
+        'perf_value': values, 'perf_unit': unit, 'result': 'pass',
+        'timestamp': pd.date_range('2026-01-01', periods=len(values), freq='D'),
+    })
+
+
+def latest(var, unit, value):
+    df = history(var, unit, [value])
+    return df.assign(timestamp=pd.Timestamp('2027-01-01'))
+
+
+class TestBaselines(unittest.TestCase):
+
+    def setUp(self):
+        self.table = pd.concat([
+            history('solver_time', 's', [100.0, 101.0, 99.0, 100.0]),
+            history('element_updates_per_s', 'elements/s', [1e9, 1.01e9, 0.99e9, 1e9]),
+            history('seismogram_l2', '', [1e-3, 2e-3, 1e-4, 5e-4]),
+            history('time_step_count', 'count', [1000, 1000, 1000, 1000]),
+        ], ignore_index=True)
+        self.base = baselines.compute_baselines(self.table).set_index('var')
+
+    def test_direction(self):
+        self.assertTrue(pd.isna(self.base.loc['solver_time', 'lower']))
+        self.assertGreater(self.base.loc['solver_time', 'upper'], 0)
+        self.assertTrue(pd.isna(self.base.loc['element_updates_per_s', 'upper']))
+        self.assertLess(self.base.loc['element_updates_per_s', 'lower'], 0)
+
+    def test_not_baselined(self):
+        self.assertNotIn('seismogram_l2', self.base.index)
+        self.assertNotIn('time_step_count', self.base.index)
+
+    def test_compare(self):
+        tree = baselines.to_json(self.base.reset_index())
+        runs = pd.concat([
+            self.table,
+            latest('solver_time', 's', 80.0),                        # faster
+            latest('element_updates_per_s', 'elements/s', 1.2e9),   # faster
+        ], ignore_index=True)
+        status = baselines.compare(runs, baselines.from_json(tree)).set_index('var')['status']
+        self.assertEqual(status.to_dict(), {'solver_time': 'ok', 'element_updates_per_s': 'ok'})
+
+        runs = pd.concat([
+            self.table,
+            latest('solver_time', 's', 120.0),                       # slower
+            latest('element_updates_per_s', 'elements/s', 0.8e9),   # slower
+        ], ignore_index=True)
+        status = baselines.compare(runs, baselines.from_json(tree)).set_index('var')['status']
+        self.assertEqual(status.to_dict(), {'solver_time': 'FAIL',
+                                            'element_updates_per_s': 'FAIL'})
+
+    def test_references(self):
+        tree = baselines.to_json(self.base.reset_index())
+        # A file built before, with a two-sided rate and an accuracy measure
+        variables = tree['thea:gh']['default']['specfem3d_small']
+        variables['element_updates_per_s']['upper'] = 0.02
+        variables['seismogram_l2'] = {'value': 1e-3, 'lower': -0.02, 'upper': 0.02,
+                                      'unit': '', 'mad': 0, 'runs': 4}
+        refs = baselines.references(tree, 'thea:gh', 'default', 'specfem3d_small')
+        self.assertEqual(set(refs), {'solver_time', 'element_updates_per_s'})
+        self.assertIsNone(refs['solver_time'][1])
+        self.assertIsNone(refs['element_updates_per_s'][2])
+
+
+if __name__ == '__main__':
+    unittest.main()
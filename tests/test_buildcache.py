@@ -0,0 +1,57 @@
+'''Offline tests of the cache of build products.
+
+    $ python -m unittest discover tests
+'''
+
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from powercap import buildcache
+
+
+class TestBuildCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cache = buildcache.BuildCache(os.path.join(self.tmp.name, 'cache'))
+        self.build = os.path.join(self.tmp.name, 'build')
+        os.makedirs(os.path.join(self.build, 'bin'))
+        with open(os.path.join(self.build, 'bin', 'Fall3d.x'), 'w') as fp:
+            fp.write('x' * 1024)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def store(self, key, last_used):
+        self.cache.store(key, self.build, ['bin'])
+        meta = self.cache._read_meta(key)
+        meta['last_used'] = last_used
+        self.cache._write_meta(key, meta)
+
+    def test_restore_records_use_before_copy(self):
+        self.store('a' * 64, 0)
+        copytree = buildcache.shutil.copytree
+
+        def check_and_copy(*args, **kwargs):
+            self.assertGreater(self.cache._read_meta('a' * 64)['last_used'], 0)
+            return copytree(*args, **kwargs)
+
+        dst = os.path.join(self.tmp.name, 'restored')
+        with mock.patch.object(buildcache.shutil, 'copytree', check_and_copy):
+            self.assertTrue(self.cache.restore('a' * 64, dst))
+
+        self.assertTrue(os.path.isfile(os.path.join(dst, 'bin', 'Fall3d.x')))
+
+    def test_evict_keeps_recent_entries(self):
+        self.store('a' * 64, 0)
+        self.store('b' * 64, time.time())
+        self.assertEqual(self.cache.evict(0), ['a' * 64])
+        self.assertIn('b' * 64, self.cache)
+        self.assertEqual(self.cache.evict(0, grace=0), ['b' * 64])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,137 @@
+'''Offline tests of the container definitions generated from the HPCCM recipes.
+
+    $ python -m unittest discover tests
+'''
+
+import os
+import re
+import tempfile
+import unittest
+
+try:
+    import hpccm
+except ImportError:
+    hpccm = None
+
+if hpccm is not None:
+    from hpccm.building_blocks import generic_autotools
+    from hpccm.common import container_type
+
+    from powercap import clusters, containers, images, layers
+
+
+def run_recipe(app, cluster, fmt='singularity', **userarg):
+    '''`(definition, {tag: Layer})` of the recipe of `app` for `cluster`.'''
+    layers.registry.clear()
+    text = hpccm.recipe(os.path.join(containers.ROOT, containers.RECIPES[app]),
+                        ctype=containers.FORMATS[fmt][0], raise_exceptions=True,
+                        singularity_version='3.2', userarg=dict(userarg, cluster=cluster))
+    return text, dict(layers.registry)
+
+
+@unittest.skipUnless(hpccm, 'requires hpccm')
+class TestLayers(unittest.TestCase):
+
+    def test_inline_without_layers(self):
+        text, used = run_recipe('fall3d', 'thea')
+        self.assertEqual(used, {})
+        self.assertNotIn('localimage', text)
+        self.assertIn('From: nvcr.io/nvidia/nvhpc@sha256:da058394e753', text)
+        self.assertIn('hdf5-1.14.3.tar.bz2', text)
+        self.assertIn('fall3d-9.0.1.tar.gz', text)
+
+    def test_singularity_layer(self):
+        text, used = run_recipe('fall3d', 'thea', layers='/layers')
+        layer, = used.values()
+        self.assertRegex(layer.tag, r'^fall3d-netcdf-[0-9a-f]{12}$')
+        self.assertIn(f'BootStrap: localimage\nFrom: /layers/{layer.tag}.sif\nStage: devel', text)
+        # The stack is built in the layer, its environment set again on top of it
+        devel = text.split('Stage: runtime')[0]
+        self.assertNotIn('hdf5-1.14.3.tar.bz2', devel)
+        self.assertIn('hdf5-1.14.3.tar.bz2', layer.text)
+        self.assertIn('export HDF5_DIR=/opt/hdf5', devel)
+        self.assertIn('module load nvhpc-hpcx-cuda12', devel)
+        self.assertIn('fall3d-9.0.1.tar.gz', devel)
+        self.assertNotIn('fall3d-9.0.1.tar.gz', layer.text)
+        self.assertTrue(layer.text.startswith('BootStrap: docker\nFrom: nvcr.io/nvidia/nvhpc@'))
+        self.assertNotIn('Stage:', layer.text)
+        # Runtime stage still copies the libraries of the stack
+        self.assertIn('%files from devel\n    /opt/hdf5 /opt/hdf5', text)
+        # The base image of the layer is still checked against the pins of the cluster
+        digests = images.deffile_digests(text)
+        self.assertEqual(len(digests), 2)
+        images.check_pins('fall3d_thea.sif', digests, clusters.load()['thea'].pins())
+
+    def test_docker_layer(self):
+        text, used = run_recipe('fall3d', 'leonardo', fmt='docker', layers='/layers')
+        layer, = used.values()
+        self.assertIn(f'FROM {layers.DOCKER_REPOSITORY}:{layer.tag} AS devel', text)
+        self.assertIn('COPY --from=devel /opt/netcdf /opt/netcdf', text)
+        self.assertRegex(layer.text, r'^FROM nvcr.io/nvidia/nvhpc@sha256:f50d2e293b79\S*\n')
+
+    def test_key_independent_of_application(self):
+        double, (key,) = run_recipe('fall3d', 'thea', layers='/layers')
+        single, (single_key,) = run_recipe('fall3d', 'thea', layers='/layers',
+                                           fall3d_single_precision='YES')
+        self.assertNotEqual(double, single)
+        self.assertEqual(key, single_key)
+
+    def test_key_of_building_blocks(self):
+        hpccm.config.g_ctype = container_type.SINGULARITY
+        keys = set()
+        for version in ('1.0', '1.0', '1.1'):
+            layer = layers.Layer('lib', '/layers', image='ubuntu:22.04', _distro='ubuntu22')
+            layer += generic_autotools(url=f'https://example.com/lib-{version}.tar.gz',
+                                       prefix='/opt/lib')
+            layer.devel()
+            keys.add(layer.key)
+
+        self.assertEqual(len(keys), 2)
+
+    def test_shared_mpi_layer(self):
+        for cluster in ('leonardo', 'thea'):
+            _, specfem = run_recipe('specfem3d_cartesian', cluster, layers='/layers')
+            _, xshells = run_recipe('xshells-mpi', cluster, layers='/layers')
+            self.assertEqual(list(specfem), list(xshells))
+            self.assertTrue(next(iter(specfem)).startswith('openmpi-cuda-'))
+
+        _, leonardo = run_recipe('specfem3d_cartesian', 'leonardo', layers='/layers')
+        self.assertNotEqual(list(leonardo), list(specfem))
+
+
+@unittest.skipUnless(hpccm, 'requires hpccm')
+class TestGenerate(unittest.TestCase):
+
+    def test_generate(self):
+        with tempfile.TemporaryDirectory() as out:
+            generated = containers.generate(out, ['specfem3d_cartesian', 'xshells-mpi', 'xshells'],
+                                            ['thea'])
+            script = containers.build_script(out, generated)
+            self.assertEqual([(app, cluster) for app, cluster, _, _ in generated],
+                             [('specfem3d_cartesian', 'thea'), ('xshells-mpi', 'thea'),
+                              ('xshells', 'thea')])
+            tag = generated[0][3][0].tag
+            self.assertEqual(os.listdir(os.path.join(out, 'layers')), [f'{tag}.def'])
+            self.assertEqual(generated[2][3], [])
+            with open(os.path.join(out, 'xshells-mpi_thea.def')) as fp:
+                self.assertIn(f'From: {out}/layers/{tag}.sif', fp.read())
+
+            with open(script) as fp:
+                lines = fp.read().splitlines()
+
+            self.assertEqual(len([line for line in lines if f'layers/{tag}.def' in line]), 1)
+            self.assertEqual(len([line for line in lines if re.search(r'_thea\.def"\)$', line)]),
+                             3)
+
+    def test_generate_docker_without_layers(self):
+        with tempfile.TemporaryDirectory() as out:
+            generated = containers.generate(out, ['fall3d'], ['leonardo'], fmt='docker',
+                                            layered=False)
+            self.assertEqual(generated[0][3], [])
+            self.assertFalse(os.path.exists(os.path.join(out, 'layers')))
+            with open(os.path.join(out, 'fall3d_leonardo.Dockerfile')) as fp:
+                self.assertIn('hdf5-1.14.3.tar.bz2', fp.read())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,43 @@
+'''Offline tests of the decomposition of the FALL3D grid.
+
+    $ python -m unittest discover tests
+'''
+
+import glob
+import os
+import unittest
+
+from powercap import decomposition, perflog
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class TestSamples(unittest.TestCase):
+
+    def setUp(self):
+        # Their records have no executable options
+        logs = sorted(glob.glob(os.path.join(ROOT, 'applications/fall3d/log/*.log')))
+        self.assertTrue(logs)
+        self.table = perflog.read_perflogs(files=logs)
+        self.grid = decomposition.read_fall3d_grid(
+            os.path.join(ROOT, 'applications/fall3d/raikoke-2019-large/Raikoke-2019.inp'))
+
+    def check(self, samples):
+        self.assertTrue(samples)
+        for grid, dims, time in samples:
+            self.assertEqual(grid, tuple(self.grid))
+            self.assertEqual(len(dims), 3)
+            self.assertGreater(time, 0)
+
+    def test_legacy_perflogs(self):
+        self.check(decomposition.samples_from_perflogs(self.table, self.grid))
+
+    def test_missing_as_nan(self):
+        # As pandas reads missing strings with its string dtype
+        df = self.table.to_pandas().assign(executable_opts=float('nan'))
+        self.check(decomposition.samples_from_perflogs(df, self.grid))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+'''Offline tests of the verification of container images against their pins.
+
+    $ python -m unittest discover tests
+'''
+
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from powercap import images
+
+
+PINS = {'devel': 'sha256:' + 'a' * 64, 'runtime': 'sha256:' + 'b' * 64}
+
+PINNED = f'''BootStrap: docker
+From: nvcr.io/nvidia/nvhpc@sha256:{'b' * 64}
+'''
+
+UNPINNED = '''BootStrap: docker
+From: nvcr.io/nvidia/nvhpc:24.9-runtime-cuda12.6-ubuntu22.04
+'''
+
+
+class TestPins(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cache = images.ImageCache(os.path.join(self.tmp.name, 'cache'))
+        self.image = os.path.join(self.tmp.name, 'app.sif')
+        with open(self.image, 'wb') as fp:
+            fp.write(b'sif')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def add(self, deffile, **kwargs):
+        with mock.patch.object(images, 'inspect_deffile', return_value=deffile):
+            return self.cache.add(self.image, PINS, **kwargs)
+
+    def test_pinned(self):
+        self.assertEqual(self.add(PINNED)['status'], 'verified')
+
+    def test_unpinned_rejected(self):
+        with self.assertRaises(ValueError):
+            self.add(UNPINNED)
+
+        self.assertEqual(self.cache.entries(), [])
+
+    def test_unpinned_allowed(self):
+        self.assertEqual(self.add(UNPINNED, allow_unpinned=True)['status'], 'unpinned')
+        # Cached, but still rejected where unpinned images are not allowed
+        with self.assertRaises(ValueError):
+            self.add(UNPINNED)
+
+
+if __name__ == '__main__':
+    unittest.main()
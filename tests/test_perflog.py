@@ -0,0 +1,67 @@
+'''Offline tests of the columnar perflog store.
+
+    $ python -m unittest discover tests
+'''
+
+import logging
+import tempfile
+import types
+import unittest
+
+from powercap import perflog
+
+
+def record(name, seconds):
+    '''A ReFrame perflog record of a test `name` lasting `seconds`.'''
+    check = types.SimpleNamespace(
+        display_name=name, hashcode='0123abcd', num_gpus=4, num_tasks=4,
+        num_tasks_per_node=4, num_cpus_per_task=8, extra_resources={},
+        executable='Fall3d.x', executable_opts=['All', 'Raikoke-2019.inp', '2', '2', '1'],
+        job=types.SimpleNamespace(nodelist=['gh001']),
+    )
+    rec = logging.makeLogRecord({
+        'check_system': 'thea', 'check_partition': 'gh', 'check_environ': 'default',
+        'check_result': 'pass', 'check_perf_var': None,
+        'check_perfvalues': {'thea:gh:elapsed_time': (seconds, None, None, None, 's')},
+    })
+    rec.__rfm_check__ = check
+    return rec
+
+
+class TestStore(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = self.tmp.name
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_handler_writes_each_record(self):
+        handler = perflog.PerfStoreHandler(self.root)
+        handler.emit(record('fall3d_test', 10.0))
+        # Before any flush, as when the session is killed
+        table = perflog.PerflogStore(self.root).query(perf_var='elapsed_time')
+        self.assertEqual(table['perf_value'].to_pylist(), [10.0])
+
+    def test_handler_batch(self):
+        handler = perflog.PerfStoreHandler(self.root, batch_size=2)
+        handler.emit(record('fall3d_test', 10.0))
+        self.assertEqual(perflog.PerflogStore(self.root).query().num_rows, 0)
+        handler.emit(record('fall3d_test', 11.0))
+        self.assertEqual(perflog.PerflogStore(self.root).query().num_rows, 2)
+
+    def test_compact(self):
+        store = perflog.PerflogStore(self.root)
+        handler = perflog.PerfStoreHandler(self.root)
+        for seconds in (10.0, 11.0, 12.0):
+            handler.emit(record('fall3d_test', seconds))
+
+        self.assertEqual(len(store.fragments()), 3)
+        store.compact()
+        self.assertEqual(len(store.fragments()), 1)
+        self.assertEqual(sorted(store.query()['perf_value'].to_pylist()), [10.0, 11.0, 12.0])
+
+
+if __name__ == '__main__':
+    unittest.main()
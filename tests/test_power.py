@@ -0,0 +1,85 @@
+'''Offline tests of the power sampler.
+
+    $ python -m unittest discover tests
+'''
+
+import os
+import stat
+import tempfile
+import threading
+import time
+import unittest
+
+from powercap import power
+
+
+class FlakySource:
+    '''Watt values, raising in place of the `None` entries.'''
+
+    def __init__(self, values):
+        self.values = list(values)
+
+    def read(self):
+        value = self.values.pop(0) if self.values else 100.0
+        if value is None:
+            raise OSError('sensor unavailable')
+
+        return value
+
+
+# Stand-in for `nvidia-smi --query-gpu=index,power.draw --loop-ms`, with two GPUs
+NVIDIA_SMI = '''#!/bin/sh
+echo "0, 100.0"
+echo "1, 50.0"
+while true; do
+    echo "0, 100.0"
+    echo "1, [N/A]"
+    sleep 0.01
+    echo "0, 100.0"
+    echo "1, 50.0"
+    sleep 0.01
+done
+'''
+
+
+class TestSampler(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.buffer = power.RingBuffer.create(os.path.join(self.tmp.name, 'power.bin'), 64)
+
+    def tearDown(self):
+        self.buffer.close()
+        self.tmp.cleanup()
+
+    def sample(self, source, seconds):
+        stop = threading.Event()
+        sampler = threading.Thread(target=power.run_sampler,
+                                   args=(source, self.buffer, 0.01, stop))
+        sampler.start()
+        time.sleep(seconds)
+        stop.set()
+        sampler.join()
+
+    def test_failed_reads_are_skipped(self):
+        with self.assertLogs('powercap.power', 'WARNING') as logs:
+            self.sample(FlakySource([10.0, None, None, 20.0]), 0.2)
+
+        self.assertEqual([w for _, w in self.buffer.samples()][:2], [10.0, 20.0])
+        self.assertEqual(len(logs.records), 2)
+
+    def test_nvidia_smi_stream(self):
+        command = os.path.join(self.tmp.name, 'nvidia-smi')
+        with open(command, 'w') as fp:
+            fp.write(NVIDIA_SMI)
+
+        os.chmod(command, os.stat(command).st_mode | stat.S_IXUSR)
+        source = power.make_source(f'nvidia-smi:{command}')
+        self.sample(source, 0.3)
+        self.assertGreater(self.buffer.count, 0)
+        self.assertEqual({w for _, w in self.buffer.samples()}, {150.0})
+        self.assertIsNotNone(source._process.poll())
+
+
+if __name__ == '__main__':
+    unittest.main()
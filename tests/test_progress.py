@@ -0,0 +1,51 @@
+'''Offline tests of the progress sidecar.
+
+    $ python -m unittest discover tests
+'''
+
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+from powercap import progress
+
+
+class TestStall(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.out = os.path.join(self.tmp.name, 'rfm_job.out')
+        self.windows = os.path.join(self.tmp.name, 'power_window.txt')
+        self.csv = os.path.join(self.tmp.name, 'progress.csv')
+        with open(self.out, 'w') as fp:
+            fp.write('staging inputs\n')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def watch(self, seconds):
+        watcher = progress.Watcher(self.out, 'specfem', self.csv, stall=0.2,
+                                   windows=self.windows)
+        stop = threading.Event()
+        sidecar = threading.Thread(target=watcher.run, args=(0.02, stop))
+        sidecar.start()
+        time.sleep(seconds)
+        stop.set()
+        sidecar.join()
+        return [row['event'] for row in progress.read_progress(self.csv)]
+
+    def test_not_armed_before_run(self):
+        # The pre-run commands take longer than the stall time
+        self.assertNotIn('stall', self.watch(0.5))
+
+    def test_armed_by_run_window(self):
+        with open(self.windows, 'w') as fp:
+            fp.write(f'run start {time.time()}\n')
+
+        self.assertIn('stall', self.watch(0.5))
+
+
+if __name__ == '__main__':
+    unittest.main()